@@ -0,0 +1,79 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)  # Benchmarks import the node modules from the repository root
+
+
+def environment():
+    """Where the numbers came from, so results from different machines and commits are not mixed up."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count()
+    }
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, round(fraction * len(sorted_values) + 0.5))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def latency_summary(latencies, elapsed):
+    """p50/p90/p99/max in milliseconds and throughput for a list of per-request seconds."""
+    values = sorted(latencies)
+    ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        "requests": len(values),
+        "throughput_per_sec": round(len(values) / elapsed, 1) if elapsed else None,
+        "p50_ms": ms(percentile(values, 0.50)),
+        "p90_ms": ms(percentile(values, 0.90)),
+        "p99_ms": ms(percentile(values, 0.99)),
+        "max_ms": ms(values[-1] if values else None)
+    }
+
+
+def credit(db, addresses, coins):
+    """
+    Funds addresses in a throwaway database with one reward transfer each,
+    through the normal ledger path so every balance has its transaction row.
+    """
+    from database import NETWORK
+    rewards = [{"sender": NETWORK, "recipient": address, "amount": coins, "height": i} for i, address in enumerate(addresses)]
+    if not all(result["accepted"] for result in db.add_transactions_bulk(rewards)):
+        raise RuntimeError("could not fund benchmark addresses")
+
+
+def timed(fn, repeat):
+    """Calls fn() `repeat` times and returns the elapsed seconds."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return time.perf_counter() - start
+
+
+def emit(suite, results, output=None):
+    """Prints the results as JSON and writes them to `output` if given."""
+    report = {"suite": suite, "environment": environment(), "results": results}
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+    return report
@@ -0,0 +1,172 @@
+"""
+HTTP load generator for /add_transaction, /get_balance and /mine. By default
+it starts a throwaway node on the loopback interface, so no network or
+running node is needed; pass --url to load an existing node instead.
+
+    python -m bench.load [--concurrency 16] [--requests 2000] [--output results.json]
+"""
+import argparse
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from bench.common import emit, latency_summary
+from bench.micro import make_wallet
+
+POLL_INTERVAL = 0.05  # Seconds between mining job status checks
+
+
+class LoadClient:
+    """Issues requests from a thread pool, one keep-alive session per thread, and records latencies."""
+
+    def __init__(self, url, concurrency, timeout=30):
+        self.url = url.rstrip("/")
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.mount("http://", HTTPAdapter(pool_maxsize=2))
+        return session
+
+    def request(self, method, path, **kwargs):
+        return self.session().request(method, f"{self.url}{path}", timeout=self.timeout, **kwargs)
+
+    def run(self, jobs):
+        """
+        Runs each job (a callable returning True on success) on the pool and
+        returns the latency summary plus error count.
+        """
+        latencies = []
+        errors = 0
+        lock = threading.Lock()
+
+        def timed_job(job):
+            nonlocal errors
+            start = time.perf_counter()
+            try:
+                ok = job()
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                errors += not ok
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            list(executor.map(timed_job, jobs))
+        summary = latency_summary(latencies, time.perf_counter() - start)
+        summary["errors"] = errors
+        summary["concurrency"] = self.concurrency
+        return summary
+
+
+def start_local_node(directory, difficulty):
+    """Serves a fresh writer node on 127.0.0.1 in this process. Returns (url, node state, server)."""
+    from werkzeug.serving import make_server
+    from node import create_app
+
+    app = create_app(db_name=os.path.join(directory, "load.db"))
+    state = app.extensions["fartchan"]
+    state.blockchain.difficulty = difficulty
+    state.blockchain.adjust_difficulty = lambda: None  # Keep every block at the requested difficulty
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-node", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", state, server
+
+
+def mine_job(client, miner):
+    """Queues a mining job and waits for it; the latency is submission to finished block."""
+    def job():
+        response = client.request("POST", "/mine", json={"miner": miner})
+        if response.status_code != 202:
+            return False
+        job_id = response.json()["job_id"]
+        while True:
+            status = client.request("GET", f"/mine/{job_id}").json().get("status")
+            if status not in ("queued", "running"):
+                return status == "done"
+            time.sleep(POLL_INTERVAL)
+    return job
+
+
+def fund(client, state, wallets, amount):
+    """Gives every wallet a confirmed balance by mining a block for it, in-process on a local node."""
+    if state is not None:
+        blockchain = state.blockchain
+        for wallet in wallets:
+            # A reward of `amount` coins; the block is real, so the node's ledger still matches its chain
+            tip = blockchain.chain[-1]
+            if not blockchain.create_block(blockchain.proof_of_work(tip["proof"]), blockchain.hash(tip),
+                                           wallet.public_key.to_string().hex(), amount):
+                raise RuntimeError("could not mine funding blocks on the local node")
+        return
+    for wallet in wallets:
+        if not mine_job(client, wallet.public_key.to_string().hex())():
+            raise RuntimeError("could not mine funding blocks on the target node")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate HTTP load against a FARTCHAN node.")
+    parser.add_argument("--url", help="node to load (default: start a throwaway node on 127.0.0.1)")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per transaction and balance phase")
+    parser.add_argument("--mine-jobs", type=int, default=10, help="mining jobs in the /mine phase")
+    parser.add_argument("--difficulty", type=int, default=3, help="difficulty of the throwaway node's blocks")
+    parser.add_argument("--wallets", type=int, default=20, help="sending wallets")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    # Per-request INFO logs would dominate the timings
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as directory:
+        url, state, server = start_local_node(directory, args.difficulty) if not args.url else (args.url, None, None)
+        client = LoadClient(url, args.concurrency)
+        try:
+            wallets = [make_wallet() for _ in range(args.wallets)]
+            addresses = [wallet.public_key.to_string().hex() for wallet in wallets]
+            fund(client, state, wallets, 1000)
+
+            # Sign everything up front so the timings only cover the node
+            signed = [
+                wallets[i % len(wallets)].sign_transaction(addresses[(i + 1) % len(wallets)], 0.001, fee=0.0001, nonce=i)
+                for i in range(args.requests)
+            ]
+            results = {"target": "local" if state is not None else url}
+            results["add_transaction"] = client.run(
+                [lambda tx=tx: client.request("POST", "/add_transaction", json=tx).status_code == 200 for tx in signed]
+            )
+            results["get_balance"] = client.run(
+                [lambda i=i: client.request("GET", "/get_balance", params={"address": addresses[i % len(addresses)]}).ok
+                 for i in range(args.requests)]
+            )
+            results["mine"] = LoadClient(url, min(args.concurrency, args.mine_jobs)).run(
+                [mine_job(client, f"bench-miner-{i}") for i in range(args.mine_jobs)]
+            )
+
+            # Balance reads while blocks are being produced
+            miners = threading.Thread(target=LoadClient(url, 2).run,
+                                      args=([mine_job(client, f"bench-miner-bg-{i}") for i in range(args.mine_jobs)],))
+            miners.start()
+            results["get_balance_while_mining"] = client.run(
+                [lambda i=i: client.request("GET", "/get_balance", params={"address": addresses[i % len(addresses)]}).ok
+                 for i in range(args.requests)]
+            )
+            miners.join()
+        finally:
+            if server is not None:
+                server.shutdown()  # Scheduler and sync threads are daemons and end with the process
+        emit("load", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
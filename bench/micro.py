@@ -0,0 +1,151 @@
+"""
+In-process micro-benchmarks: proof-of-work hash rate, block hashing and
+Merkle cost by transaction count, and ledger operations. Everything runs
+against a throwaway database; no node or network is needed.
+
+    python -m bench.micro [--quick] [--output results.json]
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+from ecdsa import SigningKey, SECP256k1
+from bench.common import credit, emit, timed
+from blockchain import Blockchain, GENESIS_TIMESTAMP
+from database import Database
+from merkle import hash_transaction, merkle_root
+from mining import ParallelMiner, SerialMiner
+from wallet import Wallet
+
+
+def make_wallet():
+    """A signing wallet that is not written to disk or registered anywhere."""
+    wallet = Wallet.__new__(Wallet)
+    wallet.private_key = SigningKey.generate(curve=SECP256k1)
+    wallet.public_key = wallet.private_key.get_verifying_key()
+    return wallet
+
+
+def bench_proof_of_work(directory, difficulties, rounds):
+    """Hashes per second of Blockchain.proof_of_work, serial and multi-core, at each difficulty."""
+    results = []
+    engines = [("serial", SerialMiner())]
+    if (os.cpu_count() or 1) > 1:
+        engines.append(("parallel", ParallelMiner()))
+    for name, miner in engines:
+        blockchain = Blockchain(miner=miner, db=Database(os.path.join(directory, f"pow-{name}.db")))
+        try:
+            for difficulty in difficulties:
+                blockchain.difficulty = difficulty
+                last_proof, hashes = 100, 0
+                start = time.perf_counter()
+                for _ in range(rounds):
+                    proof = blockchain.proof_of_work(last_proof)
+                    hashes += proof + 1  # Nonces are tried from 0 up to the proof
+                    last_proof = proof
+                elapsed = time.perf_counter() - start
+                results.append({
+                    "engine": name,
+                    "difficulty": difficulty,
+                    "rounds": rounds,
+                    "hashes": hashes,
+                    "seconds": round(elapsed, 4),
+                    "hashes_per_sec": round(hashes / elapsed),
+                    "seconds_per_block": round(elapsed / rounds, 6)
+                })
+        finally:
+            miner.close()
+    return results
+
+
+def bench_block_hash(directory, sizes, repeat):
+    """Cost of Blockchain.hash and of the Merkle root that commits a block's transactions."""
+    blockchain = Blockchain(miner=SerialMiner(), db=Database(os.path.join(directory, "hash.db")))
+    wallet = make_wallet()
+    recipient = make_wallet().public_key.to_string().hex()
+    signed = [wallet.sign_transaction(recipient, 1, fee=0.001, nonce=i) for i in range(max(sizes))]
+
+    results = []
+    for size in sizes:
+        transactions = signed[:size]
+        tx_hashes = [hash_transaction(tx) for tx in transactions]
+        block = {
+            "index": 2,
+            "timestamp": GENESIS_TIMESTAMP,
+            "transactions": transactions,
+            "proof": 12345,
+            "previous_hash": "0" * 64,
+            "merkle_root": merkle_root(tx_hashes),
+            "difficulty": 4
+        }
+        hash_seconds = timed(lambda: blockchain.hash(block), repeat)
+        root_repeat = max(1, repeat // max(size, 1))
+        root_seconds = timed(lambda: merkle_root([hash_transaction(tx) for tx in transactions]), root_repeat)
+        results.append({
+            "transactions": size,
+            "hash_us": round(hash_seconds / repeat * 1e6, 2),
+            "merkle_root_us": round(root_seconds / root_repeat * 1e6, 2)
+        })
+    return results
+
+
+def bench_database(directory, operations):
+    """Ledger throughput: cached and uncached balance reads, single transfers and bulk batches."""
+    results = {}
+    senders = [f"sender-{i}" for i in range(100)]
+
+    for cache_size, label in ((100_000, "get_balance_cached"), (0, "get_balance_uncached")):
+        db = Database(os.path.join(directory, f"{label}.db"), balance_cache_size=cache_size)
+        credit(db, senders, 10)
+        seconds = timed(lambda: [db.get_balance(sender) for sender in senders], operations // len(senders))
+        count = operations // len(senders) * len(senders)
+        results[label] = {"operations": count, "ops_per_sec": round(count / seconds)}
+
+    batch = [{"sender": senders[i % len(senders)], "recipient": senders[(i + 1) % len(senders)], "amount": 1, "nonce": i}
+             for i in range(operations)]
+
+    db = Database(os.path.join(directory, "single.db"))
+    credit(db, senders, operations)
+    start = time.perf_counter()
+    for transfer in batch:
+        db.add_transactions_bulk([transfer])
+    seconds = time.perf_counter() - start
+    results["add_transactions_single"] = {"operations": operations, "ops_per_sec": round(operations / seconds)}
+
+    db = Database(os.path.join(directory, "bulk.db"))
+    credit(db, senders, operations)
+    start = time.perf_counter()
+    accepted = sum(result["accepted"] for result in db.add_transactions_bulk(batch))
+    seconds = time.perf_counter() - start
+    results["add_transactions_bulk"] = {"operations": operations, "accepted": accepted,
+                                        "ops_per_sec": round(operations / seconds)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run FARTCHAN micro-benchmarks.")
+    parser.add_argument("--quick", action="store_true", help="smaller workloads, for a fast smoke run")
+    parser.add_argument("--difficulty", type=int, action="append", help="PoW difficulty to measure (repeatable)")
+    parser.add_argument("--rounds", type=int, help="blocks mined per difficulty")
+    parser.add_argument("--operations", type=int, help="database operations per measurement")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)  # Per-operation INFO logs would dominate the timings
+    difficulties = args.difficulty or ([1, 2, 3] if args.quick else [1, 2, 3, 4, 5])
+    rounds = args.rounds or (3 if args.quick else 10)
+    operations = args.operations or (1000 if args.quick else 10_000)
+    sizes = [0, 1, 10, 100] if args.quick else [0, 1, 10, 100, 1000]
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = {
+            "proof_of_work": bench_proof_of_work(directory, difficulties, rounds),
+            "block_hash": bench_block_hash(directory, sizes, 2000 if args.quick else 20_000),
+            "database": bench_database(directory, operations)
+        }
+    emit("micro", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
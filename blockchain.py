@@ -1,83 +1,447 @@
-import hashlib
-import json
+import logging
+import threading
 import time
-from database import Database
+from collections import OrderedDict
+from codec import decode_block, encode_block
+from database import LEDGER_TIP_KEY, NETWORK, TX_IDS_KEY, Database, from_units, to_units, transaction_units, transfer_nonce
+from headers import block_hash, block_target, difficulty_to_target, valid_proof
+from mempool import Mempool
+from merkle import hash_transaction, merkle_root
+from metrics import Counter, Gauge, Histogram, timed
+from mining import create_miner
+from retarget import MAX_TARGET, Retarget, target_difficulty, target_to_hex
+from signatures import transaction_id
+
+POW_HASHES = Counter("fartchan_pow_hashes_total", "Nonces tried by successful proof-of-work searches.")
+POW_SECONDS = Histogram("fartchan_pow_seconds", "Time to find a proof of work.")
+POW_HASH_RATE = Gauge("fartchan_pow_hash_rate", "Hashes per second of the last successful proof-of-work search.")
+BLOCK_SECONDS = Histogram("fartchan_create_block_seconds", "Time to assemble, apply and store a mined block.")
+CHAIN_PREFIX_KEY = "chain_prefix"  # Meta: headers and work below the base of a chain bootstrapped from a snapshot
+
+class Chain:
+    """
+    List-like view of the stored chain. Only the tip is loaded on startup;
+    older blocks are read from storage on demand and kept in an LRU cache of
+    compact binary encodings, decoded on access. Index 0 is the genesis block (height 1), and negative indexes count from the tip.
+
+    A chain bootstrapped from a snapshot stores no blocks below its base (the
+    snapshot block). Its `prefix` keeps the retarget window of headers under
+    the base and the work of every block before it.
+    """
+
+    def __init__(self, store, hash_block, cache_size=256, prefix=None):
+        self.store = store
+        self.hash_block = hash_block
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # height -> encoded block, least recently used first
+        self._lock = threading.Lock()
+        self._work = None  # Total proof-of-work, computed on first use
+        self._prefix = prefix or {"headers": [], "work": 0}
+        self.base = store.load_base() or 1  # Height of the lowest stored block
+        tip = store.load_tip()
+        self._length = tip["index"] if tip else 0
+        self._tip_hash = hash_block(tip) if tip else None
+        if tip:
+            self._remember(tip)
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def tip_hash(self):
+        """Hash of the tip block, without loading it."""
+        return self._tip_hash
+
+    def __iter__(self):
+        for height in range(self.base, self._length + 1):
+            yield self.get(height)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self._length))]
+        if i < 0:
+            i += self._length
+        if not 0 <= i < self._length:
+            raise IndexError("chain index out of range")
+        return self.get(i + 1)
+
+    def get(self, height):
+        """Return the block at a 1-based height, loading it from storage if needed."""
+        with self._lock:
+            data = self._cache.get(height)
+            if data is not None:
+                self._cache.move_to_end(height)
+        if data is not None:
+            return decode_block(data)
+        block = self.store.load_block(height)
+        if block is None:
+            raise IndexError(f"block {height} is not stored")
+        with self._lock:
+            self._remember(block)
+        return block
+
+    def append(self, block):
+        """Persist a block on top of the tip."""
+        if block["index"] != self._length + 1:
+            raise ValueError(f"expected block {self._length + 1}, got {block['index']}")
+        if not self.store.save_block(block, self.hash_block(block)):
+            raise RuntimeError(f"failed to store block {block['index']}")
+        with self._lock:
+            self._remember(block)
+            self._length = block["index"]
+            self._tip_hash = self.hash_block(block)
+            if self._work is not None:
+                self._work += block_work(block)
+
+    def replace(self, height, removed, blocks):
+        """Take on `blocks`, already committed to the store above a height in place of `removed`."""
+        with self._lock:
+            for block in removed:
+                self._cache.pop(block["index"], None)
+                if self._work is not None:
+                    self._work -= block_work(block)
+            for block in blocks:
+                self._remember(block)
+                if self._work is not None:
+                    self._work += block_work(block)
+            self._length = blocks[-1]["index"] if blocks else height
+            self._tip_hash = self.hash_block(blocks[-1]) if blocks else self.hash_block(self.store.load_block(height))
+
+    def rebase(self, block, prefix):
+        """
+        Replace the stored chain with a single block above genesis, as a node
+        bootstrapped from a snapshot starts. `prefix` holds the retarget
+        window of headers below the block and the work of the blocks before it.
+        """
+        self.truncate(0)
+        if not self.store.save_block(block, self.hash_block(block)):
+            raise RuntimeError(f"failed to store block {block['index']}")
+        with self._lock:
+            self._prefix = prefix
+            self.base = block["index"]
+            self._remember(block)
+            self._length = block["index"]
+            self._tip_hash = self.hash_block(block)
+            self._work = None
+
+    def truncate(self, height):
+        """Delete every block above a height and return them, lowest first."""
+        removed = self[max(height, self.base - 1):]
+        if removed and not self.store.delete_blocks_from(height + 1):
+            raise RuntimeError(f"failed to delete blocks above {height}")
+        with self._lock:
+            for block in removed:
+                self._cache.pop(block["index"], None)
+                if self._work is not None:
+                    self._work -= block_work(block)
+            self._length = min(self._length, height)
+            if removed:
+                self._tip_hash = self.hash_block(self.store.load_block(height)) if height else None
+        return removed
+
+    def refresh(self):
+        """
+        Pick up blocks another process wrote to the shared store. Costs one
+        indexed lookup; the cache is only dropped if the tip moved. Returns
+        True if it did.
+        """
+        tip = self.store.load_tip_header()
+        length, tip_hash = (tip["index"], tip["hash"]) if tip else (0, None)
+        with self._lock:
+            if length == self._length and tip_hash == self._tip_hash:
+                return False
+            self._cache.clear()
+            self._length = length
+            self._tip_hash = tip_hash
+            self._work = None
+        return True
+
+    def load_headers(self, start, end):
+        """Headers with start <= height <= end, each with its hash; those below the base come from the prefix."""
+        headers = [header for header in self._prefix["headers"] if start <= header["index"] <= min(end, self.base - 1)]
+        return headers + self.store.load_headers(max(start, self.base), end)
+
+    def work(self):
+        """Total expected hashes behind the chain."""
+        if self._work is None:
+            work = self._prefix["work"] if self.base > 1 else 0
+            for start in range(self.base, self._length + 1, 5000):
+                work += sum(block_work(header) for header in self.store.load_headers(start, start + 4999))
+            self._work = work
+        return self._work
+
+    def _remember(self, block):
+        self._cache[block["index"]] = encode_block(block)
+        self._cache.move_to_end(block["index"])
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+# Fixed so that every node starts from the same genesis block and can sync with peers
+GENESIS_TIMESTAMP = "1740787200.0"
+
+def genesis_block():
+    """The genesis block every chain starts from."""
+    return {
+        "index": 1,
+        "timestamp": GENESIS_TIMESTAMP,
+        "transactions": [],
+        "proof": 100,
+        "previous_hash": "0",
+        "merkle_root": merkle_root([])
+    }
+
+def block_work(header):
+    """Expected number of hashes needed to mine a block at its recorded target."""
+    target = block_target(header)
+    return (MAX_TARGET + 1) // (target + 1) if target is not None else 1
 
 class Blockchain:
-    def __init__(self):
-        self.chain = []
-        self.transactions = []
-        self.difficulty = 4  # Adjustable difficulty
-        self.block_time_target = 10  # Target time per block in seconds
-        self.db = Database()
-        self.create_genesis_block()
+    def __init__(self, miner=None, db=None, store=None, retarget=None):
+        self.mempool = Mempool()
+        self.max_block_transactions = 1000  # Upper bound on transactions per block
+        self.retarget = retarget or Retarget()  # Picks the target of the next block from recent block times
+        self.target = None  # 256-bit target the next block's proof must meet
+        self.db = db or Database()
+        # Blocks live in SQLite unless a BlockStore is given
+        self.chain = Chain(store if store is not None else self.db, self.hash, prefix=self.db.get_meta(CHAIN_PREFIX_KEY))
+        self.miner = miner or create_miner()  # Pluggable proof-of-work engine
+        self.block_listeners = []  # Callables notified with every new block
+        self.transaction_listeners = []  # Callables notified with the hash of every transaction the mempool accepts
+        self.lock = threading.RLock()  # Guards changes to the chain and the ledger it drives
+        if not self.chain:
+            self.create_genesis_block()
+        elif self.chain.store is not self.db:
+            self._reconcile_store()
+        if not self.db.get_meta(TX_IDS_KEY):
+            self._rekey_transactions()
+        self.adjust_difficulty()
+
+    @property
+    def block_store(self):
+        """The BlockStore blocks are kept in, or None when they live in the database with the ledger."""
+        return self.chain.store if self.chain.store is not self.db else None
+
+    def _reconcile_store(self):
+        """
+        Drop blocks a crash left in the BlockStore after they were written but
+        before the ledger transaction committing them (see Database.add_block).
+        """
+        tip = self.db.get_meta(LEDGER_TIP_KEY)
+        if not tip or tip["height"] >= len(self.chain):
+            return
+        if self.hash(self.chain.store.load_block(tip["height"])) != tip["hash"]:
+            logging.error(f"Block store does not match the ledger tip at height {tip['height']}")
+            return
+        logging.warning(f"Dropping blocks above {tip['height']} that the ledger never committed")
+        self.chain.truncate(tip["height"])
+
+    def _rekey_transactions(self):
+        """One-time move of a ledger keyed by whole-dict hashes to transaction ids (see Database.rekey_transactions)."""
+        def keys():
+            for start in range(self.chain.base, len(self.chain) + 1, 500):
+                for block in self.chain.store.load_blocks(start, start + 499):
+                    for tx in block["transactions"]:
+                        yield hash_transaction(tx), transaction_id(tx), transfer_nonce(tx)
+        if not self.db.rekey_transactions(keys()):
+            raise RuntimeError("failed to re-key the ledger by transaction id")
 
     def create_genesis_block(self):
         """Creates the genesis block."""
-        genesis_block = {
-            "index": 1,
-            "timestamp": str(time.time()),
-            "transactions": [],
-            "proof": 100,
-            "previous_hash": "0"
-        }
-        self.chain.append(genesis_block)
-
-    def add_transaction(self, sender, recipient, amount):
-        """
-        Adds a transaction to the list of pending transactions.
-        Does NOT require a signature in this version.
-        """
-        # Prevent spending more than available (unless sender is "Network")
-        if sender != "Network" and self.db.get_balance(sender) < int(amount):
-            return False
-        self.transactions.append({
-            "sender": sender,
-            "recipient": recipient,
-            "amount": amount
-        })
-        self.db.add_transaction(sender, recipient, amount)
-        return True
+        try:
+            self.chain.append(genesis_block())
+        except RuntimeError:
+            # Another process sharing the database stored the (identical) genesis block first
+            self.chain.refresh()
+
+    def add_transaction(self, tx):
+        """
+        Adds a transaction to the mempool of pending transactions.
+        Signatures are verified by the node before transactions reach this point.
+        Returns (tx_hash, None) if accepted or (None, error) if rejected.
+        """
+        error = self._check_transaction(tx)
+        if error:
+            return None, error
+
+        # Keyed by the signed content, so a re-encoded signature is still the same transaction
+        tx_hash = transaction_id(tx)
+        # Under the chain lock so a block cannot confirm or drop pending spends between the checks
+        with self.lock:
+            if self.db.has_transaction(tx_hash):
+                return None, "Duplicate transaction"
+            if "nonce" in tx and self.db.has_nonce(tx["sender"], tx["nonce"]):
+                return None, "Duplicate nonce"
+            # Pending spends are checked against the confirmed balance
+            tx_hash, error = self.mempool.add(tx, self.db.get_balance(tx["sender"]), tx_hash)
+        if tx_hash:
+            for listener in self.transaction_listeners:
+                listener(tx_hash)
+        return tx_hash, error
+
+    def add_transactions(self, txs):
+        """
+        Adds a batch of verified transactions to the mempool, in order, as
+        add_transaction does for one: confirmed ids, confirmed nonces and
+        balances are each looked up for the whole batch in one query, and the
+        mempool admits it under one lock. Returns one (tx_hash, error) per transaction.
+        """
+        results = [(None, self._check_transaction(tx)) for tx in txs]
+        candidates = [(i, tx, transaction_id(tx)) for i, tx in enumerate(txs) if results[i][1] is None]
+        with self.lock:
+            confirmed = self.db.confirmed_ids(tx_hash for _, _, tx_hash in candidates)
+            nonces = self.db.confirmed_nonces({(tx["sender"], tx["nonce"]) for _, tx, _ in candidates if "nonce" in tx})
+            balances = self.db.get_balances({tx["sender"] for _, tx, _ in candidates})
+            admit = []
+            for i, tx, tx_hash in candidates:
+                if tx_hash in confirmed:
+                    results[i] = None, "Duplicate transaction"
+                elif "nonce" in tx and (tx["sender"], tx["nonce"]) in nonces:
+                    results[i] = None, "Duplicate nonce"
+                else:
+                    admit.append((i, tx, tx_hash))
+            # Pending spends are checked against the confirmed balance
+            admitted = self.mempool.add_batch([(tx, balances.get(tx["sender"], 0), tx_hash) for _, tx, tx_hash in admit])
+            for (i, _, _), result in zip(admit, admitted):
+                results[i] = result
+        for tx_hash, _ in results:
+            if tx_hash:
+                for listener in self.transaction_listeners:
+                    listener(tx_hash)
+        return results
 
-    def proof_of_work(self, last_proof):
-        """Performs Proof-of-Work mining."""
-        proof = 0
-        while not self.is_valid_proof(last_proof, proof):
-            proof += 1
+    @staticmethod
+    def _check_transaction(tx):
+        """Shape checks that need no ledger lookup. Returns an error, or None."""
+        amount = to_units(tx.get("amount"))
+        fee = to_units(tx.get("fee", 0))
+        if amount is None or amount <= 0 or fee is None or fee < 0:
+            return "Invalid transaction amount"
+        if "nonce" in tx and (not isinstance(tx["nonce"], int) or isinstance(tx["nonce"], bool)):
+            return "Invalid nonce"
+        if tx.get("sender") == NETWORK:
+            return "Reward transactions are created by miners only"
+        return None
+
+    def proof_of_work(self, last_proof, cancel=None):
+        """
+        Performs Proof-of-Work mining and returns the smallest valid proof.
+        Returns None if the optional cancel event is set before a proof is found.
+        """
+        start = time.perf_counter()
+        proof = self.miner.mine(last_proof, self.target.to_bytes(32, "big"), cancel)
+        if proof is not None:
+            # Nonces are searched upwards from 0; parallel engines may try a few chunks past the proof
+            elapsed = time.perf_counter() - start
+            POW_HASHES.inc(proof + 1)
+            POW_SECONDS.observe(elapsed)
+            POW_HASH_RATE.set(round((proof + 1) / elapsed) if elapsed else 0)
         return proof
 
     def is_valid_proof(self, last_proof, proof):
-        guess = f"{last_proof}{proof}".encode()
-        guess_hash = hashlib.sha256(guess).hexdigest()
-        return guess_hash[:self.difficulty] == "0" * self.difficulty
+        return valid_proof(last_proof, proof, self.target)
+
+    @property
+    def difficulty(self):
+        """The current target as a number of leading hex zeros (fractional), for display."""
+        return round(target_difficulty(self.target), 2)
+
+    @difficulty.setter
+    def difficulty(self, difficulty):
+        self.target = int.from_bytes(difficulty_to_target(difficulty), "big")
 
     def adjust_difficulty(self):
-        """Adjusts the mining difficulty based on the time taken to mine the last block."""
-        if len(self.chain) < 2:
-            return
-        last_time = float(self.chain[-1]['timestamp'])
-        prev_time = float(self.chain[-2]['timestamp'])
-        actual_time = last_time - prev_time
-        if actual_time < self.block_time_target:
-            self.difficulty += 1
-        elif actual_time > self.block_time_target:
-            self.difficulty = max(1, self.difficulty - 1)
+        """Sets the target for the next block from the times of the recent blocks (see Retarget)."""
+        height = len(self.chain)
+        self.target = self.retarget.next_target(
+            self.chain.load_headers(max(1, height - self.retarget.window), height)
+        )
 
     def hash(self, block):
-        """Creates a SHA-256 hash of a block."""
-        block_string = json.dumps(block, sort_keys=True).encode()
-        return hashlib.sha256(block_string).hexdigest()
-
-    def create_block(self, proof, previous_hash):
-        """Creates a new block and adds it to the chain."""
-        block = {
-            "index": len(self.chain) + 1,
-            "timestamp": str(time.time()),
-            "transactions": self.transactions,
-            "proof": proof,
-            "previous_hash": previous_hash
-        }
-        self.chain.append(block)
-        self.transactions = []  # Reset pending transactions
-        self.adjust_difficulty()
+        """Creates a SHA-256 hash of a block header."""
+        return block_hash(block)
+
+    @timed(BLOCK_SECONDS)
+    def create_block(self, proof, previous_hash, miner_address=None, reward=0):
+        """
+        Creates a new block from the highest-fee pending transactions, applies it
+        to the ledger and adds it to the chain. The miner, if given, receives the
+        reward plus fees in a leading Network transaction. Returns None if
+        previous_hash is no longer the tip, e.g. after a peer's block arrived.
+        """
+        with self.lock:
+            if previous_hash != self.hash(self.chain[-1]):
+                return None
+            index = len(self.chain) + 1
+            selected = self.mempool.select(self.max_block_transactions)
+            transactions = [tx for _, tx in selected]
+            if miner_address:
+                # Summed in base units so fees never pick up float error
+                fees = sum(transaction_units(tx)[1] for tx in transactions)
+                amount = from_units(to_units(reward) + fees)
+                coinbase = {"sender": NETWORK, "recipient": miner_address, "amount": amount, "height": index}
+                transactions.insert(0, coinbase)
+
+            def make_block(accepted):
+                # Only transactions the ledger accepted make it into the block
+                return {
+                    "index": index,
+                    "timestamp": str(time.time()),
+                    "transactions": accepted,
+                    "proof": proof,
+                    "previous_hash": previous_hash,
+                    "merkle_root": merkle_root([hash_transaction(tx) for tx in accepted]),
+                    "target": target_to_hex(self.target)  # The target the proof was mined against
+                }
+
+            # Ledger rows and the block commit together; nothing changes if either fails
+            block = self.db.add_block(transactions, make_block, self.hash, self.block_store)
+            if block is None:
+                raise RuntimeError(f"failed to commit block {index}")
+            self.chain.replace(index - 1, [], [block])
+            # Rejected transactions are dropped too, so they are not selected again
+            self.mempool.remove(tx_hash for tx_hash, _ in selected)
+            self.adjust_difficulty()
+        for listener in self.block_listeners:
+            listener(block)
         return block
+
+    def refresh(self):
+        """
+        Follow a chain written by another process through the shared database,
+        e.g. in a read-only worker. Balances only change when the tip does, so
+        the balance cache is dropped at the same time. Returns True if the tip moved.
+        """
+        with self.lock:
+            if not self.chain.refresh():
+                return False
+            self.db.balance_cache.clear()
+            tip = self.chain[-1]
+            self.adjust_difficulty()
+        for listener in self.block_listeners:
+            listener(tip)
+        return True
+
+    def replace_blocks(self, fork_height, blocks):
+        """
+        Switches the chain to `blocks` on top of fork_height, reverting the
+        ledger for any blocks above the fork first, all in one database
+        transaction (see Database.replace_blocks). The caller must have
+        checked the new blocks (see validation.check_blocks and replay_blocks).
+        Transactions from dropped blocks go back to the mempool where still valid.
+        """
+        with self.lock:
+            removed = self.chain[fork_height:]
+            if not self.db.replace_blocks(fork_height, removed, blocks, self.hash, self.block_store):
+                raise RuntimeError(f"blocks above {fork_height} do not apply to the ledger")
+            self.chain.replace(fork_height, removed, blocks)
+
+            included = {transaction_id(tx) for block in blocks for tx in block["transactions"]}
+            self.mempool.remove(included)
+            for block in removed:
+                for tx in block["transactions"]:
+                    if tx["sender"] != NETWORK and transaction_id(tx) not in included:
+                        self.add_transaction(tx)
+
+            self.adjust_difficulty()
+        for listener in self.block_listeners:
+            listener(self.chain[-1])
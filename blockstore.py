@@ -0,0 +1,280 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from array import array
+from codec import Block, encode_block, write_varint
+
+# Record header: height, payload length, CRC-32 of the payload, block hash
+RECORD = struct.Struct("<QII32s")
+OFFSET_BITS = 40  # Index entries pack (segment << 40) | offset into one unsigned 64-bit value
+OFFSET_MASK = (1 << OFFSET_BITS) - 1
+INDEX_FILE = "index.dat"
+
+
+class BlockStore:
+    """
+    Append-only block storage in fixed-size segment files. Each block is
+    written once as its codec encoding behind a small record header, and a
+    height -> (segment, offset) index is kept in an array('Q'). Segments are
+    preallocated and memory-mapped, so reading a block is an index lookup and
+    a slice of the map rather than a query.
+
+    Implements the block half of the Database interface (save_block,
+    load_block, load_blocks, load_headers, load_tip, delete_blocks_from)
+    so it can back Chain in place of SQLite. Like SQLite it may start above
+    height 1, on a node bootstrapped from a snapshot: the first record then
+    fixes the base height and index entries count from there.
+    """
+
+    def __init__(self, directory, segment_size=64 * 1024 * 1024):
+        self.directory = directory
+        self.segment_size = segment_size
+        self._index = array("Q")
+        self._base = 0  # Heights below the first stored block
+        self._maps = []  # Segment number -> mmap
+        self._files = []
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        self._open_segments()
+        self._recover()
+        self._index_file = open(os.path.join(directory, INDEX_FILE), "ab")
+
+    def __len__(self):
+        return self._base + len(self._index) if self._index else 0
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, f"blocks-{number:05d}.dat")
+
+    def _open_segments(self):
+        number = 0
+        while os.path.exists(self._segment_path(number)):
+            self._map_segment(number)
+            number += 1
+
+    def _map_segment(self, number):
+        path = self._segment_path(number)
+        f = open(path, "r+b" if os.path.exists(path) else "w+b")
+        if os.fstat(f.fileno()).st_size < self.segment_size:
+            f.truncate(self.segment_size)  # Sparse on most filesystems until written
+        self._files.append(f)
+        self._maps.append(mmap.mmap(f.fileno(), 0))
+
+    def _read_record(self, segment, offset, height):
+        """Returns (hash, payload end) if a valid record for `height` starts here, else None."""
+        if segment >= len(self._maps) or offset + RECORD.size > len(self._maps[segment]):
+            return None
+        data = self._maps[segment]
+        stored_height, length, crc, block_hash = RECORD.unpack_from(data, offset)
+        end = offset + RECORD.size + length
+        if stored_height != height or length == 0 or end > len(data):
+            return None
+        if zlib.crc32(memoryview(data)[offset + RECORD.size:end]) != crc:
+            return None
+        return block_hash, end
+
+    def _recover(self):
+        """
+        Loads the index and reconciles it with the segments: entries whose
+        record is missing or torn are dropped, records written after the last
+        index flush are re-indexed, and whatever follows the last good record
+        is cleared so it can never be mistaken for a block later.
+        """
+        path = os.path.join(self.directory, INDEX_FILE)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                data = f.read()
+            self._index.frombytes(data[:len(data) - len(data) % self._index.itemsize])
+
+        self._base = self._first_height() - 1
+        while self._index and self._read_record(*self._locate(len(self)), len(self)) is None:
+            self._index.pop()
+
+        segment, offset = self._next_position()
+        while True:
+            height = self._base + len(self._index) + 1
+            if self._read_record(segment, offset, height) is None:
+                if offset == 0 or self._read_record(segment + 1, 0, height) is None:
+                    break
+                segment, offset = segment + 1, 0
+            self._index.append(segment << OFFSET_BITS | offset)
+            offset = self._read_record(segment, offset, height)[1]
+
+        self._clear_from(segment, offset)
+        with open(path, "wb") as f:
+            f.write(self._index.tobytes())
+        logging.info(f"Block store opened with {len(self._index)} blocks in {len(self._maps)} segments")
+
+    def _first_height(self):
+        """Height of the record at the start of the first segment: 1 unless the store starts at a snapshot."""
+        if self._maps:
+            height = RECORD.unpack_from(self._maps[0], 0)[0]
+            if height and self._read_record(0, 0, height) is not None:
+                return height
+        return 1
+
+    def _clear_from(self, segment, offset):
+        # Zeroing the next record header ends the chain of records at this point
+        if segment < len(self._maps) and offset + RECORD.size <= len(self._maps[segment]):
+            self._maps[segment][offset:offset + RECORD.size] = bytes(RECORD.size)
+        for later in range(segment + 1, len(self._maps)):
+            self._maps[later][:RECORD.size] = bytes(RECORD.size)
+
+    def _locate(self, height):
+        entry = self._index[height - self._base - 1]
+        return entry >> OFFSET_BITS, entry & OFFSET_MASK
+
+    def _next_position(self):
+        """Segment and offset just past the last indexed record."""
+        if not self._index:
+            return 0, 0
+        segment, offset = self._locate(len(self))
+        length = RECORD.unpack_from(self._maps[segment], offset)[1]
+        return segment, offset + RECORD.size + length
+
+    def view(self, height):
+        """
+        Zero-copy memoryview of a block's encoding, or None if it is not stored.
+        The view stays readable for the life of the store, but its contents are
+        replaced if the block is later deleted and the space reused.
+        """
+        with self._lock:
+            if not self._base < height <= len(self):
+                return None
+            segment, offset = self._locate(height)
+            length = RECORD.unpack_from(self._maps[segment], offset)[1]
+            start = offset + RECORD.size
+            return memoryview(self._maps[segment])[start:start + length]
+
+    def save_block(self, block, block_hash):
+        """Append a block on top of the stored tip, or at any height to an empty store. Returns False if the height is not next."""
+        payload = encode_block(block)
+        record_size = RECORD.size + len(payload)
+        if record_size > self.segment_size:
+            logging.error(f"Block {block['index']} is larger than a segment ({record_size} bytes)")
+            return False
+        with self._lock:
+            if self._index and block["index"] != len(self) + 1:
+                logging.warning(f"Block {block['index']} does not extend the stored tip at {len(self)}.")
+                return False
+            segment, offset = self._next_position()
+            if offset + record_size > self.segment_size:
+                segment, offset = segment + 1, 0
+            if segment == len(self._maps):
+                self._map_segment(segment)
+
+            data = self._maps[segment]
+            # Payload first, then the header that makes the record valid
+            data[offset + RECORD.size:offset + record_size] = payload
+            data[offset:offset + RECORD.size] = RECORD.pack(block["index"], len(payload), zlib.crc32(payload), bytes.fromhex(block_hash))
+            self._clear_from(segment, offset + record_size)
+
+            entry = segment << OFFSET_BITS | offset
+            if not self._index:
+                self._base = block["index"] - 1
+            self._index.append(entry)
+            self._index_file.write(struct.pack("<Q", entry))
+            self._index_file.flush()
+            logging.info(f"Block {block['index']} stored: {block_hash}")
+            return True
+
+    def load_block(self, height):
+        """Load a block by its 1-based height, or None if it is not stored."""
+        with self._lock:
+            data = self.view(height)
+            return Block.decode(data)[0].to_dict() if data is not None else None
+
+    def load_blocks(self, start, end):
+        """Load the stored blocks with start <= height <= end, in height order."""
+        with self._lock:
+            return [self.load_block(height) for height in range(max(start, self._base + 1), min(end, len(self)) + 1)]
+
+    def read_blocks(self, start, end):
+        """Encoded blocks start..end as one buffer in codec.encode_blocks layout, copied straight from the segments."""
+        with self._lock:
+            heights = range(max(start, self._base + 1), min(end, len(self)) + 1)
+            out = bytearray()
+            write_varint(out, len(heights))
+            for height in heights:
+                out += self.view(height)
+            return bytes(out)
+
+    def load_headers(self, start, end):
+        """Load block headers (without transactions) with start <= height <= end, each with its hash."""
+        with self._lock:
+            headers = []
+            for height in range(max(start, self._base + 1), min(end, len(self)) + 1):
+                segment, offset = self._locate(height)
+                block_hash = RECORD.unpack_from(self._maps[segment], offset)[3]
+                header = Block.decode_header(self._maps[segment], offset + RECORD.size)[0].to_dict()
+                header["hash"] = block_hash.hex()
+                headers.append(header)
+            return headers
+
+    def delete_blocks_from(self, height):
+        """Delete every stored block at or above a height. Returns False on failure."""
+        with self._lock:
+            if height > len(self):
+                return True
+            height = max(height, self._base + 1)
+            segment, offset = self._locate(height)
+            del self._index[height - self._base - 1:]
+            self._clear_from(segment, offset)
+            try:
+                self._index_file.truncate(len(self._index) * self._index.itemsize)
+            except OSError as e:
+                logging.error(f"Failed to truncate block index: {e}")
+                return False
+            logging.info(f"Blocks from height {height} deleted")
+            return True
+
+    def load_tip(self):
+        """Load the highest stored block, or None if no blocks are stored."""
+        with self._lock:
+            return self.load_block(len(self)) if self._index else None
+
+    def load_base(self):
+        """Height of the lowest stored block, or None if no blocks are stored."""
+        with self._lock:
+            return self._base + 1 if self._index else None
+
+    def load_tip_header(self):
+        """Height and hash of the highest stored block as {"index", "hash"}, or None."""
+        with self._lock:
+            if not self._index:
+                return None
+            segment, offset = self._locate(len(self))
+            return {"index": len(self), "hash": RECORD.unpack_from(self._maps[segment], offset)[3].hex()}
+
+    def flush(self):
+        """Write dirty segment pages and the index to disk."""
+        with self._lock:
+            for data in self._maps:
+                data.flush()
+            self._index_file.flush()
+            os.fsync(self._index_file.fileno())
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self._index_file.close()
+            for data, f in zip(self._maps, self._files):
+                try:
+                    data.close()
+                except BufferError:
+                    pass  # A caller still holds a view; the map is released with it
+                f.close()
+
+
+def copy_blocks(source, target, batch=500):
+    """Copies every block from one store to another, e.g. from SQLite into a new BlockStore."""
+    tip = source.load_tip()
+    height = len(target) + 1 if isinstance(target, BlockStore) and len(target) else source.load_base()
+    while tip and height <= tip["index"]:
+        headers = source.load_headers(height, height + batch - 1)
+        for block, header in zip(source.load_blocks(height, height + batch - 1), headers):
+            if not target.save_block(block, header["hash"]):
+                raise RuntimeError(f"failed to copy block {block['index']}")
+        height += batch
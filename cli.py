@@ -1,12 +1,267 @@
 import requests
+from requests.adapters import HTTPAdapter
 import wallet
+from headers import block_hash, block_target, valid_proof
+from merkle import hash_transaction, verify_proof
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import csv
 import time
 import os
 import json
+import sys
 
-API_URL = "http://127.0.0.1:5000"  # Blockchain Node Address
+API_URL = os.environ.get("FARTCHAN_URL", "http://127.0.0.1:5000")  # Blockchain Node Address
+PAGE_SIZE = 50  # Transactions fetched per page
+BATCH_SIZE = 500  # Transfers per /add_transactions request in bulk sends
+CONCURRENCY = 8  # Bulk-send requests in flight
 
-def main():
+class NodeClient:
+    """
+    Talks to one node over a single requests.Session, so every call reuses
+    pooled keep-alive connections instead of opening a new one. The session
+    is shared by the bulk-send threads; its pool holds one connection per thread.
+    """
+
+    def __init__(self, url=API_URL, pool_size=CONCURRENCY, timeout=30):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get(self, path, **params):
+        return self.session.get(f"{self.url}{path}", params=params, timeout=self.timeout)
+
+    def post(self, path, payload):
+        return self.session.post(f"{self.url}{path}", json=payload, timeout=self.timeout)
+
+    def balance(self, address):
+        """Returns the node's balance response for an address."""
+        response = self.get("/get_balance", address=address)
+        response.raise_for_status()
+        return response.json()
+
+    def send(self, tx):
+        """Submits one signed transaction. Returns (tx_hash, error)."""
+        response = self.post("/add_transaction", tx)
+        body = response.json()
+        return (body.get("tx_hash"), None) if response.status_code == 200 else (None, body.get("error", "unknown error"))
+
+    def send_batch(self, txs):
+        """Submits signed transactions in one /add_transactions call. Returns one (tx_hash, error) per transaction."""
+        try:
+            response = self.post("/add_transactions", {"transactions": txs})
+            body = response.json()
+            if response.status_code != 200:
+                return [(None, body.get("error", "unknown error"))] * len(txs)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            return [(None, f"request failed: {e}")] * len(txs)
+        return [(result["tx_hash"], result["error"]) for result in body["results"]]
+
+    def mine(self, address, wait=True, poll=1):
+        """Queues a mining job; with `wait`, polls until it finishes. Returns the job dict."""
+        response = self.post("/mine", {"miner": address})
+        if response.status_code != 202:
+            return {"status": "failed", "error": response.json().get("error", "Error mining block")}
+        job = response.json()
+        while wait and job.get("status") in ("queued", "running"):
+            time.sleep(poll)
+            job = self.get(f"/mine/{job['job_id']}").json()
+        return job
+
+    def header(self, height):
+        """The header of the block at a height, or None."""
+        response = self.get("/headers", **{"from": height, "limit": 1})
+        response.raise_for_status()
+        headers = response.json()["headers"]
+        return headers[0] if headers and headers[0]["index"] == height else None
+
+    def history(self, after=0, limit=PAGE_SIZE, address=None):
+        """One page of confirmed transactions after an id."""
+        params = {"after": after, "limit": limit}
+        if address:
+            params["address"] = address
+        response = self.get("/get_transactions", **params)
+        response.raise_for_status()
+        return [json.loads(line) for line in response.iter_lines() if line]
+
+def check_tx_proof(client, height, data):
+    """
+    Checks a /tx_proof answer without trusting the node's hashes: the header
+    must hash to the block hash, carry a valid proof of work on the previous
+    block's proof, and the transaction must lead to its Merkle root. Returns
+    an error message, or None if it all holds.
+    """
+    header = data["header"]
+    if header.get("index") != height or block_hash(header) != data["block_hash"]:
+        return "the header does not hash to the block hash"
+    if height > 1:
+        target = block_target(header)
+        previous = client.header(height - 1)
+        if target is None or previous is None or not valid_proof(previous["proof"], header["proof"], target):
+            return "the block's proof of work is invalid"
+        if header["previous_hash"] != block_hash(previous):
+            return "the block does not link to the previous block"
+    # Recompute the leaf locally rather than trusting the node's hash
+    if not verify_proof(hash_transaction(data["transaction"]), data["proof"], header["merkle_root"]):
+        return "proof does not match the block's Merkle root"
+    return None
+
+def parse_amount(text, zero_ok=False):
+    """A positive (or, with `zero_ok`, zero) coin amount from text: an int for whole numbers, otherwise a float. None if invalid."""
+    try:
+        amount = int(text)
+    except ValueError:
+        try:
+            amount = float(text)
+        except ValueError:
+            return None
+    return amount if (0 <= amount if zero_ok else 0 < amount) and amount < float("inf") else None
+
+def read_payouts(path, index, default_wallet=None):
+    """
+    Reads a CSV of transfers with a header row: recipient and amount columns,
+    optionally fee and sender (a wallet file or public key; defaults to
+    --wallet). Returns (signed transactions with their line numbers, errors).
+    """
+    signed, errors = [], []
+    nonce = time.time_ns()  # One base per run; every row gets its own nonce
+    with open(path, newline="") as f:
+        for line, row in enumerate(csv.DictReader(f), start=2):
+            sender = (row.get("sender") or "").strip() or default_wallet
+            recipient = (row.get("recipient") or "").strip()
+            amount = parse_amount((row.get("amount") or "").strip())
+            fee = (row.get("fee") or "").strip()
+            fee = parse_amount(fee, zero_ok=True) if fee else 0
+            if not sender or not recipient:
+                errors.append({"line": line, "error": "Missing sender or recipient"})
+            elif amount is None or fee is None:
+                errors.append({"line": line, "error": "Invalid amount or fee"})
+            else:
+                try:
+                    tx = index.wallet(sender).sign_transaction(recipient, amount, fee=fee, nonce=nonce + line)
+                except KeyError:
+                    errors.append({"line": line, "error": f"No wallet for {sender}"})
+                    continue
+                signed.append((line, tx))
+    return signed, errors
+
+def send_csv(client, index, path, default_wallet=None, batch_size=BATCH_SIZE, concurrency=CONCURRENCY):
+    """Signs every row of a payout CSV and submits them in batches, `concurrency` requests at a time."""
+    signed, errors = read_payouts(path, index, default_wallet)
+    batches = [signed[i:i + batch_size] for i in range(0, len(signed), batch_size)]
+    accepted = 0
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = executor.map(client.send_batch, [[tx for _, tx in batch] for batch in batches])
+        for batch, batch_results in zip(batches, results):
+            for (line, _), (tx_hash, error) in zip(batch, batch_results):
+                if tx_hash:
+                    accepted += 1
+                else:
+                    errors.append({"line": line, "error": error})
+    errors.sort(key=lambda error: error["line"])
+    return {"accepted": accepted, "rejected": len(errors), "errors": errors}
+
+def resolve_address(index, name_or_address):
+    """The public key behind a wallet file name, or the argument itself if it is not a wallet file."""
+    name = index.find(name_or_address)
+    if name is not None:
+        return index.address(name)
+    if name_or_address.endswith(".json"):
+        raise KeyError(name_or_address)
+    return name_or_address
+
+def run_command(args):
+    """Runs one non-interactive subcommand. Returns the process exit code."""
+    client = NodeClient(args.url, pool_size=max(getattr(args, "concurrency", 1), 1))
+    index = wallet.WalletIndex(args.wallet_dir)
+    try:
+        if args.command == "balance":
+            print(client.balance(resolve_address(index, args.wallet))["balance"])
+
+        elif args.command == "send":
+            if args.from_csv:
+                summary = send_csv(client, index, args.from_csv, args.wallet, args.batch_size, args.concurrency)
+                print(json.dumps(summary, indent=2))
+                return 0 if not summary["rejected"] else 1
+            if not (args.wallet and args.to and args.amount):
+                print("send needs --wallet, --to and --amount, or --from-csv", file=sys.stderr)
+                return 2
+            amount, fee = parse_amount(args.amount), parse_amount(args.fee, zero_ok=True) if args.fee else 0
+            if amount is None or fee is None:
+                print("Invalid amount or fee.", file=sys.stderr)
+                return 2
+            tx_hash, error = client.send(index.wallet(args.wallet).sign_transaction(args.to, amount, fee=fee))
+            print(tx_hash or f"Error processing transaction: {error}", file=sys.stdout if tx_hash else sys.stderr)
+            return 0 if tx_hash else 1
+
+        elif args.command == "mine":
+            job = client.mine(resolve_address(index, args.wallet), wait=not args.no_wait)
+            if job.get("status") == "done":
+                print(job["block"]["index"])
+            elif args.no_wait and job.get("job_id"):
+                print(job["job_id"])
+            else:
+                print(f"Mining job {job.get('status', 'failed')}: {job.get('error')}", file=sys.stderr)
+                return 1
+
+        elif args.command == "history":
+            address = resolve_address(index, args.address) if args.address else None
+            after, remaining = args.after, args.limit
+            # NDJSON, one transaction per line, paged until the node runs out or --limit is reached
+            while remaining is None or remaining > 0:
+                page = client.history(after, min(PAGE_SIZE, remaining or PAGE_SIZE), address)
+                for tx in page:
+                    print(json.dumps(tx))
+                if len(page) < PAGE_SIZE:
+                    break
+                after = page[-1]["id"]
+                remaining = remaining - len(page) if remaining is not None else None
+
+    except KeyError as e:
+        print(f"Wallet not found: {e.args[0]}", file=sys.stderr)
+        return 1
+    except OSError as e:  # Includes requests' connection errors
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    except ValueError:
+        print("Error: Unexpected response from the blockchain node.", file=sys.stderr)
+        return 1
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="FARTCHAN command-line client. Run without a command for the interactive menu.")
+    parser.add_argument("--url", default=API_URL, help="node URL (default: FARTCHAN_URL or %(default)s)")
+    parser.add_argument("--wallet-dir", default=".", help="directory holding wallet_*.json files")
+    commands = parser.add_subparsers(dest="command")
+
+    balance = commands.add_parser("balance", help="print the confirmed balance of a wallet or address")
+    balance.add_argument("wallet", help="wallet file or public key")
+
+    send = commands.add_parser("send", help="send one transfer, or every row of a CSV")
+    send.add_argument("--wallet", help="sending wallet file or public key (default sender for --from-csv)")
+    send.add_argument("--to", help="recipient public key")
+    send.add_argument("--amount", help="amount in coins")
+    send.add_argument("--fee", help="fee in coins")
+    send.add_argument("--from-csv", metavar="FILE", help="CSV with recipient,amount[,fee][,sender] columns")
+    send.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="transfers per request with --from-csv")
+    send.add_argument("--concurrency", type=int, default=CONCURRENCY, help="requests in flight with --from-csv")
+
+    mine = commands.add_parser("mine", help="mine a block and print its height")
+    mine.add_argument("wallet", help="wallet file or public key that receives the reward")
+    mine.add_argument("--no-wait", action="store_true", help="print the job ID instead of waiting for the block")
+
+    history = commands.add_parser("history", help="print confirmed transactions as NDJSON")
+    history.add_argument("--address", help="only transactions to or from this wallet file or public key")
+    history.add_argument("--after", type=int, default=0, help="start after this transaction id")
+    history.add_argument("--limit", type=int, help="stop after this many transactions")
+    return parser
+
+def main(url=API_URL, wallet_dir="."):
+    client = NodeClient(url)
+    index = wallet.WalletIndex(wallet_dir)
     while True:
         print("\n1. Create New Wallet")
         print("2. List Existing Wallets")
@@ -14,20 +269,21 @@ def main():
         print("4. View Transactions")
         print("5. Send Transaction")
         print("6. Mine Block")
-        print("7. Exit")
+        print("7. Verify Transaction Inclusion")
+        print("8. Exit")
         choice = input("Choose an option: ")
 
         if choice == "1":
             filename = f"wallet_{int(time.time())}.json"
             new_wallet = wallet.Wallet()
-            new_wallet.save_keys(filename)
+            new_wallet.save_keys(os.path.join(wallet_dir, filename))
             print(f"\nNew wallet created! File: {filename}")
             print(f"Public Key: {new_wallet.public_key}")
+            index = wallet.WalletIndex(wallet_dir)  # Pick up the new file
 
         elif choice == "2":
-            wallets = os.listdir(".")  # List files in current directory
-            wallet_files = [w for w in wallets if w.startswith("wallet_") and w.endswith(".json")]
-            
+            wallet_files = index.files()
+
             if not wallet_files:
                 print("No wallets found.")
             else:
@@ -36,47 +292,47 @@ def main():
                     print(f"- {w}")
 
         elif choice == "3":
-            wallet_file = input("Enter your wallet filename: ")
-            if not os.path.exists(wallet_file):
+            wallet_file = index.find(input("Enter your wallet filename: "))
+            if wallet_file is None:
                 print("Wallet file not found!")
                 continue
-            
+
             try:
-                keys = wallet.Wallet.load_keys(wallet_file)
-                response = requests.get(f"{API_URL}/get_balance?address={keys['public_key']}")
-                if response.status_code == 200:
-                    print("\nBalance:", response.json().get("balance", "Error fetching balance"))
-                else:
-                    print("Error fetching balance.")
+                print("\nBalance:", client.balance(index.address(wallet_file)).get("balance", "Error fetching balance"))
+            except requests.exceptions.HTTPError:
+                print("Error fetching balance.")
             except (requests.exceptions.RequestException, json.JSONDecodeError):
                 print("Error: Unable to connect to the blockchain node.")
 
         elif choice == "4":
+            after = 0
+            print("\nTransaction History:")
             try:
-                response = requests.get(f"{API_URL}/get_transactions")
-                if response.status_code == 200:
-                    transactions = response.json()
-
-                    if isinstance(transactions, list) and all(isinstance(tx, dict) for tx in transactions):
-                        print("\nTransaction History:")
-                        for tx in transactions:
-                            print(f"{tx.get('timestamp', 'Unknown')} | {tx.get('sender', 'N/A')} -> {tx.get('recipient', 'N/A')} | Amount: {tx.get('amount', 0)}")
-                    else:
-                        print("No valid transactions found.")
-                else:
-                    print("Failed to fetch transactions.")
+                while True:
+                    transactions = client.history(after, PAGE_SIZE)
+                    if not transactions and after == 0:
+                        print("No transactions found.")
+                    for tx in transactions:
+                        print(f"{tx.get('timestamp', 'Unknown')} | {tx.get('sender', 'N/A')} -> {tx.get('recipient', 'N/A')} | Amount: {tx.get('amount', 0)}")
+
+                    if len(transactions) < PAGE_SIZE:
+                        break
+                    after = transactions[-1]["id"]
+                    if input("Press Enter for more, or q to stop: ").strip().lower() == "q":
+                        break
+            except requests.exceptions.HTTPError:
+                print("Failed to fetch transactions.")
             except (requests.exceptions.RequestException, ValueError):
                 print("Error: Unable to connect to the blockchain node.")
 
         elif choice == "5":
-            sender_wallet = input("Enter your wallet filename: ")
-            if not os.path.exists(sender_wallet):
+            sender_wallet = index.find(input("Enter your wallet filename: "))
+            if sender_wallet is None:
                 print("Wallet file not found!")
                 continue
-            
+
             try:
-                keys = wallet.Wallet.load_keys(sender_wallet)
-                sender = keys["public_key"]
+                sender = index.wallet(sender_wallet)
                 recipient = input("Recipient (Public Key): ")
                 amount = input("Amount: ")
 
@@ -89,39 +345,67 @@ def main():
                     print("Invalid amount. Must be a number.")
                     continue
 
-                data = {"sender": sender, "recipient": recipient, "amount": amount}
-                response = requests.post(f"{API_URL}/add_transaction", json=data)
-                if response.status_code == 200:
-                    print(response.json().get("message", "Transaction sent successfully!"))
+                tx_hash, error = client.send(sender.sign_transaction(recipient, amount))
+                if tx_hash:
+                    print("Transaction added")
                 else:
-                    print("Error processing transaction.")
+                    print(f"Error processing transaction: {error}")
 
             except (requests.exceptions.RequestException, json.JSONDecodeError):
                 print("Error: Unable to connect to the blockchain node.")
 
         elif choice == "6":
-            miner_wallet = input("Enter your wallet filename: ")
-            if not os.path.exists(miner_wallet):
+            miner_wallet = index.find(input("Enter your wallet filename: "))
+            if miner_wallet is None:
                 print("Wallet file not found!")
                 continue
 
             try:
-                keys = wallet.Wallet.load_keys(miner_wallet)
-                response = requests.get(f"{API_URL}/mine?miner={keys['public_key']}")
-                if response.status_code == 200:
-                    print(response.json().get("message", "Block mined successfully!"))
+                print("Mining job queued, waiting for the block...")
+                job = client.mine(index.address(miner_wallet))
+                if job.get("status") == "done":
+                    print(f"New block mined! Height: {job['block']['index']}")
                 else:
-                    print("Error mining block.")
+                    print(f"Mining job {job.get('status', 'failed')}: {job.get('error')}")
 
             except (requests.exceptions.RequestException, json.JSONDecodeError):
                 print("Error: Unable to connect to the blockchain node.")
 
         elif choice == "7":
+            try:
+                height = int(input("Block height: "))
+                position = int(input("Transaction index in block: "))
+            except ValueError:
+                print("Block height and transaction index must be integers.")
+                continue
+
+            try:
+                response = client.get("/tx_proof", block=height, tx=position)
+                if response.status_code != 200:
+                    print(response.json().get("error", "Error fetching proof."))
+                    continue
+
+                data = response.json()
+                tx = data["transaction"]
+                error = check_tx_proof(client, height, data)
+                if error is None:
+                    print(f"Verified: {tx['sender']} -> {tx['recipient']} ({tx['amount']}) is in block {height}")
+                    print(f"Merkle root: {data['header']['merkle_root']} ({len(data['proof'])} proof hashes)")
+                else:
+                    print(f"Verification FAILED: {error}.")
+            except (requests.exceptions.RequestException, ValueError, KeyError):
+                print("Error: Unable to connect to the blockchain node.")
+
+        elif choice == "8":
             print("Exiting CLI...")
             break
 
         else:
-            print("Invalid option. Please select a number between 1-7.")
+            print("Invalid option. Please select a number between 1-8.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = build_parser().parse_args()
+    if args.command is None:
+        main(args.url, args.wallet_dir)
+    else:
+        sys.exit(run_command(args))
@@ -0,0 +1,420 @@
+import json
+import struct
+
+BINARY = "application/octet-stream"
+
+# Fixed-width header: flags, index, timestamp, proof, previous_hash, merkle_root, difficulty.
+# A 256-bit target, when present, follows it as 32 raw bytes.
+HEADER = struct.Struct("<BIdQ32s32sB")
+DOUBLE = struct.Struct("<d")
+
+# Header flags: which struct fields hold a value. Anything that does not fit
+# its slot (or an unknown key) travels in a JSON trailer instead.
+H_INDEX = 1
+H_TIMESTAMP = 2
+H_PROOF = 4
+H_PREVIOUS_HASH = 8
+H_MERKLE_ROOT = 16
+H_DIFFICULTY = 32
+H_EXTRA = 64
+H_TARGET = 128
+
+# Transaction flags. Addresses take two bits each (none, raw key, Network, text);
+# amount and fee take two bits each (none, varint, double).
+ADDRESS_KEY, ADDRESS_NETWORK, ADDRESS_TEXT = 1, 2, 3
+NUMBER_INT, NUMBER_FLOAT = 1, 2
+T_SENDER = 0
+T_RECIPIENT = 2
+T_AMOUNT = 4
+T_FEE = 6
+T_NONCE = 1 << 8
+T_SIGNATURE = 1 << 9
+T_HEIGHT = 1 << 10
+T_EXTRA = 1 << 11
+
+NETWORK = "Network"
+KEY_SIZE = 64  # Raw SECP256k1 public key (x || y)
+
+
+def write_varint(out, value):
+    """Appends an unsigned LEB128 varint to a bytearray."""
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(buf, offset):
+    """Reads an unsigned varint from bytes or a memoryview. Returns (value, new offset)."""
+    value = shift = 0
+    while True:
+        byte = buf[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def write_int(out, value):
+    write_varint(out, value * 2 if value >= 0 else -value * 2 - 1)  # Zigzag keeps small negatives small
+
+
+def read_int(buf, offset):
+    value, offset = read_varint(buf, offset)
+    return (value >> 1) ^ -(value & 1), offset
+
+
+def write_bytes(out, data):
+    write_varint(out, len(data))
+    out += data
+
+
+def read_bytes(buf, offset):
+    size, offset = read_varint(buf, offset)
+    return bytes(buf[offset:offset + size]), offset + size
+
+
+def _is_int(value, bits=None):
+    return type(value) is int and (bits is None or 0 <= value < 1 << bits)
+
+
+def _raw_hex(value, size):
+    """Returns the bytes behind a lowercase hex string of `size` bytes, or None if it is anything else."""
+    if not isinstance(value, str) or len(value) != size * 2:
+        return None
+    try:
+        raw = bytes.fromhex(value)
+    except ValueError:
+        return None
+    return raw if raw.hex() == value else None
+
+
+def _float_text(value):
+    """Returns the float behind a timestamp string if repr() gives the same text back."""
+    if not isinstance(value, str):
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    return number if repr(number) == value else None
+
+
+def _encode_address(value):
+    if value == NETWORK:
+        return ADDRESS_NETWORK, value
+    raw = _raw_hex(value, KEY_SIZE)
+    if raw is not None:
+        return ADDRESS_KEY, raw
+    return (ADDRESS_TEXT, value) if isinstance(value, str) else (0, None)
+
+
+def _encode_number(value):
+    if _is_int(value):
+        return NUMBER_INT, value
+    return (NUMBER_FLOAT, value) if type(value) is float else (0, None)
+
+
+class Transaction:
+    """
+    A transaction in compact form. Public keys and signatures are held as raw
+    bytes and amounts as numbers; None means the field is absent. Fields that
+    do not fit (and unknown keys) are kept in `extra` so dicts round-trip exactly.
+    """
+    __slots__ = ("sender", "recipient", "amount", "fee", "nonce", "signature", "height", "extra")
+
+    def __init__(self):
+        self.sender = self.recipient = self.amount = self.fee = None
+        self.nonce = self.signature = self.height = self.extra = None
+
+    @classmethod
+    def from_dict(cls, tx):
+        self = cls()
+        extra = {}
+        for key, value in tx.items():
+            if key in ("sender", "recipient"):
+                kind, value = _encode_address(value)
+            elif key in ("amount", "fee"):
+                kind, value = _encode_number(value)
+            elif key in ("nonce", "height"):
+                kind = _is_int(value)
+            elif key == "signature":
+                kind = isinstance(value, str) and len(value) % 2 == 0
+                value = _raw_hex(value, len(value) // 2) if kind else None
+                kind = value is not None
+            else:
+                kind = False
+            if kind:
+                setattr(self, key, value)
+            else:
+                extra[key] = tx[key]
+        self.extra = extra or None
+        return self
+
+    def to_dict(self):
+        tx = {}
+        for key in ("sender", "recipient"):
+            value = getattr(self, key)
+            if value is not None:
+                tx[key] = value.hex() if isinstance(value, bytes) else value
+        for key in ("amount", "fee", "nonce", "height"):
+            value = getattr(self, key)
+            if value is not None:
+                tx[key] = value
+        if self.signature is not None:
+            tx["signature"] = self.signature.hex()
+        if self.extra:
+            tx.update(self.extra)
+        return tx
+
+    def encode(self, out=None):
+        """Appends the encoding to `out` (a bytearray) if given; returns the buffer."""
+        out = bytearray() if out is None else out
+        flags = 0
+        body = bytearray()
+        for key, shift in (("sender", T_SENDER), ("recipient", T_RECIPIENT)):
+            value = getattr(self, key)
+            if value is None:
+                continue
+            if isinstance(value, bytes):
+                flags |= ADDRESS_KEY << shift
+                body += value
+            elif value == NETWORK:
+                flags |= ADDRESS_NETWORK << shift
+            else:
+                flags |= ADDRESS_TEXT << shift
+                write_bytes(body, value.encode())
+        for key, shift in (("amount", T_AMOUNT), ("fee", T_FEE)):
+            value = getattr(self, key)
+            if value is None:
+                continue
+            if type(value) is float:
+                flags |= NUMBER_FLOAT << shift
+                body += DOUBLE.pack(value)
+            else:
+                flags |= NUMBER_INT << shift
+                write_int(body, value)
+        if self.nonce is not None:
+            flags |= T_NONCE
+            write_int(body, self.nonce)
+        if self.signature is not None:
+            flags |= T_SIGNATURE
+            write_bytes(body, self.signature)
+        if self.height is not None:
+            flags |= T_HEIGHT
+            write_int(body, self.height)
+        if self.extra:
+            flags |= T_EXTRA
+            write_bytes(body, json.dumps(self.extra, separators=(",", ":")).encode())
+        write_varint(out, flags)
+        out += body
+        return out
+
+    @classmethod
+    def decode(cls, buf, offset=0):
+        """Reads a transaction from bytes or a memoryview. Returns (transaction, new offset)."""
+        self = cls()
+        flags, offset = read_varint(buf, offset)
+        for key, shift in (("sender", T_SENDER), ("recipient", T_RECIPIENT)):
+            kind = flags >> shift & 3
+            if kind == ADDRESS_KEY:
+                setattr(self, key, bytes(buf[offset:offset + KEY_SIZE]))
+                offset += KEY_SIZE
+            elif kind == ADDRESS_NETWORK:
+                setattr(self, key, NETWORK)
+            elif kind == ADDRESS_TEXT:
+                value, offset = read_bytes(buf, offset)
+                setattr(self, key, value.decode())
+        for key, shift in (("amount", T_AMOUNT), ("fee", T_FEE)):
+            kind = flags >> shift & 3
+            if kind == NUMBER_FLOAT:
+                setattr(self, key, DOUBLE.unpack_from(buf, offset)[0])
+                offset += DOUBLE.size
+            elif kind == NUMBER_INT:
+                value, offset = read_int(buf, offset)
+                setattr(self, key, value)
+        if flags & T_NONCE:
+            self.nonce, offset = read_int(buf, offset)
+        if flags & T_SIGNATURE:
+            self.signature, offset = read_bytes(buf, offset)
+        if flags & T_HEIGHT:
+            self.height, offset = read_int(buf, offset)
+        if flags & T_EXTRA:
+            extra, offset = read_bytes(buf, offset)
+            self.extra = json.loads(extra)
+        return self, offset
+
+
+class Block:
+    """
+    A block in compact form: a fixed-width header struct, an optional JSON
+    trailer for fields that do not fit it, then the transactions. Hashes are
+    held as raw bytes and the timestamp as a float; None means absent.
+    """
+    __slots__ = ("index", "timestamp", "proof", "previous_hash", "merkle_root", "difficulty", "target",
+                 "transactions", "extra")
+
+    def __init__(self):
+        self.index = self.timestamp = self.proof = self.previous_hash = None
+        self.merkle_root = self.difficulty = self.target = self.extra = None
+        self.transactions = None
+
+    @classmethod
+    def from_dict(cls, block):
+        self = cls()
+        extra = {}
+        for key, value in block.items():
+            if key == "transactions":
+                self.transactions = [Transaction.from_dict(tx) for tx in value]
+                continue
+            if key == "index":
+                fits = _is_int(value, 32)
+            elif key == "proof":
+                fits = _is_int(value, 64)
+            elif key == "difficulty":
+                fits = _is_int(value, 8)
+            elif key == "timestamp":
+                value = _float_text(value)
+                fits = value is not None
+            elif key in ("previous_hash", "merkle_root", "target"):
+                value = _raw_hex(value, 32)
+                fits = value is not None
+            else:
+                fits = False
+            if fits:
+                setattr(self, key, value)
+            else:
+                extra[key] = block[key]
+        self.extra = extra or None
+        return self
+
+    def to_dict(self):
+        block = {}
+        if self.index is not None:
+            block["index"] = self.index
+        if self.timestamp is not None:
+            block["timestamp"] = repr(self.timestamp)
+        if self.transactions is not None:
+            block["transactions"] = [tx.to_dict() for tx in self.transactions]
+        if self.proof is not None:
+            block["proof"] = self.proof
+        for key in ("previous_hash", "merkle_root", "target"):
+            value = getattr(self, key)
+            if value is not None:
+                block[key] = value.hex()
+        if self.difficulty is not None:
+            block["difficulty"] = self.difficulty
+        if self.extra:
+            block.update(self.extra)
+        return block
+
+    def encode_header(self, out=None):
+        """Appends the header (without transactions) to `out` if given; returns the buffer."""
+        out = bytearray() if out is None else out
+        flags = (
+            (H_INDEX if self.index is not None else 0)
+            | (H_TIMESTAMP if self.timestamp is not None else 0)
+            | (H_PROOF if self.proof is not None else 0)
+            | (H_PREVIOUS_HASH if self.previous_hash is not None else 0)
+            | (H_MERKLE_ROOT if self.merkle_root is not None else 0)
+            | (H_DIFFICULTY if self.difficulty is not None else 0)
+            | (H_EXTRA if self.extra else 0)
+            | (H_TARGET if self.target is not None else 0)
+        )
+        out += HEADER.pack(
+            flags, self.index or 0, self.timestamp or 0.0, self.proof or 0,
+            self.previous_hash or bytes(32), self.merkle_root or bytes(32), self.difficulty or 0
+        )
+        if self.target is not None:
+            out += self.target
+        if self.extra:
+            write_bytes(out, json.dumps(self.extra, separators=(",", ":")).encode())
+        return out
+
+    def encode(self, out=None):
+        """Appends the header and transactions to `out` if given; returns the buffer."""
+        out = self.encode_header(out)
+        write_varint(out, len(self.transactions or ()))
+        for tx in self.transactions or ():
+            tx.encode(out)
+        return out
+
+    @classmethod
+    def decode_header(cls, buf, offset=0):
+        """Reads a header from bytes or a memoryview. Returns (block without transactions, new offset)."""
+        self = cls()
+        flags, index, timestamp, proof, previous_hash, root, difficulty = HEADER.unpack_from(buf, offset)
+        offset += HEADER.size
+        self.index = index if flags & H_INDEX else None
+        self.timestamp = timestamp if flags & H_TIMESTAMP else None
+        self.proof = proof if flags & H_PROOF else None
+        self.previous_hash = previous_hash if flags & H_PREVIOUS_HASH else None
+        self.merkle_root = root if flags & H_MERKLE_ROOT else None
+        self.difficulty = difficulty if flags & H_DIFFICULTY else None
+        if flags & H_TARGET:
+            self.target = bytes(buf[offset:offset + 32])
+            offset += 32
+        if flags & H_EXTRA:
+            extra, offset = read_bytes(buf, offset)
+            self.extra = json.loads(extra)
+        return self, offset
+
+    @classmethod
+    def decode(cls, buf, offset=0):
+        """Reads a block from bytes or a memoryview. Returns (block, new offset)."""
+        self, offset = cls.decode_header(buf, offset)
+        count, offset = read_varint(buf, offset)
+        self.transactions = []
+        for _ in range(count):
+            tx, offset = Transaction.decode(buf, offset)
+            self.transactions.append(tx)
+        return self, offset
+
+
+def encode_block(block):
+    """Encodes a block dict to bytes."""
+    return bytes(Block.from_dict(block).encode())
+
+
+def decode_block(buf):
+    """Decodes bytes produced by encode_block back to the original dict."""
+    return Block.decode(memoryview(buf))[0].to_dict()
+
+
+def encode_blocks(blocks):
+    """Encodes a list of block dicts as a count followed by the blocks."""
+    out = bytearray()
+    write_varint(out, len(blocks))
+    for block in blocks:
+        Block.from_dict(block).encode(out)
+    return bytes(out)
+
+
+def decode_blocks(buf):
+    buf = memoryview(buf)
+    count, offset = read_varint(buf, 0)
+    blocks = []
+    for _ in range(count):
+        block, offset = Block.decode(buf, offset)
+        blocks.append(block.to_dict())
+    return blocks
+
+
+def encode_headers(headers):
+    """Encodes header dicts as a count followed by the headers. Derived "hash" keys are dropped."""
+    out = bytearray()
+    write_varint(out, len(headers))
+    for header in headers:
+        Block.from_dict({key: value for key, value in header.items() if key != "hash"}).encode_header(out)
+    return bytes(out)
+
+
+def decode_headers(buf):
+    buf = memoryview(buf)
+    count, offset = read_varint(buf, 0)
+    headers = []
+    for _ in range(count):
+        header, offset = Block.decode_header(buf, offset)
+        headers.append(header.to_dict())
+    return headers
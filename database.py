@@ -1,29 +1,237 @@
 import sqlite3
+import json
 import logging
+import queue
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from metrics import Histogram, log_throttled, timed
+from signatures import transaction_id
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
-class Database:
-    def __init__(self, db_name="blockchain.db"):
-        """Initialize database connection, enable WAL mode, and create tables."""
+NETWORK = "Network"  # Sender of block rewards; the only sender that may mint funds
+COIN = 100_000_000  # Base units per coin; the ledger stores integers only
+MAX_UNITS = 2 ** 63 - 1  # Largest value an SQLite INTEGER can hold
+TX_IDS_KEY = "transaction_ids"  # Meta flag: tx_hash columns hold transaction ids (see signatures.transaction_id)
+LEDGER_TIP_KEY = "ledger_tip"  # Meta: height and hash of the block the ledger was last committed with
+
+QUERY_SECONDS = Histogram("fartchan_db_query_seconds", "Time spent in Database methods.", ["method"])
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def to_units(amount):
+    """
+    Converts a coin amount from a transaction (int or float) to integer base
+    units. Returns None if it is not a number, has more precision than one
+    base unit, or does not fit the ledger.
+    """
+    if not is_number(amount):
+        return None
+    units = round(amount * COIN)
+    if abs(units - amount * COIN) > 1e-3 or abs(units) > MAX_UNITS:
+        return None
+    return units
+
+def from_units(units):
+    """Converts base units back to a coin amount: an int for whole coins, otherwise a float."""
+    return units // COIN if units % COIN == 0 else units / COIN
+
+def transaction_units(tx):
+    """Returns (amount, fee) of a transaction dict in base units; either is None if invalid."""
+    return to_units(tx["amount"]), to_units(tx.get("fee", 0))
+
+def transfer_nonce(tx):
+    """The nonce the ledger keeps unique per sender: an integer that fits a column, otherwise None."""
+    nonce = tx.get("nonce")
+    return nonce if type(nonce) is int and abs(nonce) <= MAX_UNITS else None
+
+class ConnectionPool:
+    """
+    Keeps long-lived SQLite connections for one database file and hands them
+    out per call. Pragmas are applied once when a connection is opened, and
+    each connection keeps its own prepared statement cache.
+    """
+
+    def __init__(self, db_name, max_idle=8, timeout=15, cached_statements=256):
         self.db_name = db_name
-        self.enable_wal()
-        self.create_tables()
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self._idle = queue.LifoQueue()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_name,
+            timeout=self.timeout,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        return conn
 
-    def enable_wal(self):
-        """Enable SQLite Write-Ahead Logging (WAL) to prevent database locking."""
+    @contextmanager
+    def connection(self):
+        """Borrow a connection in autocommit mode and return it to the pool afterwards."""
         try:
-            with sqlite3.connect(self.db_name, timeout=15, isolation_level=None) as conn:
-                conn.execute("PRAGMA journal_mode=WAL;")
-                logging.info("WAL mode enabled.")
-        except sqlite3.Error as e:
-            logging.error(f"Failed to enable WAL mode: {e}")
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            if self._idle.qsize() < self.max_idle:
+                self._idle.put(conn)
+            else:
+                conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """Borrow a connection and run the block inside BEGIN IMMEDIATE ... COMMIT."""
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def close(self):
+        """Close every idle connection."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+class BalanceCache:
+    """
+    Thread-safe LRU cache of balances with hit/miss counters.
+    Writers wrap their SQLite transaction in write(); its balance changes are
+    applied to cached entries only after COMMIT. Readers fill misses with
+    fill(), which is dropped while a write is in flight or if one started
+    after the read began, so a value read before a COMMIT is never cached after it.
+    """
+
+    def __init__(self, max_size=100_000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.epoch = 0  # Bumped when a write starts and when it ends
+        self._writers = 0  # Writes between BEGIN and the end of write()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached balance, or None on a miss."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return value
+
+    def fill(self, key, value, epoch):
+        """Cache a value read from SQLite unless a write is in flight or started since `epoch`."""
+        with self._lock:
+            if epoch == self.epoch and not self._writers:
+                self._store(key, value)
+
+    @contextmanager
+    def write(self):
+        """
+        Wrap a write transaction (including its COMMIT). Yields a dict the
+        writer adds its balance changes to (address -> delta in base units);
+        they reach cached entries when the block exits normally. If it
+        raises, the touched entries are dropped instead.
+        """
+        deltas = {}
+        with self._lock:
+            self.epoch += 1
+            self._writers += 1
+        try:
+            yield deltas
+        except BaseException:
+            with self._lock:
+                for key in deltas:
+                    self._entries.pop(key, None)
+            raise
+        else:
+            with self._lock:
+                for key, delta in deltas.items():
+                    if key in self._entries:  # Uncached keys stay uncached
+                        self._entries[key] += delta
+        finally:
+            with self._lock:
+                self.epoch += 1
+                self._writers -= 1
+
+    def invalidate(self, keys):
+        with self._lock:
+            self.epoch += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.epoch += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+    def _store(self, key, value):
+        if self.max_size <= 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def timed_query(fn):
+    """Records each call's duration in QUERY_SECONDS under the method's name."""
+    return timed(QUERY_SECONDS, method=fn.__name__)(fn)
+
+def get_pool(db_name="blockchain.db"):
+    """Return the process-wide connection pool for a database file."""
+    with _pools_lock:
+        pool = _pools.get(db_name)
+        if pool is None:
+            pool = _pools[db_name] = ConnectionPool(db_name)
+        return pool
+
+class Database:
+    def __init__(self, db_name="blockchain.db", balance_cache_size=100_000):
+        """Attach to the shared connection pool (WAL mode), set up the balance cache and create tables."""
+        self.db_name = db_name
+        self.pool = get_pool(db_name)
+        self.balance_cache = BalanceCache(balance_cache_size)
+        self.create_tables()
 
     def create_tables(self):
         """Create necessary tables for the blockchain."""
         try:
-            with sqlite3.connect(self.db_name, timeout=15, isolation_level=None) as conn:
+            with self.pool.connection() as conn:
                 cursor = conn.cursor()
 
                 cursor.execute("""
@@ -32,10 +240,11 @@ class Database:
                     )
                 """)
 
+                # Amounts and balances are integer base units (see COIN)
                 cursor.execute("""
                     CREATE TABLE IF NOT EXISTS balances (
                         public_key TEXT PRIMARY KEY,
-                        balance REAL DEFAULT 0
+                        balance INTEGER NOT NULL DEFAULT 0 CHECK (balance >= 0)
                     )
                 """)
 
@@ -44,121 +253,810 @@ class Database:
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
                         sender TEXT NOT NULL,
                         recipient TEXT NOT NULL,
-                        amount REAL NOT NULL CHECK (amount > 0),
-                        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                        amount INTEGER NOT NULL CHECK (amount > 0),
+                        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                        fee INTEGER NOT NULL DEFAULT 0,
+                        tx_hash TEXT,
+                        nonce INTEGER
+                    )
+                """)
+
+                # Columns added after the first release
+                columns = {row[1] for row in cursor.execute("PRAGMA table_info(transactions)")}
+                if "fee" not in columns:
+                    cursor.execute("ALTER TABLE transactions ADD COLUMN fee INTEGER NOT NULL DEFAULT 0")
+                if "tx_hash" not in columns:
+                    cursor.execute("ALTER TABLE transactions ADD COLUMN tx_hash TEXT")
+                if "nonce" not in columns:
+                    cursor.execute("ALTER TABLE transactions ADD COLUMN nonce INTEGER")
+
+                # Header fields are kept as JSON so the block dict round-trips exactly
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS blocks (
+                        height INTEGER PRIMARY KEY,
+                        hash TEXT NOT NULL UNIQUE,
+                        previous_hash TEXT NOT NULL,
+                        header TEXT NOT NULL
                     )
                 """)
 
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS block_transactions (
+                        height INTEGER NOT NULL REFERENCES blocks (height),
+                        position INTEGER NOT NULL,
+                        tx TEXT NOT NULL,
+                        PRIMARY KEY (height, position)
+                    ) WITHOUT ROWID
+                """)
+
+                # Ledger history compacted away by prune_transactions (see snapshot.py): the summed
+                # balance changes of the pruned rows, and their hashes so they cannot be replayed
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS ledger_base (
+                        public_key TEXT PRIMARY KEY,
+                        balance INTEGER NOT NULL
+                    )
+                """)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS pruned_transactions (
+                        tx_hash BLOB PRIMARY KEY
+                    ) WITHOUT ROWID
+                """)
+
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS meta (
+                        key TEXT PRIMARY KEY,
+                        value TEXT NOT NULL
+                    )
+                """)
+
+                self._migrate_to_units(conn)
+
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_sender ON transactions (sender)")
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_recipient ON transactions (recipient)")
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_timestamp ON transactions (timestamp)")
+                cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_hash ON transactions (tx_hash)")
+                # A sender's nonce can be confirmed once, like its transaction
+                cursor.execute("""
+                    CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_nonce ON transactions (sender, nonce)
+                    WHERE nonce IS NOT NULL
+                """)
+
                 logging.info("Database tables created successfully.")
 
         except sqlite3.Error as e:
             logging.error(f"Database error: {e}")
 
+    def _migrate_to_units(self, conn):
+        """Rebuilds ledger tables created with REAL amounts as INTEGER base units, once."""
+        types = {row[1]: row[2] for row in conn.execute("PRAGMA table_info(balances)")}
+        if types.get("balance") != "REAL":
+            return
+        logging.info("Converting the ledger to integer base units...")
+        # executescript commits any open transaction first, so the script carries its own;
+        # on failure the pool rolls back whatever it left open
+        with self.pool.connection() as migration:
+            migration.executescript(f"""
+                BEGIN IMMEDIATE;
+                ALTER TABLE balances RENAME TO balances_real;
+                CREATE TABLE balances (
+                    public_key TEXT PRIMARY KEY,
+                    balance INTEGER NOT NULL DEFAULT 0 CHECK (balance >= 0)
+                );
+                INSERT INTO balances (public_key, balance)
+                    SELECT public_key, MAX(CAST(ROUND(balance * {COIN}) AS INTEGER), 0) FROM balances_real;
+                DROP TABLE balances_real;
+
+                ALTER TABLE transactions RENAME TO transactions_real;
+                CREATE TABLE transactions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sender TEXT NOT NULL,
+                    recipient TEXT NOT NULL,
+                    amount INTEGER NOT NULL CHECK (amount > 0),
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    fee INTEGER NOT NULL DEFAULT 0,
+                    tx_hash TEXT,
+                    nonce INTEGER
+                );
+                INSERT INTO transactions (id, sender, recipient, amount, timestamp, fee, tx_hash, nonce)
+                    SELECT id, sender, recipient, CAST(ROUND(amount * {COIN}) AS INTEGER), timestamp,
+                           CAST(ROUND(fee * {COIN}) AS INTEGER), tx_hash, nonce
+                    FROM transactions_real;
+                DROP TABLE transactions_real;
+
+                -- Checkpointed balances were floats; the next --verify starts over
+                DELETE FROM meta WHERE key = 'validation_checkpoint';
+                COMMIT;
+            """)
+        self.balance_cache.clear()
+        logging.info("Ledger converted to integer base units.")
+
+    @timed_query
     def register_wallet(self, public_key):
         """Register a new wallet with an initial balance of 0."""
         try:
-            with sqlite3.connect(self.db_name, timeout=15, isolation_level=None) as conn:
+            with self.pool.transaction() as conn:
                 cursor = conn.cursor()
                 cursor.execute("INSERT OR IGNORE INTO wallets (public_key) VALUES (?)", (public_key,))
                 cursor.execute("INSERT OR IGNORE INTO balances (public_key, balance) VALUES (?, 0)", (public_key,))
-                logging.info(f"Wallet registered: {public_key}")
+                logging.debug("Wallet registered: %s", public_key)
 
         except sqlite3.Error as e:
             logging.error(f"Failed to register wallet: {e}")
 
-    def update_balance(self, public_key, amount):
-        """Update or insert balance for a given public key."""
+    @timed_query
+    def get_balance(self, public_key):
+        """Get the balance of a given public key in base units, served from the cache when possible."""
+        balance = self.balance_cache.get(public_key)
+        if balance is not None:
+            return balance
+
         try:
-            with sqlite3.connect(self.db_name, timeout=15, isolation_level=None) as conn:
+            epoch = self.balance_cache.epoch
+            with self.pool.connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("SELECT balance FROM balances WHERE public_key = ?", (public_key,))
                 result = cursor.fetchone()
+                balance = result[0] if result else 0
+                self.balance_cache.fill(public_key, balance, epoch)
+                return balance
 
-                if result:
-                    new_balance = result[0] + amount
-                    if new_balance < 0:
-                        logging.warning(f"Insufficient funds for {public_key}")
-                        return False  # Prevent overdrafts
-                    cursor.execute("UPDATE balances SET balance = ? WHERE public_key = ?", (new_balance, public_key))
-                else:
-                    if amount < 0:
-                        logging.warning(f"Cannot create a wallet with negative balance: {public_key}")
-                        return False
-                    new_balance = amount  # Ensure new_balance is always defined
-                    cursor.execute("INSERT INTO balances (public_key, balance) VALUES (?, ?)", (public_key, new_balance))
-
-                logging.info(f"Balance updated: {public_key} => {new_balance}")
-                return True
+        except sqlite3.Error as e:
+            logging.error(f"Failed to retrieve balance: {e}")
+            return 0
+
+    @staticmethod
+    def _debit(cursor, address, units):
+        """Guarded debit: returns False, changing nothing, if the balance is too low."""
+        cursor.execute(
+            "UPDATE balances SET balance = balance - ? WHERE public_key = ? AND balance >= ?", (units, address, units)
+        )
+        return cursor.rowcount == 1
+
+    @staticmethod
+    def _confirmed(cursor, tx_hash):
+        """True if a transaction id is in the ledger or among the pruned rows."""
+        if cursor.execute("SELECT 1 FROM transactions WHERE tx_hash = ?", (tx_hash,)).fetchone():
+            return True
+        return cursor.execute(
+            "SELECT 1 FROM pruned_transactions WHERE tx_hash = ?", (bytes.fromhex(tx_hash),)
+        ).fetchone() is not None
+
+    @staticmethod
+    def _nonce_confirmed(cursor, sender, nonce):
+        return cursor.execute(
+            "SELECT 1 FROM transactions WHERE sender = ? AND nonce = ?", (sender, nonce)
+        ).fetchone() is not None
+
+    @staticmethod
+    def _credit(cursor, address, units):
+        cursor.execute("""
+            INSERT INTO balances (public_key, balance) VALUES (?, ?)
+            ON CONFLICT(public_key) DO UPDATE SET balance = balance + excluded.balance
+        """, (address, units))
+
+    @timed_query
+    def add_transactions_bulk(self, transfers):
+        """
+        Validate and apply a batch of transfers in one write transaction.
+        Transfers are applied in order, so a transfer may spend funds received
+        earlier in the same batch. Each sender pays amount + fee through a
+        guarded debit; transfers from NETWORK (block rewards) mint new funds.
+        A transfer whose id or (sender, nonce) is already confirmed, or taken
+        earlier in the batch, is rejected on its own rather than failing the batch.
+        Amounts are coins as signed and are converted to base units here.
+        Returns one result dict per transfer.
+        """
+        results, valid = self._prepare_transfers(transfers)
+        if not valid:
+            return results
+
+        try:
+            with self.balance_cache.write() as deltas, self.pool.transaction() as conn:
+                accepted = self._apply_transfers(conn.cursor(), valid, results, deltas)
+                logging.info(f"Batch committed: {accepted} accepted, {len(transfers) - accepted} rejected")
 
         except sqlite3.Error as e:
-            logging.error(f"Failed to update balance: {e}")
-        return False
+            logging.error(f"Failed to add transaction batch: {e}")
+            for result in results:
+                if result["accepted"] or result["error"] is None:
+                    result["accepted"] = False
+                    result["error"] = "Transaction failed"
 
-    def get_balance(self, public_key):
-        """Get the balance of a given public key."""
+        return results
+
+    @staticmethod
+    def _prepare_transfers(transfers):
+        """Shape and amount checks. Returns (one result dict per transfer, the transfers left to apply)."""
+        results = []
+        valid = []
+        for index, transfer in enumerate(transfers):
+            if not isinstance(transfer, dict) or not all(k in transfer for k in ("sender", "recipient", "amount")):
+                results.append({"index": index, "accepted": False, "error": "Missing transaction fields"})
+                continue
+            amount, fee = transaction_units(transfer)
+            if amount is None or amount <= 0 or fee is None or fee < 0:
+                results.append({"index": index, "accepted": False, "error": "Invalid transaction amount"})
+                continue
+            nonce = transfer_nonce(transfer)
+            results.append({"index": index, "accepted": False, "error": None})
+            valid.append((index, transfer["sender"], transfer["recipient"], amount, fee, transaction_id(transfer), nonce))
+        return results, valid
+
+    def _apply_transfers(self, cursor, valid, results, deltas):
+        """
+        Apply prepared transfers in order inside the caller's write
+        transaction, marking each result and adding balance changes to
+        `deltas`. Returns the number accepted.
+        """
+        rows = []
+        seen = set()
+        for index, sender, recipient, amount, fee, tx_hash, nonce in valid:
+            if tx_hash in seen or self._confirmed(cursor, tx_hash):
+                results[index]["error"] = "Duplicate transaction"
+                continue
+            if nonce is not None and ((sender, nonce) in seen or self._nonce_confirmed(cursor, sender, nonce)):
+                results[index]["error"] = "Duplicate nonce"
+                continue
+            if sender != NETWORK:
+                if not self._debit(cursor, sender, amount + fee):
+                    results[index]["error"] = "Insufficient balance"
+                    continue
+                deltas[sender] = deltas.get(sender, 0) - amount - fee
+            self._credit(cursor, recipient, amount)
+            deltas[recipient] = deltas.get(recipient, 0) + amount
+            rows.append((sender, recipient, amount, fee, tx_hash, nonce))
+            seen.add(tx_hash)
+            if nonce is not None:
+                seen.add((sender, nonce))
+            results[index]["accepted"] = True
+
+        cursor.executemany(
+            "INSERT INTO transactions (sender, recipient, amount, fee, tx_hash, nonce) VALUES (?, ?, ?, ?, ?, ?)", rows
+        )
+        return len(rows)
+
+    @staticmethod
+    def _revert_transfers(cursor, transactions, deltas):
+        """Undo applied transactions (newest first) inside the caller's write transaction: delete the rows, reverse the balances."""
+        changes = {}
+        for tx in transactions:
+            amount, fee = transaction_units(tx)
+            if tx["sender"] != NETWORK:
+                changes[tx["sender"]] = changes.get(tx["sender"], 0) + amount + fee
+            changes[tx["recipient"]] = changes.get(tx["recipient"], 0) - amount
+        cursor.executemany("DELETE FROM transactions WHERE tx_hash = ?", ((transaction_id(tx),) for tx in transactions))
+        cursor.executemany("UPDATE balances SET balance = balance + ? WHERE public_key = ?",
+                           ((delta, address) for address, delta in changes.items()))
+        for address, delta in changes.items():
+            deltas[address] = deltas.get(address, 0) + delta
+
+    @timed_query
+    def add_block(self, transfers, make_block, hash_block, store=None):
+        """
+        Apply `transfers` (skipping any the ledger rejects), build the block
+        from the accepted ones with make_block(accepted) and store it, in one
+        write transaction, so the ledger never holds rows of a block that was
+        not stored. Returns the block, or None if nothing was committed.
+        """
+        def apply(cursor, deltas):
+            results, valid = self._prepare_transfers(transfers)
+            self._apply_transfers(cursor, valid, results, deltas)
+            return [make_block([tx for tx, result in zip(transfers, results) if result["accepted"]])]
+
+        blocks = self._write_chain(None, [], apply, hash_block, store)
+        return blocks[0] if blocks else None
+
+    @timed_query
+    def replace_blocks(self, fork_height, removed, blocks, hash_block, store=None):
+        """
+        Switch the ledger and the stored chain from `removed` (the blocks
+        above fork_height, lowest first) to `blocks`, in one write
+        transaction: the removed blocks' rows are deleted and their balance
+        changes reversed, every transaction of the new blocks is applied and
+        the blocks are stored. If any transaction is rejected or anything
+        fails, all of it is rolled back. Returns False in that case.
+        """
+        def apply(cursor, deltas):
+            for block in blocks:
+                results, valid = self._prepare_transfers(block["transactions"])
+                self._apply_transfers(cursor, valid, results, deltas)
+                rejected = next((result for result in results if not result["accepted"]), None)
+                if rejected is not None:
+                    raise ValueError(f"block {block['index']} transaction {rejected['index']}: {rejected['error']}")
+            return blocks
+
+        return self._write_chain(fork_height, removed, apply, hash_block, store) is not None
+
+    def _write_chain(self, fork_height, removed, apply, hash_block, store):
+        """
+        One BEGIN IMMEDIATE ... COMMIT around a change of the chain tip: revert
+        `removed`, let apply(cursor, deltas) apply new transactions and return
+        the new blocks, store them (above fork_height; None: on top of the
+        tip) and record the ledger tip. Blocks kept in a BlockStore (`store`)
+        are written just before COMMIT and the removed ones put back if
+        anything fails. Returns the new blocks, or None after a rollback.
+        """
+        store_changed = False
         try:
-            with sqlite3.connect(self.db_name, timeout=15, isolation_level=None) as conn:
+            with self.balance_cache.write() as deltas, self.pool.transaction() as conn:
                 cursor = conn.cursor()
-                cursor.execute("SELECT balance FROM balances WHERE public_key = ?", (public_key,))
-                result = cursor.fetchone()
-                return float(result[0]) if result else 0.0  # Ensure float return
+                self._revert_transfers(cursor, [tx for block in reversed(removed) for tx in reversed(block["transactions"])],
+                                       deltas)
+                blocks = apply(cursor, deltas)
+                if fork_height is None:
+                    fork_height = blocks[0]["index"] - 1
+                if store is None:
+                    cursor.execute("DELETE FROM block_transactions WHERE height > ?", (fork_height,))
+                    cursor.execute("DELETE FROM blocks WHERE height > ?", (fork_height,))
+                    for block in blocks:
+                        self._insert_block(cursor, block, hash_block(block))
+                tip = blocks[-1]
+                cursor.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                               (LEDGER_TIP_KEY, json.dumps({"height": tip["index"], "hash": hash_block(tip)})))
+                if store is not None:
+                    store_changed = True
+                    if not store.delete_blocks_from(fork_height + 1):
+                        raise ValueError(f"failed to delete stored blocks above {fork_height}")
+                    for block in blocks:
+                        if not store.save_block(block, hash_block(block)):
+                            raise ValueError(f"failed to store block {block['index']}")
+                return blocks
+
+        except (sqlite3.Error, ValueError) as e:
+            if store_changed:
+                # The rolled-back ledger still describes the removed blocks
+                store.delete_blocks_from(fork_height + 1)
+                for block in removed:
+                    store.save_block(block, hash_block(block))
+            logging.error(f"Failed to commit blocks above height {fork_height}: {e}")
+            return None
+
+    @timed_query
+    def rebuild_balances(self):
+        """
+        Recompute every balance from the transactions table on top of the
+        ledger base left by pruning, e.g. after a crash or manual edits left the
+        materialized balances out of step. Registered wallets without
+        transactions keep a zero row. Returns the number of addresses, or None
+        on failure.
+        """
+        try:
+            with self.pool.transaction() as conn:
+                conn.execute("DELETE FROM balances")
+                conn.execute("""
+                    INSERT INTO balances (public_key, balance)
+                    SELECT address, SUM(delta) FROM (
+                        SELECT public_key AS address, balance AS delta FROM ledger_base
+                        UNION ALL
+                        SELECT recipient, amount FROM transactions
+                        UNION ALL
+                        SELECT sender, -(amount + fee) FROM transactions WHERE sender != ?
+                    ) GROUP BY address
+                """, (NETWORK,))
+                conn.execute("INSERT OR IGNORE INTO balances (public_key, balance) SELECT public_key, 0 FROM wallets")
+                count = conn.execute("SELECT COUNT(*) FROM balances").fetchone()[0]
+            # After COMMIT, so no fill can cache a balance read before it
+            self.balance_cache.clear()
+            logging.info(f"Rebuilt balances for {count} addresses.")
+            return count
 
         except sqlite3.Error as e:
-            logging.error(f"Failed to retrieve balance: {e}")
-            return 0.0
+            logging.error(f"Failed to rebuild balances: {e}")
+            return None
+
+    @timed_query
+    def last_transaction_id(self):
+        """Id of the newest transaction row, or 0 if there are none."""
+        try:
+            with self.pool.connection() as conn:
+                return conn.execute("SELECT COALESCE(MAX(id), 0) FROM transactions").fetchone()[0]
 
-    def add_transaction(self, sender, recipient, amount):
-        """Add a transaction to the database and update balances atomically."""
-        if amount <= 0:
-            logging.warning("Invalid transaction amount.")
+        except sqlite3.Error as e:
+            logging.error(f"Failed to read the last transaction id: {e}")
+            return None
+
+    def iter_ledger_rows(self, after=0, up_to=None, limit=None):
+        """Yield full transaction rows (including tx_hash) with after < id <= up_to, oldest first."""
+        query = "SELECT id, sender, recipient, amount, fee, tx_hash, timestamp FROM transactions WHERE id > ?"
+        params = [after]
+        if up_to is not None:
+            query += " AND id <= ?"
+            params.append(up_to)
+        query += " ORDER BY id"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        try:
+            with self.pool.connection() as conn:
+                for t in conn.execute(query, params):
+                    yield {"id": t[0], "sender": t[1], "recipient": t[2], "amount": t[3], "fee": t[4],
+                           "tx_hash": t[5], "timestamp": t[6]}
+
+        except sqlite3.Error as e:
+            logging.error(f"Failed to read ledger rows: {e}")
+
+    @timed_query
+    def prune_transactions(self, up_to):
+        """
+        Fold every transaction row with id <= up_to into ledger_base, keep its
+        hash in pruned_transactions and delete the row, in one commit. Balances
+        do not change. Returns the number of rows pruned, or None on failure.
+        """
+        try:
+            with self.pool.transaction() as conn:
+                conn.execute("""
+                    INSERT INTO ledger_base (public_key, balance)
+                    SELECT address, SUM(delta) FROM (
+                        SELECT recipient AS address, amount AS delta FROM transactions WHERE id <= ?
+                        UNION ALL
+                        SELECT sender, -(amount + fee) FROM transactions WHERE id <= ? AND sender != ?
+                    ) WHERE true GROUP BY address
+                    ON CONFLICT(public_key) DO UPDATE SET balance = balance + excluded.balance
+                """, (up_to, up_to, NETWORK))
+                conn.executemany("INSERT OR IGNORE INTO pruned_transactions (tx_hash) VALUES (?)", (
+                    (bytes.fromhex(tx_hash),) for (tx_hash,) in conn.execute(
+                        "SELECT tx_hash FROM transactions WHERE id <= ? AND tx_hash IS NOT NULL", (up_to,)
+                    ).fetchall()
+                ))
+                count = conn.execute("DELETE FROM transactions WHERE id <= ?", (up_to,)).rowcount
+                logging.info(f"Pruned {count} transactions up to id {up_to}.")
+                return count
+
+        except sqlite3.Error as e:
+            logging.error(f"Failed to prune transactions: {e}")
+            return None
+
+    @timed_query
+    def import_balances(self, balances):
+        """
+        Start an empty ledger from snapshot balances: they become both the
+        stored balances and the ledger base. Returns False if the ledger
+        already has history.
+        """
+        try:
+            with self.pool.transaction() as conn:
+                if conn.execute("SELECT EXISTS (SELECT 1 FROM transactions) OR EXISTS (SELECT 1 FROM ledger_base)").fetchone()[0]:
+                    logging.warning("Cannot import balances into a ledger that already has history.")
+                    return False
+                conn.execute("DELETE FROM balances")
+                conn.executemany("INSERT INTO balances (public_key, balance) VALUES (?, ?)", balances.items())
+                conn.executemany("INSERT INTO ledger_base (public_key, balance) VALUES (?, ?)", balances.items())
+            self.balance_cache.clear()
+            logging.info(f"Imported balances for {len(balances)} addresses.")
+            return True
+
+        except sqlite3.Error as e:
+            logging.error(f"Failed to import balances: {e}")
             return False
 
-        sender_balance = self.get_balance(sender)
-        if sender_balance < amount:
-            logging.warning(f"Insufficient funds. Sender has only {sender_balance}.")
+    def checkpoint_wal(self):
+        """Copy the write-ahead log into the database file and truncate it."""
+        try:
+            with self.pool.connection() as conn:
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+        except sqlite3.Error as e:
+            logging.error(f"Failed to checkpoint the WAL: {e}")
+
+    @timed_query
+    def has_transaction(self, tx_hash):
+        """Check whether a transaction with this id (see signatures.transaction_id) has already been applied."""
+        try:
+            with self.pool.connection() as conn:
+                return self._confirmed(conn.cursor(), tx_hash)
+
+        except sqlite3.Error as e:
+            logging.error(f"Failed to look up transaction: {e}")
             return False
 
+    @timed_query
+    def has_nonce(self, sender, nonce):
+        """Check whether a transaction from `sender` with this nonce has already been applied."""
         try:
-            with sqlite3.connect(self.db_name, timeout=15, isolation_level=None) as conn:
-                cursor = conn.cursor()
+            with self.pool.connection() as conn:
+                return self._nonce_confirmed(conn.cursor(), sender, nonce)
 
-                cursor.execute("""
-                    INSERT INTO transactions (sender, recipient, amount) VALUES (?, ?, ?)
-                """, (sender, recipient, amount))
+        except sqlite3.Error as e:
+            logging.error(f"Failed to look up nonce: {e}")
+            return False
 
-                # Deduct from sender
-                cursor.execute("UPDATE balances SET balance = balance - ? WHERE public_key = ?", (amount, sender))
+    @timed_query
+    def confirmed_ids(self, tx_hashes):
+        """The subset of transaction ids already applied or pruned, looked up in chunks of 500."""
+        tx_hashes = list(tx_hashes)
+        try:
+            with self.pool.connection() as conn:
+                confirmed = set()
+                for i in range(0, len(tx_hashes), 500):
+                    chunk = tx_hashes[i:i + 500]
+                    marks = ",".join("?" * len(chunk))
+                    confirmed.update(tx_hash for (tx_hash,) in conn.execute(
+                        f"SELECT tx_hash FROM transactions WHERE tx_hash IN ({marks})", chunk
+                    ))
+                    confirmed.update(tx_hash.hex() for (tx_hash,) in conn.execute(
+                        f"SELECT tx_hash FROM pruned_transactions WHERE tx_hash IN ({marks})",
+                        [bytes.fromhex(tx_hash) for tx_hash in chunk]
+                    ))
+                return confirmed
 
-                # Add to recipient
-                cursor.execute("""
-                    INSERT INTO balances (public_key, balance) VALUES (?, ?)
-                    ON CONFLICT(public_key) DO UPDATE SET balance = balance + ?
-                """, (recipient, amount, amount))
+        except sqlite3.Error as e:
+            logging.error(f"Failed to look up transactions: {e}")
+            return set()
 
-                logging.info(f"Transaction successful: {sender} -> {recipient} ({amount})")
+    @timed_query
+    def confirmed_nonces(self, pairs):
+        """The subset of (sender, nonce) pairs already applied, looked up in chunks of 500."""
+        pairs = list(pairs)
+        try:
+            with self.pool.connection() as conn:
+                confirmed = set()
+                for i in range(0, len(pairs), 500):
+                    chunk = pairs[i:i + 500]
+                    confirmed.update(conn.execute(
+                        "SELECT t.sender, t.nonce FROM transactions t JOIN (VALUES "
+                        f"{','.join(['(?, ?)'] * len(chunk))}) AS v ON t.sender = v.column1 AND t.nonce = v.column2",
+                        [value for pair in chunk for value in pair]
+                    ))
+                return confirmed
+
+        except sqlite3.Error as e:
+            logging.error(f"Failed to look up nonces: {e}")
+            return set()
+
+    @timed_query
+    def rekey_transactions(self, keys):
+        """
+        Move ledger rows and pruned hashes from the older whole-dict hashes to
+        transaction ids, once. `keys` yields (old hash, transaction id,
+        transfer_nonce) for every transaction on the chain. Rows whose id or nonce is already
+        taken (a replay confirmed before ids existed) keep their old key.
+        Returns False on failure.
+        """
+        try:
+            with self.pool.transaction() as conn:
+                for old, new, nonce in keys:
+                    conn.execute("UPDATE OR IGNORE transactions SET tx_hash = ?, nonce = ? WHERE tx_hash = ?",
+                                 (new, nonce, old))
+                    conn.execute("UPDATE OR IGNORE pruned_transactions SET tx_hash = ? WHERE tx_hash = ?",
+                                 (bytes.fromhex(new), bytes.fromhex(old)))
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, 'true')", (TX_IDS_KEY,))
+                logging.info("Ledger rows re-keyed by transaction id.")
                 return True
 
         except sqlite3.Error as e:
-            logging.error(f"Failed to add transaction: {e}")
-        return False
+            logging.error(f"Failed to re-key transactions: {e}")
+            return False
+
+    def iter_transactions(self, after=0, limit=100, address=None, since=None, until=None):
+        """
+        Yield transactions with id greater than `after`, oldest first, at most `limit` rows.
+        Optionally filter by an address (as sender or recipient) and a timestamp range
+        [since, until). Pass the last id seen as `after` to fetch the next page.
+        """
+        columns = "id, sender, recipient, amount, fee, timestamp"
+        conditions = ["id > ?"]
+        params = [after]
+        if since is not None:
+            conditions.append("timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("timestamp < ?")
+            params.append(until)
+        where = " AND ".join(conditions)
+
+        if address is None:
+            query = f"SELECT {columns} FROM transactions WHERE {where} ORDER BY id LIMIT ?"
+            params.append(limit)
+        else:
+            # Each branch walks its own index in id order; UNION drops self-transfer duplicates
+            query = f"""
+                SELECT * FROM (SELECT {columns} FROM transactions WHERE sender = ? AND {where} ORDER BY id LIMIT ?)
+                UNION
+                SELECT * FROM (SELECT {columns} FROM transactions WHERE recipient = ? AND {where} ORDER BY id LIMIT ?)
+                ORDER BY id LIMIT ?
+            """
+            params = [address, *params, limit, address, *params, limit, limit]
 
-    def get_transactions(self):
-        """Retrieve all transactions."""
         try:
-            with sqlite3.connect(self.db_name, timeout=15, isolation_level=None) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT sender, recipient, amount, timestamp FROM transactions")
-                transactions = cursor.fetchall()
-                return [{"sender": t[0], "recipient": t[1], "amount": t[2], "timestamp": t[3]} for t in transactions]
+            with self.pool.connection() as conn:
+                for t in conn.execute(query, params):
+                    yield {"id": t[0], "sender": t[1], "recipient": t[2], "amount": t[3], "fee": t[4], "timestamp": t[5]}
 
         except sqlite3.Error as e:
             logging.error(f"Failed to fetch transactions: {e}")
+
+    @timed_query
+    def get_transactions(self, after=0, limit=100, address=None, since=None, until=None):
+        """Retrieve one page of transactions as a list (see iter_transactions)."""
+        return list(self.iter_transactions(after, limit, address, since, until))
+
+    @timed_query
+    def save_block(self, block, block_hash):
+        """Persist a block header and its transactions. Returns False if the height is taken."""
+        try:
+            with self.pool.transaction() as conn:
+                self._insert_block(conn.cursor(), block, block_hash)
+                return True
+
+        except sqlite3.IntegrityError:
+            logging.warning(f"Block {block['index']} already stored.")
+        except sqlite3.Error as e:
+            logging.error(f"Failed to store block: {e}")
+        return False
+
+    @staticmethod
+    def _insert_block(cursor, block, block_hash):
+        header = {key: value for key, value in block.items() if key != "transactions"}
+        cursor.execute(
+            "INSERT INTO blocks (height, hash, previous_hash, header) VALUES (?, ?, ?, ?)",
+            (block["index"], block_hash, block["previous_hash"], json.dumps(header))
+        )
+        cursor.executemany(
+            "INSERT INTO block_transactions (height, position, tx) VALUES (?, ?, ?)",
+            ((block["index"], position, json.dumps(tx)) for position, tx in enumerate(block["transactions"]))
+        )
+        logging.info(f"Block {block['index']} stored: {block_hash}")
+
+    @timed_query
+    def load_block(self, height):
+        """Load a block by its 1-based height, or None if it is not stored."""
+        try:
+            with self.pool.connection() as conn:
+                row = conn.execute("SELECT header FROM blocks WHERE height = ?", (height,)).fetchone()
+                if row is None:
+                    return None
+                block = json.loads(row[0])
+                block["transactions"] = [
+                    json.loads(tx) for (tx,) in conn.execute(
+                        "SELECT tx FROM block_transactions WHERE height = ? ORDER BY position", (height,)
+                    )
+                ]
+                return block
+
+        except sqlite3.Error as e:
+            logging.error(f"Failed to load block {height}: {e}")
+            return None
+
+    @timed_query
+    def load_blocks(self, start, end):
+        """Load the stored blocks with start <= height <= end, in height order."""
+        try:
+            with self.pool.connection() as conn:
+                blocks = {}
+                for height, header in conn.execute(
+                    "SELECT height, header FROM blocks WHERE height BETWEEN ? AND ? ORDER BY height", (start, end)
+                ):
+                    blocks[height] = json.loads(header)
+                    blocks[height]["transactions"] = []
+                for height, tx in conn.execute(
+                    "SELECT height, tx FROM block_transactions WHERE height BETWEEN ? AND ? ORDER BY height, position",
+                    (start, end)
+                ):
+                    blocks[height]["transactions"].append(json.loads(tx))
+                return list(blocks.values())
+
+        except sqlite3.Error as e:
+            logging.error(f"Failed to load blocks {start}-{end}: {e}")
+            return []
+
+    @timed_query
+    def load_headers(self, start, end):
+        """Load block headers (without transactions) with start <= height <= end, each with its hash."""
+        try:
+            with self.pool.connection() as conn:
+                headers = []
+                for block_hash, header in conn.execute(
+                    "SELECT hash, header FROM blocks WHERE height BETWEEN ? AND ? ORDER BY height", (start, end)
+                ):
+                    header = json.loads(header)
+                    header["hash"] = block_hash
+                    headers.append(header)
+                return headers
+
+        except sqlite3.Error as e:
+            logging.error(f"Failed to load headers {start}-{end}: {e}")
             return []
 
+    @timed_query
+    def delete_blocks_from(self, height):
+        """Delete every stored block at or above a height. Returns False on failure."""
+        try:
+            with self.pool.transaction() as conn:
+                conn.execute("DELETE FROM block_transactions WHERE height >= ?", (height,))
+                conn.execute("DELETE FROM blocks WHERE height >= ?", (height,))
+                logging.info(f"Blocks from height {height} deleted.")
+                return True
+
+        except sqlite3.Error as e:
+            logging.error(f"Failed to delete blocks: {e}")
+            return False
+
+    @timed_query
+    def load_tip(self):
+        """Load the highest stored block, or None if no blocks are stored."""
+        try:
+            with self.pool.connection() as conn:
+                row = conn.execute("SELECT MAX(height) FROM blocks").fetchone()
+        except sqlite3.Error as e:
+            logging.error(f"Failed to load chain tip: {e}")
+            return None
+        return self.load_block(row[0]) if row[0] is not None else None
+
+    @timed_query
+    def load_base(self):
+        """Height of the lowest stored block, or None if no blocks are stored."""
+        try:
+            with self.pool.connection() as conn:
+                return conn.execute("SELECT MIN(height) FROM blocks").fetchone()[0]
+
+        except sqlite3.Error as e:
+            logging.error(f"Failed to load chain base: {e}")
+            return None
+
+    @timed_query
+    def load_tip_header(self):
+        """Height and hash of the highest stored block as {"index", "hash"}, or None. One indexed lookup."""
+        try:
+            with self.pool.connection() as conn:
+                row = conn.execute("SELECT height, hash FROM blocks ORDER BY height DESC LIMIT 1").fetchone()
+                return {"index": row[0], "hash": row[1]} if row else None
+
+        except sqlite3.Error as e:
+            logging.error(f"Failed to load chain tip: {e}")
+            return None
+
+    @timed_query
+    def get_meta(self, key):
+        """Read a JSON value from the meta table, or None if it is not set."""
+        try:
+            with self.pool.connection() as conn:
+                row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+                return json.loads(row[0]) if row else None
+
+        except sqlite3.Error as e:
+            logging.error(f"Failed to read {key}: {e}")
+            return None
+
+    @timed_query
+    def set_meta(self, key, value):
+        """Store a JSON value in the meta table."""
+        try:
+            with self.pool.connection() as conn:
+                conn.execute(
+                    "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                    (key, json.dumps(value))
+                )
+
+        except sqlite3.Error as e:
+            logging.error(f"Failed to store {key}: {e}")
+
+    @timed_query
+    def get_balances(self, addresses=None):
+        """Return stored balances as a dict, for every address or only the given ones."""
+        try:
+            with self.pool.connection() as conn:
+                if addresses is None:
+                    return dict(conn.execute("SELECT public_key, balance FROM balances"))
+                addresses = list(addresses)
+                balances = {}
+                for i in range(0, len(addresses), 500):
+                    chunk = addresses[i:i + 500]
+                    balances.update(conn.execute(
+                        f"SELECT public_key, balance FROM balances WHERE public_key IN ({','.join('?' * len(chunk))})",
+                        chunk
+                    ))
+                return balances
+
+        except sqlite3.Error as e:
+            logging.error(f"Failed to read balances: {e}")
+            return {}
+
+    @timed_query
     def list_wallets(self):
         """List all registered wallets."""
         try:
-            with sqlite3.connect(self.db_name, timeout=15, isolation_level=None) as conn:
+            with self.pool.connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("SELECT public_key FROM wallets")
                 wallets = cursor.fetchall()
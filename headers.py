@@ -0,0 +1,36 @@
+import hashlib
+import json
+
+# Fields covered by the block hash; transactions are committed through merkle_root
+HEADER_FIELDS = ("index", "timestamp", "proof", "previous_hash", "merkle_root", "difficulty", "target")
+
+
+def block_hash(block):
+    """Creates a SHA-256 hash of a block header."""
+    header = {key: block[key] for key in HEADER_FIELDS if key in block}
+    block_string = json.dumps(header, sort_keys=True).encode()
+    return hashlib.sha256(block_string).hexdigest()
+
+
+def valid_proof(last_proof, proof, target):
+    """Checks a proof against the previous block's proof: its hash, as an integer, must not exceed the target."""
+    guess = f"{last_proof}{proof}".encode()
+    return int.from_bytes(hashlib.sha256(guess).digest(), "big") <= target
+
+
+def difficulty_to_target(difficulty):
+    """Converts a leading-hex-zeros difficulty into a 32-byte big-endian target."""
+    return ((1 << (256 - 4 * difficulty)) - 1).to_bytes(32, "big")
+
+
+def block_target(header):
+    """
+    Target a block's proof was mined against, as an integer. Older blocks
+    recorded a count of leading hex zeros instead; blocks with neither
+    (genesis) return None.
+    """
+    if "target" in header:
+        return int(header["target"], 16)
+    if "difficulty" in header:
+        return int.from_bytes(difficulty_to_target(header["difficulty"]), "big")
+    return None
@@ -0,0 +1,163 @@
+import heapq
+import itertools
+import threading
+from database import from_units, transaction_units
+from signatures import transaction_id
+
+
+class MempoolEntry:
+    __slots__ = ("tx", "tx_hash", "sender", "nonce", "fee", "spend", "seq")
+
+    def __init__(self, tx, tx_hash, seq):
+        self.tx = tx
+        self.tx_hash = tx_hash
+        self.sender = tx["sender"]
+        self.nonce = tx.get("nonce")
+        amount, self.fee = transaction_units(tx)  # Base units
+        self.spend = amount + self.fee
+        self.seq = seq
+
+
+class Mempool:
+    """
+    Pending transactions waiting for a block.
+    Entries are indexed by transaction id (signatures.transaction_id),
+    pending spend is tracked per sender so overspends are rejected without
+    scanning the pool, and a fee-ordered heap feeds block templates. When full, the lowest-fee entry is evicted.
+    """
+
+    def __init__(self, max_size=50_000):
+        self.max_size = max_size
+        self.entries = {}  # tx_hash -> MempoolEntry
+        self.spends = {}  # sender -> total pending amount + fees, in base units
+        self.counts = {}  # sender -> number of pending transactions
+        self.nonces = {}  # sender -> set of pending nonces
+        self._by_fee = []  # (-fee, seq, tx_hash): highest fee, then oldest, first
+        self._by_eviction = []  # (fee, -seq, tx_hash): lowest fee, then newest, first
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, tx_hash):
+        return tx_hash in self.entries
+
+    def get(self, tx_hash):
+        entry = self.entries.get(tx_hash)
+        return entry.tx if entry else None
+
+    def pending_spend(self, sender):
+        """Base units the sender has committed to pending transactions."""
+        return self.spends.get(sender, 0)
+
+    def add(self, tx, balance, tx_hash=None):
+        """
+        Admit a transaction given the sender's confirmed balance in base units.
+        Returns (tx_hash, None) on success or (None, error) on rejection.
+        """
+        with self._lock:
+            result = self._add(tx, balance, tx_hash or transaction_id(tx))
+            self._compact()  # Evictions leave stale heap items behind too
+            return result
+
+    def add_batch(self, items):
+        """
+        Admit (tx, confirmed balance, tx_hash) items in order under one lock
+        acquisition. Returns one (tx_hash, error) pair per item, as add does.
+        """
+        with self._lock:
+            results = [self._add(tx, balance, tx_hash) for tx, balance, tx_hash in items]
+            self._compact()
+            return results
+
+    def _add(self, tx, balance, tx_hash):
+        if tx_hash in self.entries:
+            return None, "Duplicate transaction"
+        entry = MempoolEntry(tx, tx_hash, next(self._seq))
+        if entry.nonce is not None and entry.nonce in self.nonces.get(entry.sender, ()):
+            return None, "Duplicate nonce"
+        if self.spends.get(entry.sender, 0) + entry.spend > balance:
+            return None, "Insufficient balance"
+        if len(self.entries) >= self.max_size:
+            lowest = self._peek_eviction()
+            if lowest is None or entry.fee <= lowest.fee:
+                return None, "Mempool full"
+            self._remove(lowest.tx_hash)
+
+        self.entries[tx_hash] = entry
+        self.spends[entry.sender] = self.spends.get(entry.sender, 0) + entry.spend
+        self.counts[entry.sender] = self.counts.get(entry.sender, 0) + 1
+        if entry.nonce is not None:
+            self.nonces.setdefault(entry.sender, set()).add(entry.nonce)
+        heapq.heappush(self._by_fee, (-entry.fee, entry.seq, tx_hash))
+        heapq.heappush(self._by_eviction, (entry.fee, -entry.seq, tx_hash))
+        return tx_hash, None
+
+    def select(self, limit):
+        """Return up to `limit` (tx_hash, tx) pairs, highest fee first, without removing them."""
+        with self._lock:
+            selected = []
+            popped = []
+            while self._by_fee and len(selected) < limit:
+                item = heapq.heappop(self._by_fee)
+                entry = self.entries.get(item[2])
+                if entry is not None and entry.seq == item[1]:
+                    selected.append((entry.tx_hash, entry.tx))
+                    popped.append(item)
+            for item in popped:
+                heapq.heappush(self._by_fee, item)
+            return selected
+
+    def remove(self, tx_hashes):
+        """Drop transactions, e.g. once they are included in a block."""
+        with self._lock:
+            for tx_hash in tx_hashes:
+                self._remove(tx_hash)
+            self._compact()
+
+    def stats(self):
+        with self._lock:
+            fees = [entry.fee for entry in self.entries.values()]
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "senders": len(self.spends),
+                "total_fees": from_units(sum(fees)),
+                "max_fee": from_units(max(fees, default=0)),
+                "min_fee": from_units(min(fees, default=0))
+            }
+
+    def _remove(self, tx_hash):
+        entry = self.entries.pop(tx_hash, None)
+        if entry is None:
+            return
+        self.counts[entry.sender] -= 1
+        if self.counts[entry.sender]:
+            self.spends[entry.sender] -= entry.spend
+        else:
+            del self.counts[entry.sender]
+            del self.spends[entry.sender]
+        if entry.nonce is not None:
+            nonces = self.nonces[entry.sender]
+            nonces.discard(entry.nonce)
+            if not nonces:
+                del self.nonces[entry.sender]
+
+    def _peek_eviction(self):
+        # Heaps use lazy deletion: skip items whose entry is gone
+        heap = self._by_eviction
+        while heap:
+            entry = self.entries.get(heap[0][2])
+            if entry is not None and entry.seq == -heap[0][1]:
+                return entry
+            heapq.heappop(heap)
+        return None
+
+    def _compact(self):
+        # Rebuild the heaps once stale items outnumber live ones
+        if max(len(self._by_fee), len(self._by_eviction)) > 2 * len(self.entries) + 64:
+            self._by_fee = [(-e.fee, e.seq, h) for h, e in self.entries.items()]
+            self._by_eviction = [(e.fee, -e.seq, h) for h, e in self.entries.items()]
+            heapq.heapify(self._by_fee)
+            heapq.heapify(self._by_eviction)
@@ -0,0 +1,70 @@
+import hashlib
+import json
+
+EMPTY_ROOT = "0" * 64  # Merkle root of a block without transactions
+
+
+def hash_transaction(tx):
+    """Creates the SHA-256 leaf hash of a transaction."""
+    return hashlib.sha256(json.dumps(tx, sort_keys=True).encode()).hexdigest()
+
+
+def _hash_pair(left, right):
+    return hashlib.sha256(bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+
+def _next_level(level):
+    if len(level) % 2:
+        level = level + [level[-1]]  # Odd levels pair the last node with itself
+    return [_hash_pair(level[i], level[i + 1]) for i in range(0, len(level), 2)]
+
+
+def _mutated(level):
+    # Two real siblings that are equal: the list hashes like one with its odd tail padded (CVE-2012-2459)
+    return any(level[i] == level[i + 1] for i in range(0, len(level) - 1, 2))
+
+
+def merkle_root(tx_hashes):
+    """
+    Computes the Merkle root of a list of transaction hashes. Returns None if
+    a level holds two equal siblings, since [a, b, c, c] would otherwise share
+    the root of [a, b, c], so no stored merkle_root matches such a list.
+    """
+    if not tx_hashes:
+        return EMPTY_ROOT
+    level = list(tx_hashes)
+    while len(level) > 1:
+        if _mutated(level):
+            return None
+        level = _next_level(level)
+    return level[0]
+
+
+def merkle_proof(tx_hashes, index):
+    """
+    Builds the inclusion proof for the transaction at `index`: the sibling
+    hash at each level, bottom up, and which side it sits on.
+    """
+    if not 0 <= index < len(tx_hashes):
+        raise IndexError("transaction index out of range")
+    proof = []
+    level = list(tx_hashes)
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        sibling = index ^ 1
+        proof.append({"hash": level[sibling], "position": "left" if sibling < index else "right"})
+        level = _next_level(level)
+        index //= 2
+    return proof
+
+
+def verify_proof(tx_hash, proof, root):
+    """Checks that a transaction hash and its proof lead to the given Merkle root."""
+    current = tx_hash
+    for step in proof:
+        if step["position"] == "left":
+            current = _hash_pair(step["hash"], current)
+        else:
+            current = _hash_pair(current, step["hash"])
+    return current == root
@@ -0,0 +1,138 @@
+import hashlib
+import multiprocessing
+import os
+import threading
+
+CHUNK_SIZE = 50_000  # Nonces handed to a worker at a time
+CHECK_INTERVAL = 4096  # How often a worker polls the shared early-exit signal
+
+NOT_FOUND = -1
+
+
+def search_range(last_proof, target, start, stop, found=None):
+    """
+    Returns the smallest nonce in [start, stop) whose hash is <= target, or None.
+    The last_proof prefix is hashed once and copied for every nonce, and the raw
+    digest is compared against the target bytes instead of building a hexdigest.
+    """
+    prefix = hashlib.sha256(str(last_proof).encode())
+    copy = prefix.copy
+    nonce = start
+    while nonce < stop:
+        if found is not None:
+            best = found.value
+            if best != NOT_FOUND and best < nonce:
+                return None  # Another worker already holds a smaller nonce
+        end = min(nonce + CHECK_INTERVAL, stop)
+        for n in range(nonce, end):
+            h = copy()
+            h.update(str(n).encode())
+            if h.digest() <= target:
+                return n
+        nonce = end
+    return None
+
+
+# Shared early-exit signal, installed in each pool process by _init_worker
+_found = None
+
+
+def _init_worker(found):
+    global _found
+    _found = found
+
+
+def _search_chunk(args):
+    last_proof, target, start, stop = args
+    nonce = search_range(last_proof, target, start, stop, _found)
+    if nonce is not None:
+        with _found.get_lock():
+            if _found.value == NOT_FOUND or nonce < _found.value:
+                _found.value = nonce
+    return nonce
+
+
+class SerialMiner:
+    """Searches nonces in the calling thread."""
+
+    def mine(self, last_proof, target, cancel=None):
+        """Returns the smallest valid nonce, or None if cancel is set first."""
+        start = 0
+        while cancel is None or not cancel.is_set():
+            nonce = search_range(last_proof, target, start, start + CHUNK_SIZE)
+            if nonce is not None:
+                return nonce
+            start += CHUNK_SIZE
+        return None
+
+    def close(self):
+        pass
+
+
+class ParallelMiner:
+    """
+    Splits the nonce space into chunks and searches them on a process pool.
+    Chunks are collected in nonce order, so the first hit is the smallest
+    valid nonce and the result matches a serial search.
+    """
+
+    def __init__(self, processes=None, chunk_size=CHUNK_SIZE):
+        self.processes = processes or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self._pool = None
+        self._found = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._found = multiprocessing.Value("q", NOT_FOUND)
+            self._pool = multiprocessing.Pool(
+                self.processes, initializer=_init_worker, initargs=(self._found,)
+            )
+        return self._pool
+
+    def mine(self, last_proof, target, cancel=None):
+        """Returns the smallest valid nonce, or None if cancel is set first."""
+        with self._lock:
+            pool = self._get_pool()
+            self._found.value = NOT_FOUND
+            window = self.processes * 2
+            pending = {}
+            next_start = 0
+            try:
+                while True:
+                    while len(pending) < window:
+                        best = self._found.value
+                        if best != NOT_FOUND and next_start > best:
+                            break
+                        args = (last_proof, target, next_start, next_start + self.chunk_size)
+                        pending[next_start] = pool.apply_async(_search_chunk, (args,))
+                        next_start += self.chunk_size
+
+                    # Every chunk below the lowest pending one came back empty
+                    lowest = min(pending)
+                    while not pending[lowest].ready():
+                        if cancel is not None and cancel.is_set():
+                            return None
+                        pending[lowest].wait(0.1)
+                    nonce = pending.pop(lowest).get()
+                    if nonce is not None:
+                        return nonce
+            finally:
+                # Let in-flight chunks see the exit signal before the next search resets it
+                self._found.value = 0
+                for result in pending.values():
+                    result.wait()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+
+def create_miner(processes=None):
+    """Returns a parallel miner when more than one core is available."""
+    processes = processes or os.cpu_count() or 1
+    if processes > 1:
+        return ParallelMiner(processes)
+    return SerialMiner()
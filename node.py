@@ -1,60 +1,236 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, Response, current_app, g, jsonify, redirect, request
+from werkzeug.local import LocalProxy
 from blockchain import Blockchain
+from blockstore import BlockStore, copy_blocks
+from codec import BINARY, encode_blocks, encode_headers
+from database import Database, from_units
+from merkle import hash_transaction, merkle_proof
+from metrics import CONTENT_TYPE, Counter, Gauge, Histogram, log_throttled, render
+from signatures import BatchVerifier, verify_submission
+from validation import validate_chain
+from retarget import target_to_hex
+from scheduler import MiningScheduler
+from snapshot import Snapshots
+from sync import PeerSync
+from tipcache import CACHE_LOOKUPS, MAX_WAITERS, WAIT_POLL, ResponseCache, TipVersion
+import argparse
+import functools
+import json
 import logging
+import os
+import queue
+import sys
+import time
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
-app = Flask(__name__)
-blockchain = Blockchain()
-
 MINING_REWARD = 50  # Reward for mining a new block
+MAX_BATCH_SIZE = 10000  # Transfers accepted by one /add_transactions call
+TRANSACTION_FIELDS = ("sender", "recipient", "amount", "signature")
+DEFAULT_PAGE_SIZE = 100  # Transactions per /get_transactions page
+MAX_PAGE_SIZE = 1000
+MAX_HEADERS = 2000  # Headers returned by one /headers call
+MAX_BLOCKS = 500  # Blocks returned by one /blocks call
+WAIT_TIMEOUT = 30  # Default seconds a /wait_block request waits for a new block
+MAX_WAIT_TIMEOUT = 60
+WRITER = "writer"  # Owns the mempool, mining and peer sync; the only process that writes the chain
+READER = "reader"  # Serves reads from the shared database and sends writes to the writer
+
+REQUESTS = Counter("fartchan_http_requests_total", "HTTP requests served.", ["method", "route", "status"])
+REQUEST_SECONDS = Histogram("fartchan_http_request_seconds", "Time to produce an HTTP response.", ["method", "route"])
+MEMPOOL_SIZE = Gauge("fartchan_mempool_transactions", "Transactions waiting in the mempool.")
+MINING_QUEUE = Gauge("fartchan_mining_queue_jobs", "Mining jobs waiting for the block producer.")
+CHAIN_HEIGHT = Gauge("fartchan_chain_height", "Height of the chain tip.")
+DIFFICULTY = Gauge("fartchan_difficulty", "Current proof-of-work difficulty.")
+
+class Node:
+    """
+    The chain and the services an app instance serves from. A writer runs the
+    block producer and peer sync; a reader keeps only its own view of the
+    chain, refreshed from the shared database before each request, so any
+    number of reader workers can answer balance and block queries while the
+    writer mines.
+    """
+
+    def __init__(self, db_name, block_dir=None, role=WRITER, writer_url=None, peers=(), sync_interval=10,
+                 snapshot_dir="snapshots", snapshot_interval=0, max_waiters=MAX_WAITERS):
+        if role not in (WRITER, READER):
+            raise ValueError(f"unknown role {role!r}")
+        if role == READER and (not writer_url or block_dir):
+            raise ValueError("readers need a writer URL and keep blocks in the shared SQLite database")
+        self.role = role
+        self.writer_url = writer_url.rstrip("/") if writer_url else None
+        self.db = Database(db_name)
+        self.block_store = None
+        if block_dir:
+            # Keep blocks in segment files instead of SQLite; an existing SQLite chain is copied over once
+            self.block_store = BlockStore(block_dir)
+            if not len(self.block_store) and self.db.load_tip():
+                logging.info("Copying blocks from SQLite into the block store")
+                copy_blocks(self.db, self.block_store)
+        self.blockchain = Blockchain(db=self.db, store=self.block_store)
+        self.versions = TipVersion(self.blockchain, max_waiters)
+        self.responses = ResponseCache()
+        self.blockchain.block_listeners.append(self.responses.notify_new_block)
+        self.scheduler = self.verifier = self.peer_sync = self.snapshots = None
+        if role == WRITER:
+            self.scheduler = MiningScheduler(self.blockchain, MINING_REWARD)
+            self.verifier = BatchVerifier()
+            self.peer_sync = PeerSync(self.blockchain, reward=MINING_REWARD, interval=sync_interval)
+            self.peer_sync.add_peers(peers)
+            self.snapshots = Snapshots(self.blockchain, snapshot_dir, snapshot_interval)
+
+    def start(self):
+        """Start the background block producer and peer sync (writers only)."""
+        if self.role == WRITER:
+            self.scheduler.start()
+            self.peer_sync.start()
+
+api = Blueprint("api", __name__)
+node = LocalProxy(lambda: current_app.extensions["fartchan"])
+
+def create_app(db_name=None, block_dir=None, role=None, writer_url=None, peers=(), sync_interval=10,
+               snapshot_dir=None, snapshot_interval=0, max_waiters=MAX_WAITERS, start=True):
+    """
+    Build a node app. Arguments default to the FARTCHAN_DB, FARTCHAN_BLOCKS,
+    FARTCHAN_ROLE, FARTCHAN_WRITER and FARTCHAN_SNAPSHOTS environment variables,
+    so WSGI servers can call create_app() with no arguments, e.g. for reader workers:
+
+        FARTCHAN_ROLE=reader FARTCHAN_WRITER=http://127.0.0.1:5000 gunicorn -w 4 "node:create_app()"
+    """
+    state = Node(
+        db_name or os.environ.get("FARTCHAN_DB", "blockchain.db"),
+        block_dir or os.environ.get("FARTCHAN_BLOCKS"),
+        role or os.environ.get("FARTCHAN_ROLE", WRITER),
+        writer_url or os.environ.get("FARTCHAN_WRITER"),
+        peers,
+        sync_interval,
+        snapshot_dir or os.environ.get("FARTCHAN_SNAPSHOTS", "snapshots"),
+        snapshot_interval,
+        max_waiters
+    )
+    app = Flask(__name__)
+    app.extensions["fartchan"] = state
+    app.register_blueprint(api)
 
-@app.route('/mine', methods=['GET'])
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        # Streamed responses are timed until their first byte is ready
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, method=request.method, route=route)
+        REQUESTS.inc(method=request.method, route=route, status=response.status_code)
+        return response
+
+    if state.role == READER:
+        @app.before_request
+        def follow_writer():
+            state.blockchain.refresh()
+    if start:
+        state.start()
+    return app
+
+def create_asgi_app(**kwargs):
+    """ASGI entry point, e.g. uvicorn --factory node:create_asgi_app. Requires asgiref."""
+    from asgiref.wsgi import WsgiToAsgi
+    return WsgiToAsgi(create_app(**kwargs))
+
+def writer_only(view):
+    """Routes that need the mempool, mining jobs or peers; readers redirect them to the writer."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if node.role == READER:
+            return redirect(node.writer_url + request.full_path.rstrip("?"), 307)
+        return view(*args, **kwargs)
+    return wrapper
+
+def tip_cached(parse=None, pending=False):
+    """
+    Read routes whose answer only changes with the chain (and, with
+    `pending`, the writer's mempool): responses carry an ETag of that
+    version, If-None-Match is answered with 304, and bodies are served from
+    the app's response cache until the version moves. `parse` reads the
+    query arguments first, returning them as keyword arguments for the view
+    or raising ValueError, which is answered with 400.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if parse is not None:
+                try:
+                    kwargs.update(parse())
+                except ValueError as e:
+                    return jsonify({"error": str(e)}), 400
+            etag = node.versions.etag(pending=pending and node.role == WRITER)
+            if etag in request.if_none_match:
+                CACHE_LOOKUPS.inc(result="not_modified")
+                response = Response(status=304)
+            else:
+                key = (request.endpoint, request.full_path, wants_binary())
+                cached = node.responses.get(key, etag)
+                if cached is not None:
+                    CACHE_LOOKUPS.inc(result="hit")
+                    response = Response(cached[0], content_type=cached[1])
+                else:
+                    CACHE_LOOKUPS.inc(result="miss")
+                    response = current_app.make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    if not response.is_streamed:  # Streams are left to stream; they only get the ETag
+                        node.responses.put(key, etag, response.get_data(), response.content_type)
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = "no-cache"  # Revalidate every time; a 304 is cheap
+            response.vary.add("Accept")
+            return response
+        return wrapper
+    return decorator
+
+@api.route('/mine', methods=['POST'])
+@writer_only
 def mine():
-    miner_address = request.args.get("miner")
+    data = request.get_json(silent=True) or {}
+    miner_address = data.get("miner") or request.args.get("miner")
     if not miner_address:
         logging.error("No miner address provided.")
         return jsonify({"error": "No miner address provided"}), 400
 
     try:
-        last_block = blockchain.chain[-1]
-        last_proof = last_block["proof"]
-        proof = blockchain.proof_of_work(last_proof)
-        previous_hash = blockchain.hash(last_block)
-
-        # Ensure miner has a registered wallet
-        blockchain.db.register_wallet(miner_address)
-
-        # Reward the miner
-        success = blockchain.db.update_balance(miner_address, MINING_REWARD)
-        if not success:
-            logging.error("Failed to update miner balance.")
-            return jsonify({"error": "Failed to update miner balance"}), 500
-
-        # Create a new block including pending transactions
-        block = blockchain.create_block(proof, previous_hash)
-
-        response = {
-            "message": "New block mined!",
-            "block": block,
-            "reward": MINING_REWARD,
-            "miner": miner_address
-        }
-        logging.info(f"Block mined successfully: {block}")
-        return jsonify(response), 200
+        job = node.scheduler.submit(miner_address)
+    except queue.Full:
+        logging.warning("Mining queue is full.")
+        return jsonify({"error": "Mining queue is full, try again later"}), 503
 
-    except Exception as e:
-        logging.error(f"Mining failed: {e}")
-        return jsonify({"error": "Mining failed"}), 500
+    logging.debug("Mining job %s queued for %s", job.job_id, miner_address)
+    return jsonify({"message": "Mining job queued", "job_id": job.job_id, "status": job.status}), 202
+
+@api.route('/mine/<job_id>', methods=['GET'])
+@writer_only
+def mine_status(job_id):
+    job = node.scheduler.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown mining job"}), 404
+
+    response = job.to_dict()
+    response["reward"] = MINING_REWARD
+    return jsonify(response), 200
+
+@api.route('/mine/<job_id>', methods=['DELETE'])
+@writer_only
+def cancel_mine(job_id):
+    if not node.scheduler.cancel(job_id):
+        return jsonify({"error": "Job not found or already finished"}), 404
+    return jsonify({"message": "Mining job cancelled"}), 200
 
-@app.route('/add_transaction', methods=['POST'])
+@api.route('/add_transaction', methods=['POST'])
+@writer_only
 def add_transaction():
     data = request.get_json()
-    required_fields = ["sender", "recipient", "amount"]
-
-    if not data or not all(field in data for field in required_fields):
-        logging.error(f"Missing transaction fields: {data}")
+    if not data or not all(field in data for field in TRANSACTION_FIELDS):
+        log_throttled(logging.ERROR, "Missing transaction fields: %s", data)
         return jsonify({"error": "Missing transaction fields"}), 400
 
     sender = data["sender"]
@@ -62,47 +238,313 @@ def add_transaction():
     amount = data["amount"]
 
     if not isinstance(amount, (int, float)) or amount <= 0:
-        logging.error(f"Invalid transaction amount: {amount}")
+        log_throttled(logging.ERROR, "Invalid transaction amount: %s", amount)
         return jsonify({"error": "Invalid transaction amount"}), 400
 
-    # Ensure sender has enough balance
-    sender_balance = blockchain.db.get_balance(sender)
-    if sender_balance < amount:
-        logging.warning(f"Insufficient funds: {sender} has {sender_balance}, tried to send {amount}")
-        return jsonify({"error": "Insufficient balance"}), 400
-
-    # Process transaction
-    success = blockchain.db.add_transaction(sender, recipient, amount)
-    if success:
-        logging.info(f"Transaction added: {sender} -> {recipient} ({amount})")
-        return jsonify({"message": "Transaction added"}), 200
+    if not verify_submission(data):
+        log_throttled(logging.WARNING, "Invalid signature for transaction from %s", sender)
+        return jsonify({"error": "Invalid signature"}), 400
+
+    # Queue the transaction in the mempool until the next block applies it
+    tx_hash, error = node.blockchain.add_transaction(data)
+    if tx_hash:
+        logging.debug("Transaction added: %s -> %s (%s)", sender, recipient, amount)
+        return jsonify({"message": "Transaction added", "tx_hash": tx_hash}), 200
+    elif error == "Mempool full":
+        log_throttled(logging.WARNING, "Mempool is full.")
+        return jsonify({"error": error}), 503
     else:
-        logging.error(f"Transaction failed for {sender} -> {recipient} ({amount})")
-        return jsonify({"error": "Transaction failed"}), 500
+        log_throttled(logging.WARNING, "Transaction rejected for %s -> %s (%s): %s", sender, recipient, amount, error)
+        return jsonify({"error": error}), 400
+
+@api.route('/add_transactions', methods=['POST'])
+@writer_only
+def add_transactions():
+    data = request.get_json(silent=True)
+    transfers = data.get("transactions") if isinstance(data, dict) else data
+
+    if not isinstance(transfers, list) or not transfers:
+        logging.error("No transactions provided.")
+        return jsonify({"error": "Expected a non-empty array of transactions"}), 400
+    if len(transfers) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"At most {MAX_BATCH_SIZE} transactions per request"}), 413
 
-@app.route('/get_balance', methods=['GET'])
-def get_balance():
+    # Verify signatures up front (in parallel for large batches) and only queue the valid ones
+    complete = [isinstance(tx, dict) and all(field in tx for field in TRANSACTION_FIELDS) for tx in transfers]
+    checked = iter(node.verifier.verify([tx for tx, ok in zip(transfers, complete) if ok]))
+    errors = []
+    for ok in complete:
+        if not ok:
+            errors.append("Missing transaction fields")
+        elif not next(checked):
+            errors.append("Invalid signature")
+        else:
+            errors.append(None)
+
+    # The verified transactions are checked against the ledger and queued as one batch
+    verified = [index for index, error in enumerate(errors) if error is None]
+    queued = dict(zip(verified, node.blockchain.add_transactions([transfers[index] for index in verified])))
+    results = []
+    for index, error in enumerate(errors):
+        tx_hash, error = queued.get(index, (None, error))
+        results.append({"index": index, "accepted": tx_hash is not None, "tx_hash": tx_hash, "error": error})
+
+    accepted = sum(1 for result in results if result["accepted"])
+    logging.info(f"Batch processed: {accepted} accepted, {len(results) - accepted} rejected")
+    return jsonify({"accepted": accepted, "rejected": len(results) - accepted, "results": results}), 200
+
+def balance_args():
     address = request.args.get("address")
     if not address:
-        logging.error("No address provided.")
-        return jsonify({"error": "No address provided"}), 400
+        raise ValueError("No address provided")
+    return {"address": address}
 
+@api.route('/get_balance', methods=['GET'])
+@tip_cached(balance_args, pending=True)
+def get_balance(address):
     try:
-        balance = blockchain.db.get_balance(address)
-        logging.info(f"Balance retrieved: {address} => {balance}")
-        return jsonify({"balance": balance}), 200
+        # The ledger counts base units; the API reports coins
+        balance = from_units(node.blockchain.db.get_balance(address))
+        logging.debug("Balance retrieved: %s => %s", address, balance)
+        response = {"balance": balance}
+        if node.role == WRITER:  # Readers do not see the writer's mempool
+            response["pending_spend"] = from_units(node.blockchain.mempool.pending_spend(address))
+        return jsonify(response), 200
     except Exception as e:
         logging.error(f"Failed to retrieve balance: {e}")
         return jsonify({"error": "Failed to retrieve balance"}), 500
 
-@app.route('/get_transactions', methods=['GET'])
-def get_transactions():
+def page_args():
     try:
-        transactions = blockchain.db.get_transactions()
-        return jsonify(transactions), 200  # Ensure it returns a list of dictionaries
-    except Exception as e:
-        logging.error(f"Failed to fetch transactions: {e}")
-        return jsonify({"error": "Failed to fetch transactions"}), 500
+        after = int(request.args.get("after", 0))
+        limit = int(request.args.get("limit", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError("after and limit must be integers") from None
+    if after < 0 or not 0 < limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return {"after": after, "limit": limit}
+
+@api.route('/get_transactions', methods=['GET'])
+@tip_cached(page_args)
+def get_transactions(after, limit):
+    rows = node.blockchain.db.iter_transactions(
+        after=after,
+        limit=limit,
+        address=request.args.get("address"),
+        since=request.args.get("since"),
+        until=request.args.get("until")
+    )
+    # One JSON object per line; the client passes the last id back as ?after=
+    rows = (dict(row, amount=from_units(row["amount"]), fee=from_units(row["fee"])) for row in rows)
+    return Response((json.dumps(row) + "\n" for row in rows), mimetype="application/x-ndjson")
+
+@api.route('/mempool', methods=['GET'])
+@writer_only
+def mempool_stats():
+    return jsonify(node.blockchain.mempool.stats()), 200
+
+@api.route('/mempool/<tx_hash>', methods=['GET'])
+@writer_only
+def mempool_transaction(tx_hash):
+    tx = node.blockchain.mempool.get(tx_hash)
+    if tx is None:
+        return jsonify({"error": "Transaction not pending"}), 404
+    return jsonify({"tx_hash": tx_hash, "transaction": tx}), 200
+
+@api.route('/peers', methods=['POST'])
+@writer_only
+def register_peers():
+    data = request.get_json(silent=True) or {}
+    peers = data.get("peers")
+    if not isinstance(peers, list) or not all(isinstance(peer, str) and peer.startswith("http") for peer in peers):
+        return jsonify({"error": "Expected a list of peer URLs"}), 400
+
+    node.peer_sync.add_peers(peers)
+    logging.info(f"Peers registered: {peers}")
+    return jsonify({"peers": node.peer_sync.list_peers()}), 200
+
+@api.route('/peers', methods=['GET'])
+@writer_only
+def list_peers():
+    return jsonify({"peers": node.peer_sync.list_peers()}), 200
+
+@api.route('/metrics', methods=['GET'])
+def metrics():
+    # Gauges of this app's state are sampled at scrape time
+    CHAIN_HEIGHT.set(len(node.blockchain.chain))
+    DIFFICULTY.set(node.blockchain.difficulty)
+    if node.role == WRITER:
+        MEMPOOL_SIZE.set(len(node.blockchain.mempool))
+        MINING_QUEUE.set(node.scheduler.queue.qsize())
+    return Response(render(), content_type=CONTENT_TYPE)
+
+@api.route('/chain', methods=['GET'])
+@tip_cached()
+def chain_summary():
+    tip = node.blockchain.chain[-1]
+    return jsonify({
+        "height": len(node.blockchain.chain),
+        "tip_hash": node.blockchain.hash(tip),
+        "total_work": node.blockchain.chain.work(),
+        "difficulty": node.blockchain.difficulty,
+        "target": target_to_hex(node.blockchain.target)
+    }), 200
+
+@api.route('/wait_block', methods=['GET'])
+def wait_block():
+    try:
+        after = int(request.args["after"])
+        timeout = float(request.args.get("timeout", WAIT_TIMEOUT))
+    except (KeyError, ValueError):
+        return jsonify({"error": "after must be an integer and timeout a number"}), 400
+    if not 0 <= timeout <= MAX_WAIT_TIMEOUT:
+        return jsonify({"error": f"timeout must be between 0 and {MAX_WAIT_TIMEOUT} seconds"}), 400
+
+    # The writer is woken by its own blocks; readers check the shared database for the writer's
+    arrived = node.versions.wait_block(after, timeout, poll=WAIT_POLL if node.role == READER else None)
+    if arrived is None:
+        log_throttled(logging.WARNING, "Too many /wait_block requests waiting")
+        return jsonify({"error": "Too many requests waiting for a block, try again later"}), 503, {"Retry-After": "1"}
+    return jsonify({
+        "height": len(node.blockchain.chain),
+        "tip_hash": node.blockchain.chain.tip_hash,
+        "new_block": arrived
+    }), 200
+
+def wants_binary():
+    """True if the client prefers the compact binary encoding over JSON."""
+    return request.accept_mimetypes.best_match(["application/json", BINARY]) == BINARY
+
+def header_args():
+    try:
+        return {"start": int(request.args.get("from", 1)), "limit": min(int(request.args.get("limit", MAX_HEADERS)), MAX_HEADERS)}
+    except ValueError:
+        raise ValueError("from and limit must be integers") from None
+
+@api.route('/headers', methods=['GET'])
+@tip_cached(header_args)
+def headers(start, limit):
+    headers = node.blockchain.chain.store.load_headers(max(start, 1), max(start, 1) + limit - 1)
+    if wants_binary():
+        return Response(encode_headers(headers), mimetype=BINARY)
+    return jsonify({"headers": headers}), 200
+
+def block_range_args():
+    try:
+        start = int(request.args["from"])
+        end = int(request.args.get("to", start))
+    except (KeyError, ValueError):
+        raise ValueError("from and to must be integers") from None
+    if end < start or end - start + 1 > MAX_BLOCKS:
+        raise ValueError(f"Request between 1 and {MAX_BLOCKS} blocks")
+    return {"start": start, "end": end}
+
+@api.route('/blocks', methods=['GET'])
+@tip_cached(block_range_args)
+def blocks(start, end):
+    if wants_binary() and node.block_store is not None:
+        # Encoded blocks are copied straight out of the segment files
+        return Response(node.block_store.read_blocks(start, end), mimetype=BINARY)
+    blocks = node.blockchain.chain.store.load_blocks(start, end)
+    if wants_binary():
+        return Response(encode_blocks(blocks), mimetype=BINARY)
+    return jsonify({"blocks": blocks}), 200
+
+def tx_proof_args():
+    try:
+        return {"height": int(request.args["block"]), "position": int(request.args["tx"])}
+    except (KeyError, ValueError):
+        raise ValueError("block and tx must be integers") from None
+
+@api.route('/tx_proof', methods=['GET'])
+@tip_cached(tx_proof_args)
+def tx_proof(height, position):
+    if not node.blockchain.chain.base <= height <= len(node.blockchain.chain):
+        return jsonify({"error": "Block not found"}), 404
+    block = node.blockchain.chain.get(height)
+    if not 0 <= position < len(block["transactions"]):
+        return jsonify({"error": "Transaction not found in block"}), 404
+
+    tx_hashes = [hash_transaction(tx) for tx in block["transactions"]]
+    header = {key: value for key, value in block.items() if key != "transactions"}
+    return jsonify({
+        "block": height,
+        "block_hash": node.blockchain.hash(block),
+        "header": header,
+        "tx": position,
+        "transaction": block["transactions"][position],
+        "merkle_root": block["merkle_root"],
+        "proof": merkle_proof(tx_hashes, position)
+    }), 200
 
 if __name__ == '__main__':
-    app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run a FARTCHAN node.")
+    parser.add_argument("--port", type=int, default=5000, help="port to listen on")
+    parser.add_argument("--peer", action="append", default=[], help="peer node URL (repeatable)")
+    parser.add_argument("--sync-interval", type=float, default=10, help="seconds between peer sync rounds")
+    parser.add_argument("--server", choices=("dev", "waitress"), default="dev",
+                        help="HTTP server: Flask's development server or waitress (pip install waitress)")
+    parser.add_argument("--threads", type=int, default=8, help="request threads for --server waitress")
+    parser.add_argument("--max-waiters", type=int,
+                        help=f"/wait_block requests allowed to wait at once (default: half of --threads with waitress, else {MAX_WAITERS})")
+    parser.add_argument("--role", choices=(WRITER, READER), default=WRITER, help="writer node or read-only worker")
+    parser.add_argument("--writer", help="with --role reader, the writer node URL that receives writes")
+    parser.add_argument("--verify", action="store_true", help="validate the stored chain and exit")
+    parser.add_argument("--full", action="store_true", help="with --verify, ignore the checkpoint and check every block")
+    parser.add_argument("--rebuild-balances", action="store_true", help="recompute balances from the transaction ledger and exit")
+    parser.add_argument("--snapshot-dir", help="directory for balance snapshots and transaction archives (default: snapshots)")
+    parser.add_argument("--snapshot-interval", type=int, default=0, help="write a snapshot every N blocks (0: off)")
+    parser.add_argument("--snapshot", action="store_true", help="write a balance snapshot of the current tip and exit")
+    parser.add_argument("--archive", action="store_true",
+                        help="archive and prune transaction rows covered by a snapshot at least --retain blocks deep, and exit")
+    parser.add_argument("--prune", action="store_true", help="like --archive, but without keeping the pruned rows")
+    parser.add_argument("--retain", type=int, default=1000, help="blocks below the tip whose transactions are never pruned")
+    parser.add_argument("--bootstrap", metavar="SNAPSHOT",
+                        help="start a fresh node from a snapshot file and the first --peer, then keep running")
+    args = parser.parse_args()
+    if args.bootstrap and not args.peer:
+        parser.error("--bootstrap needs a --peer to download the chain from")
+    if args.role == READER and (args.snapshot or args.archive or args.prune or args.bootstrap):
+        parser.error("--snapshot, --archive, --prune and --bootstrap run on the writer")
+
+    if args.max_waiters is None:
+        args.max_waiters = max(1, args.threads // 2) if args.server == "waitress" else MAX_WAITERS
+
+    one_off = args.verify or args.rebuild_balances or args.snapshot or args.archive or args.prune
+    app = create_app(role=args.role, writer_url=args.writer, peers=args.peer, sync_interval=args.sync_interval,
+                     snapshot_dir=args.snapshot_dir, snapshot_interval=args.snapshot_interval, max_waiters=args.max_waiters,
+                     start=not one_off and not args.bootstrap)
+    state = app.extensions["fartchan"]
+    blockchain = state.blockchain
+
+    if args.snapshot:
+        print(json.dumps(state.snapshots.write(), indent=2))
+        sys.exit(0)
+
+    if args.archive or args.prune:
+        print(json.dumps(state.snapshots.archive(retain=args.retain, keep=args.archive), indent=2))
+        sys.exit(0)
+
+    if args.bootstrap:
+        try:
+            print(json.dumps(state.snapshots.bootstrap(args.bootstrap, state.peer_sync, args.peer[0])))
+        except (ValueError, RuntimeError, OSError) as e:  # OSError covers requests' errors
+            logging.error(f"Bootstrap failed: {e}")
+            sys.exit(1)
+        state.start()
+
+    if args.rebuild_balances:
+        count = blockchain.db.rebuild_balances()
+        print(json.dumps({"rebuilt": count is not None, "addresses": count}))
+        sys.exit(0 if count is not None else 1)
+
+    if args.verify:
+        result = validate_chain(blockchain, reward=MINING_REWARD, use_checkpoint=not args.full)
+        print(json.dumps(result, indent=2))
+        sys.exit(0 if result["valid"] else 1)
+
+    if args.server == "waitress":
+        from waitress import serve
+        serve(app, host="0.0.0.0", port=args.port, threads=args.threads)
+    else:
+        app.run(host="0.0.0.0", port=args.port, threaded=True)
@@ -0,0 +1,58 @@
+import math
+from headers import block_target, difficulty_to_target
+
+MAX_TARGET = (1 << 256) - 1  # Every hash meets it
+INITIAL_TARGET = int.from_bytes(difficulty_to_target(4), "big")  # Before there are block times to go by
+BLOCK_TIME_TARGET = 10  # Seconds per block
+RETARGET_WINDOW = 30  # Recent block intervals averaged by each retarget
+MAX_ADJUSTMENT = 4  # Largest factor one retarget may move the target by, either way
+
+
+def target_to_hex(target):
+    """The 64-hex-digit form a target takes in block headers."""
+    return f"{target:064x}"
+
+
+def target_difficulty(target):
+    """Target expressed as a (fractional) number of leading hex zeros, for display."""
+    return math.log((MAX_TARGET + 1) / (target + 1), 16)
+
+
+def _timestamp_ms(header):
+    return round(float(header["timestamp"]) * 1000)
+
+
+class Retarget:
+    """
+    Picks each block's target from the blocks before it. The average target
+    of the last `window` blocks is scaled by how long they actually took
+    against `block_time` per block, with the ratio clamped to
+    1/max_adjustment..max_adjustment, so a single fast or slow block nudges
+    the target instead of moving the work 16x.
+
+    All integer arithmetic on the stored headers: every node computes the
+    same target for the same chain, which lets validation and sync enforce it.
+    """
+
+    def __init__(self, block_time=BLOCK_TIME_TARGET, window=RETARGET_WINDOW, max_adjustment=MAX_ADJUSTMENT):
+        self.block_time = block_time
+        self.window = window
+        self.max_adjustment = max_adjustment
+
+    def next_target(self, headers):
+        """
+        Target for the block after headers[-1]. `headers` are consecutive,
+        oldest first; only the last window + 1 are used.
+        """
+        # Genesis has a fixed timestamp, so the interval after it says nothing about mining speed
+        recent = [header for header in headers[-(self.window + 1):] if header["index"] > 1]
+        if len(recent) < 2:
+            return (block_target(recent[-1]) if recent else None) or INITIAL_TARGET
+
+        intervals = len(recent) - 1
+        expected = intervals * round(self.block_time * 1000)
+        actual = _timestamp_ms(recent[-1]) - _timestamp_ms(recent[0])
+        actual = min(max(actual, expected // self.max_adjustment), expected * self.max_adjustment)
+        # Each interval was mined at the target of the block that ends it
+        average = sum(block_target(header) or INITIAL_TARGET for header in recent[1:]) // intervals
+        return max(1, min(MAX_TARGET, average * actual // expected))
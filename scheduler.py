@@ -0,0 +1,162 @@
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+CANCELLED = "cancelled"
+FAILED = "failed"
+
+
+class MiningJob:
+    def __init__(self, miner_address):
+        self.job_id = uuid.uuid4().hex
+        self.miner_address = miner_address
+        self.status = QUEUED
+        self.block = None
+        self.error = None
+        self.base_height = None  # Chain height the job started mining on
+        self.created = time.time()
+        self.finished = None
+        self.cancel_event = threading.Event()
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "miner": self.miner_address,
+            "status": self.status,
+            "block": self.block,
+            "error": self.error,
+            "created": self.created,
+            "finished": self.finished
+        }
+
+
+class MiningScheduler:
+    """
+    Runs mining jobs in the background on a single block-producing thread.
+    Jobs wait in a bounded queue; a queued job for the same miner is reused
+    rather than duplicated, and a running job is cancelled when a block lands
+    on top of the tip it was mining on.
+    """
+
+    def __init__(self, blockchain, reward, max_queue=16, max_jobs=1000):
+        self.blockchain = blockchain
+        self.reward = reward
+        self.max_jobs = max_jobs
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.jobs = OrderedDict()  # job_id -> MiningJob, oldest first
+        self.current = None
+        self.lock = threading.Lock()
+        self.thread = None
+        blockchain.block_listeners.append(self.notify_new_block)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="block-producer", daemon=True)
+            self.thread.start()
+
+    def submit(self, miner_address):
+        """Queues a mining job. Raises queue.Full when the queue is at capacity."""
+        with self.lock:
+            for job in self.jobs.values():
+                if job.status == QUEUED and job.miner_address == miner_address:
+                    return job
+            job = MiningJob(miner_address)
+            self.queue.put_nowait(job)
+            self.jobs[job.job_id] = job
+            self._trim_jobs()
+            return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id, reason="Cancelled by request"):
+        """Cancels a queued or running job. Returns False if it already finished."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.status not in (QUEUED, RUNNING):
+                return False
+            if job.status == RUNNING and job is not self.current:
+                return False  # Already committing its block
+            job.error = reason
+            if job.status == QUEUED:
+                self._finish(job, CANCELLED)
+            job.cancel_event.set()
+            return True
+
+    def notify_new_block(self, block):
+        """Cancels the running job if it was mining on a tip that is now stale."""
+        with self.lock:
+            job = self.current
+            if job is not None and job.base_height is not None and block["index"] > job.base_height:
+                job.error = f"Stale: block {block['index']} landed while mining"
+                job.cancel_event.set()
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished = time.time()
+        job.cancel_event.set()
+
+    def _trim_jobs(self):
+        # Forget the oldest finished jobs once the history is full
+        for job_id in list(self.jobs):
+            if len(self.jobs) <= self.max_jobs:
+                break
+            if self.jobs[job_id].status not in (QUEUED, RUNNING):
+                del self.jobs[job_id]
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            with self.lock:
+                if job.status != QUEUED:
+                    continue
+                job.status = RUNNING
+                job.base_height = len(self.blockchain.chain)
+                self.current = job
+            try:
+                block = self._produce(job)
+                with self.lock:
+                    if block is None:
+                        self._finish(job, CANCELLED)
+                    else:
+                        job.block = block
+                        self._finish(job, DONE)
+            except Exception as e:
+                logging.error(f"Mining job {job.job_id} failed: {e}")
+                with self.lock:
+                    job.error = "Mining failed"
+                    self._finish(job, FAILED)
+            finally:
+                with self.lock:
+                    self.current = None
+
+    def _produce(self, job):
+        """Mines one block for the job. Returns None if the job was cancelled."""
+        blockchain = self.blockchain
+        last_block = blockchain.chain[-1]
+        proof = blockchain.proof_of_work(last_block["proof"], job.cancel_event)
+        if proof is None or len(blockchain.chain) != job.base_height:
+            return None
+        previous_hash = blockchain.hash(last_block)
+
+        # Past this point the job commits its block and can no longer be cancelled
+        with self.lock:
+            self.current = None
+
+        # Ensure miner has a registered wallet
+        blockchain.db.register_wallet(job.miner_address)
+
+        # Create a new block from pending transactions; it pays the miner's reward
+        block = blockchain.create_block(proof, previous_hash, job.miner_address, self.reward)
+        if block is None:
+            job.error = "Stale: the chain tip changed while mining"
+            return None
+        logging.info(f"Block {block['index']} mined by {job.miner_address}")
+        return block
@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from ecdsa import VerifyingKey, SECP256k1, BadSignatureError, MalformedPointError
+from metrics import Histogram, timed
+
+PARALLEL_THRESHOLD = 64  # Smaller batches are verified in-process
+SIGNATURE_SIZE = 64  # r || s, 32 bytes each
+HALF_ORDER = SECP256k1.order // 2  # Largest s a canonical signature may carry
+
+# Batches verified on the process pool are recorded in the workers, not here
+VERIFY_SECONDS = Histogram("fartchan_signature_verify_seconds", "Time to verify one transaction signature.")
+
+
+def transaction_message(tx):
+    """Returns the canonical bytes a transaction signature covers: every field except the signature."""
+    fields = {key: value for key, value in tx.items() if key != "signature"}
+    return json.dumps(fields, sort_keys=True, separators=(",", ":")).encode()
+
+
+def transaction_id(tx):
+    """
+    Identifies a transaction by the content its signature covers. Ledger
+    dedup and the mempool key on this rather than on the whole dict, so
+    re-encoding a signature (upper-case hex, s -> n - s) cannot make a
+    confirmed transaction look new.
+    """
+    return hashlib.sha256(transaction_message(tx)).hexdigest()
+
+
+def canonical_signature(tx):
+    """True if the signature is 64 bytes as lower-case hex with a low s, the one encoding wallets produce."""
+    signature = tx.get("signature")
+    if not isinstance(signature, str) or len(signature) != SIGNATURE_SIZE * 2:
+        return False
+    try:
+        raw = bytes.fromhex(signature)
+    except ValueError:
+        return False
+    return raw.hex() == signature and int.from_bytes(raw[32:], "big") <= HALF_ORDER
+
+
+@lru_cache(maxsize=4096)
+def verifying_key(public_key_hex):
+    """Parses a hex public key once and reuses the VerifyingKey afterwards."""
+    return VerifyingKey.from_string(bytes.fromhex(public_key_hex), curve=SECP256k1)
+
+
+@timed(VERIFY_SECONDS)
+def verify_transaction(tx):
+    """Checks that the transaction was signed by the private key behind its sender address."""
+    try:
+        key = verifying_key(tx["sender"])
+        signature = bytes.fromhex(tx["signature"])
+        return key.verify(signature, transaction_message(tx), hashfunc=hashlib.sha256)
+    except (KeyError, TypeError, ValueError, BadSignatureError, MalformedPointError):
+        return False
+
+
+def verify_submission(tx):
+    """verify_transaction for new submissions, which must also carry a canonical signature."""
+    return canonical_signature(tx) and verify_transaction(tx)
+
+
+class BatchVerifier:
+    """Verifies bulk submissions (see verify_submission) on a process pool; each worker keeps its own key cache."""
+
+    def __init__(self, processes=None):
+        self.processes = processes or os.cpu_count() or 1
+        self._executor = None
+        self._lock = threading.Lock()  # Request threads share one pool
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.processes)
+            return self._executor
+
+    def verify(self, txs):
+        """Returns one bool per transaction, in order."""
+        if self.processes < 2 or len(txs) < PARALLEL_THRESHOLD:
+            return [verify_submission(tx) for tx in txs]
+        chunksize = max(1, len(txs) // (self.processes * 4))
+        return list(self._get_executor().map(verify_submission, txs, chunksize=chunksize))
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
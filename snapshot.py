@@ -0,0 +1,219 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from blockchain import CHAIN_PREFIX_KEY, block_work, genesis_block
+from headers import block_hash
+from merkle import hash_transaction, merkle_root
+from sync import HEADERS_PER_REQUEST
+from validation import CHECKPOINT_KEY
+
+SNAPSHOT_KEY = "snapshot"  # Meta key describing the newest snapshot written
+SNAPSHOT_FILE = re.compile(r"snapshot-(\d{10})\.json\.gz$")
+ARCHIVE_SEGMENT_ROWS = 100_000  # Transaction rows per archive file
+DEFAULT_RETAIN = 1000  # Blocks below the tip whose transaction rows are never pruned (reorg depth)
+
+
+def balances_digest(height, tip_hash, balances):
+    """SHA-256 over the snapshot's block and every (address, units) pair in address order."""
+    digest = hashlib.sha256(f"{height}:{tip_hash}\n".encode())
+    for address in sorted(balances):
+        digest.update(f"{address}:{balances[address]}\n".encode())
+    return digest.hexdigest()
+
+
+def _write_gzip(path, lines):
+    # Written under a temporary name and renamed, so a crash never leaves a truncated file behind
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        for line in lines:
+            f.write(line + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class Snapshots:
+    """
+    Balance checkpoints and transaction-history compaction for one node.
+
+    A snapshot is every balance at a block height, tagged with that block's
+    hash and a digest, in a gzipped JSON file. Transaction rows the newest
+    snapshot covers (and that are at least `retain` blocks deep) can then be
+    archived to compressed NDJSON segments and pruned from SQLite, and a
+    fresh node can start from a snapshot plus the blocks after it instead of
+    replaying the whole ledger.
+    """
+
+    def __init__(self, blockchain, directory, interval=0, retain=DEFAULT_RETAIN):
+        self.blockchain = blockchain
+        self.directory = directory
+        self.interval = interval  # Write a snapshot every this many blocks (0: only on request)
+        self.retain = retain
+        self._writing = threading.Lock()
+        if interval:
+            blockchain.block_listeners.append(self.notify_new_block)
+
+    def path(self, height):
+        return os.path.join(self.directory, f"snapshot-{height:010d}.json.gz")
+
+    def heights(self):
+        """Heights of the snapshots on disk, lowest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        matches = (SNAPSHOT_FILE.match(name) for name in os.listdir(self.directory))
+        return sorted(int(match.group(1)) for match in matches if match)
+
+    def latest(self):
+        """Path of the highest snapshot on disk, or None."""
+        heights = self.heights()
+        return self.path(heights[-1]) if heights else None
+
+    def write(self):
+        """Write a snapshot of the current tip. Returns its summary (without balances)."""
+        blockchain = self.blockchain
+        with self._writing:
+            # Under the chain lock the tip, the balances and the last transaction row belong together
+            with blockchain.lock:
+                height = len(blockchain.chain)
+                tip_hash = blockchain.hash(blockchain.chain[-1])
+                last_tx_id = blockchain.db.last_transaction_id()
+                balances = blockchain.db.get_balances()
+            info = {
+                "height": height,
+                "block_hash": tip_hash,
+                "last_tx_id": last_tx_id,
+                "addresses": len(balances),
+                "digest": balances_digest(height, tip_hash, balances)
+            }
+            _write_gzip(self.path(height), [json.dumps(dict(info, balances=balances))])
+            blockchain.db.set_meta(SNAPSHOT_KEY, info)
+            logging.info(f"Snapshot written at height {height}: {len(balances)} addresses")
+            return info
+
+    @staticmethod
+    def load(path):
+        """Read a snapshot file. Raises ValueError if its digest does not match its balances."""
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            snapshot = json.load(f)
+        if balances_digest(snapshot["height"], snapshot["block_hash"], snapshot["balances"]) != snapshot["digest"]:
+            raise ValueError(f"snapshot {path} does not match its digest")
+        return snapshot
+
+    def notify_new_block(self, block):
+        """Writes a snapshot in the background every `interval` blocks."""
+        if block["index"] % self.interval == 0 and not self._writing.locked():
+            threading.Thread(target=self._write_quietly, name="snapshot", daemon=True).start()
+
+    def _write_quietly(self):
+        try:
+            self.write()
+        except (OSError, IndexError) as e:
+            logging.error(f"Snapshot failed: {e}")
+
+    def archive(self, retain=None, keep=True):
+        """
+        Prune the transaction rows covered by the newest snapshot that is at
+        least `retain` blocks below the tip and still on the chain. With
+        `keep`, rows are first written to transactions-FIRST-LAST.ndjson.gz
+        segments in the snapshot directory. Returns a summary dict.
+        """
+        blockchain = self.blockchain
+        retain = self.retain if retain is None else retain
+        tip = len(blockchain.chain)
+        snapshot = None
+        for height in reversed(self.heights()):
+            if height > tip - retain or height < blockchain.chain.base:
+                continue
+            candidate = self.load(self.path(height))
+            # A snapshot from a branch that was reorganized away says nothing about our rows
+            if blockchain.hash(blockchain.chain.get(height)) == candidate["block_hash"]:
+                snapshot = candidate
+                break
+        if snapshot is None:
+            logging.info(f"No snapshot at least {retain} blocks below the tip; nothing to prune")
+            return {"snapshot_height": None, "pruned": 0, "files": []}
+
+        db = blockchain.db
+        pruned, files = 0, []
+        while True:
+            rows = list(db.iter_ledger_rows(up_to=snapshot["last_tx_id"], limit=ARCHIVE_SEGMENT_ROWS))
+            if not rows:
+                break
+            if keep:
+                path = os.path.join(self.directory, f"transactions-{rows[0]['id']:012d}-{rows[-1]['id']:012d}.ndjson.gz")
+                _write_gzip(path, (json.dumps(row) for row in rows))
+                files.append(path)
+            count = db.prune_transactions(rows[-1]["id"])
+            if count is None:
+                raise RuntimeError(f"failed to prune transactions up to id {rows[-1]['id']}")
+            pruned += count
+        db.checkpoint_wal()
+        logging.info(f"Pruned {pruned} transactions covered by the snapshot at height {snapshot['height']}")
+        return {"snapshot_height": snapshot["height"], "pruned": pruned, "files": files}
+
+    def bootstrap(self, path, peer_sync, peer):
+        """
+        Start a fresh node from a snapshot. Headers up to the snapshot height
+        are fetched from `peer`, checked like synced headers (links, proofs,
+        targets) and must lead to the snapshot's block hash. Only the snapshot
+        block itself is downloaded: the chain is rebased onto it, keeping the
+        retarget window of headers below it and the work before it (see
+        Chain), and the snapshot balances become the ledger and the validation
+        checkpoint. Later blocks arrive through normal peer sync.
+
+        Transactions confirmed before the snapshot leave no record here, so
+        this node cannot tell a replay of one from a new transaction.
+        """
+        blockchain = self.blockchain
+        snapshot = self.load(path)
+        height, expected = snapshot["height"], snapshot["block_hash"]
+        chain = blockchain.chain
+        if len(chain) > height:
+            raise ValueError(f"the chain is already past the snapshot height {height}")
+        if blockchain.db.last_transaction_id():
+            raise ValueError("the ledger already has history; bootstrap needs a fresh database")
+
+        headers = []
+        while len(headers) < height - 1:
+            page = peer_sync.fetch_headers(peer, len(headers) + 2, HEADERS_PER_REQUEST)
+            if not page:
+                raise ValueError(f"{peer} has no headers past {len(headers) + 1}")
+            headers += page[:height - 1 - len(headers)]
+        # Links, proofs and retarget targets, as in peer sync
+        genesis = genesis_block()
+        _, error = peer_sync.check_headers(genesis, [genesis], headers)
+        if error:
+            raise ValueError(error)
+        headers = [genesis] + headers
+        if block_hash(headers[-1]) != expected:
+            raise ValueError(f"{peer}'s block {height} is not the snapshot block")
+
+        block = None
+        if height > 1:
+            blocks = peer_sync.fetch_blocks(peer, height, height)
+            block = blocks[0] if blocks else None
+            root = merkle_root([hash_transaction(tx) for tx in block["transactions"]]) if block else None
+            if block is None or block_hash(block) != expected or root is None or block.get("merkle_root") != root:
+                raise ValueError(f"{peer}'s block {height} does not match the snapshot")
+
+        below = [{key: value for key, value in header.items() if key != "transactions"} for header in headers[:-1]]
+        prefix = {
+            "headers": [dict(header, hash=block_hash(header)) for header in below[-blockchain.retarget.window:]],
+            "work": sum(block_work(header) for header in below)
+        }
+        with blockchain.lock:
+            if block is not None:
+                blockchain.db.set_meta(CHAIN_PREFIX_KEY, prefix)
+                chain.rebase(block, prefix)
+            if not blockchain.db.import_balances(snapshot["balances"]):
+                raise RuntimeError("the ledger already has history; bootstrap needs a fresh database")
+            blockchain.db.set_meta(CHECKPOINT_KEY, {"height": height, "hash": expected, "balances": snapshot["balances"]})
+            blockchain.db.set_meta(SNAPSHOT_KEY, {key: value for key, value in snapshot.items() if key != "balances"})
+            blockchain.adjust_difficulty()
+        logging.info(f"Bootstrapped from the snapshot at height {height}: {len(snapshot['balances'])} addresses")
+        return {"height": height, "block_hash": expected, "addresses": len(snapshot["balances"])}
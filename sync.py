@@ -0,0 +1,288 @@
+import logging
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from blockchain import block_work
+from codec import BINARY, decode_blocks, decode_headers
+from database import NETWORK, transaction_units, transfer_nonce
+from headers import block_hash, block_target, valid_proof
+from signatures import transaction_id
+from validation import check_blocks, check_targets, replay_blocks
+
+HEADERS_PER_REQUEST = 2000
+BLOCKS_PER_REQUEST = 200
+ACCEPT = f"{BINARY}, application/json;q=0.5"  # Older peers only speak JSON
+FORK_WINDOW = 64  # Headers compared against our chain before widening the search
+MAX_AHEAD = 20_000  # Headers past our tip taken from a peer per round; a longer branch is followed over several rounds
+
+
+class SyncError(Exception):
+    pass
+
+
+class PeerSync:
+    """
+    Keeps the chain in line with peers. Each round downloads compact headers
+    first, checks their links and proofs, and picks the branch with the most
+    work. Only then are bodies fetched, in parallel ranges over a pooled
+    keep-alive session, and applied on top of the fork point.
+    """
+
+    def __init__(self, blockchain, reward=None, interval=10, workers=4, timeout=10):
+        self.blockchain = blockchain
+        self.reward = reward
+        self.interval = interval
+        self.workers = workers
+        self.timeout = timeout
+        self.peers = set()
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=workers * 2)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._stop = threading.Event()
+        self._sync_lock = threading.Lock()
+        self.thread = None
+
+    def add_peers(self, urls):
+        with self.lock:
+            for url in urls:
+                self.peers.add(url.rstrip("/"))
+
+    def list_peers(self):
+        with self.lock:
+            return sorted(self.peers)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="peer-sync", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sync_once()
+            except Exception as e:
+                logging.error(f"Peer sync failed: {e}")
+
+    def _get(self, peer, path, key, decode, **params):
+        response = self.session.get(f"{peer}{path}", params=params, headers={"Accept": ACCEPT}, timeout=self.timeout)
+        response.raise_for_status()
+        if response.headers.get("Content-Type", "").startswith(BINARY):
+            return decode(response.content)
+        return response.json()[key]
+
+    def fetch_headers(self, peer, start, limit=HEADERS_PER_REQUEST):
+        return self._get(peer, "/headers", "headers", decode_headers, **{"from": start, "limit": limit})
+
+    def fetch_blocks(self, peer, start, end):
+        return self._get(peer, "/blocks", "blocks", decode_blocks, **{"from": start, "to": end})
+
+    def sync_once(self):
+        """Run one sync round against every peer. Returns True if the chain changed."""
+        with self._sync_lock:
+            best = None
+            for peer in self.list_peers():
+                try:
+                    candidate = self._best_branch(peer)
+                except (requests.RequestException, ValueError, KeyError, IndexError, struct.error, SyncError) as e:
+                    logging.warning(f"Skipping peer {peer}: {e}")
+                    continue
+                if candidate and (best is None or candidate["gain"] > best["gain"]):
+                    best = candidate
+
+            if best is None:
+                return False
+            logging.info(f"Syncing from {best['peer']}: fork at {best['fork']}, {len(best['headers'])} new blocks")
+            self._download(best)
+            return True
+
+    def _best_branch(self, peer):
+        """
+        Find where the peer's chain forks from ours and how much more work it
+        has after that point. Header pages are checked as they arrive; the
+        branch ends at the first invalid header or MAX_AHEAD past our tip.
+        """
+        chain = self.blockchain.chain
+        retarget = self.blockchain.retarget
+        limit = len(chain) + MAX_AHEAD
+        fork, page = self._find_fork(peer)
+        previous = chain.get(fork)
+        history = chain.load_headers(max(1, fork - retarget.window), fork)
+        headers = []
+        while page:
+            page = [header for header in page if header["index"] <= limit]
+            valid, error = self.check_headers(previous, history, page)
+            headers += page[:valid]
+            if error:
+                logging.warning(f"Peer {peer}: {error}; branch ends at {previous['index'] + valid}")
+                break
+            if not page or page[-1]["index"] >= limit:
+                break
+            history = (history + page)[-retarget.window - 1:]
+            previous = page[-1]
+            page = self.fetch_headers(peer, previous["index"] + 1, min(HEADERS_PER_REQUEST, limit - previous["index"]))
+        if not headers:
+            return None
+
+        ours = sum(block_work(header) for header in chain.store.load_headers(fork + 1, len(chain)))
+        theirs = sum(block_work(header) for header in headers)
+        if theirs <= ours:
+            return None
+        return {"peer": peer, "fork": fork, "headers": headers, "gain": theirs - ours}
+
+    def check_headers(self, previous, history, page):
+        """
+        Check links, targets and proofs of a page of headers following
+        `previous`. Returns (number of leading valid headers, first error or None).
+        """
+        for valid, header in enumerate(page):
+            if header["index"] != previous["index"] + 1 or header["previous_hash"] != block_hash(previous):
+                return valid, f"broken header chain at {header['index']}"
+            # Without a target a header would claim the minimum work and skip the proof check
+            target = block_target(header)
+            if target is None:
+                return valid, f"header {header['index']} does not record its target"
+            if not valid_proof(previous["proof"], header["proof"], target):
+                return valid, f"invalid proof in header {header['index']}"
+            previous = header
+
+        # Targets must follow the retarget rule, so a branch cannot claim work with targets of its own choosing
+        errors = check_targets(self.blockchain.retarget, history, page)
+        if errors:
+            height, error = errors[0]
+            return height - page[0]["index"], f"header {height}: {error}"
+        return len(page), None
+
+    def _find_fork(self, peer):
+        """
+        Return (fork height, peer headers above it). Headers near our tip are
+        compared first; the window widens until a common block is found.
+        """
+        chain = self.blockchain.chain
+        window = FORK_WINDOW
+        while True:
+            start = max(chain.base, len(chain) - window + 1)
+            headers = self.fetch_headers(peer, start)
+            if headers and self._matches(headers[0]):
+                break
+            if start == chain.base:
+                # Blocks below the base of a bootstrapped chain are covered by its snapshot and never replaced
+                raise SyncError("peer has a different genesis block" if start == 1 else f"peer does not have our base block {start}")
+            window *= 4
+
+        # Walk forward from the common block to the first header that differs
+        while True:
+            for i, header in enumerate(headers):
+                if not self._matches(header):
+                    return header["index"] - 1, headers[i:]
+            fork = headers[-1]["index"]
+            headers = self.fetch_headers(peer, fork + 1)
+            if not headers:
+                return fork, []
+
+    def _matches(self, header):
+        chain = self.blockchain.chain
+        return chain.base <= header["index"] <= len(chain) and block_hash(header) == self.blockchain.hash(chain.get(header["index"]))
+
+    def _download(self, branch):
+        """
+        Fetch bodies in parallel and check them against the headers, their
+        links and signatures. Blocks are held back until they carry more work
+        than our blocks above the fork, then switched to in one step, so a
+        branch that fails part way never leaves us on a weaker prefix.
+        Blocks after that extend the new tip as they arrive.
+        """
+        peer, fork, headers = branch["peer"], branch["fork"], branch["headers"]
+        expected = {header["index"]: block_hash(header) for header in headers}
+        ranges = [(start, min(start + BLOCKS_PER_REQUEST - 1, headers[-1]["index"]))
+                  for start in range(fork + 1, headers[-1]["index"] + 1, BLOCKS_PER_REQUEST)]
+
+        chain = self.blockchain.chain
+        ours = sum(block_work(header) for header in chain.store.load_headers(fork + 1, len(chain)))
+        previous = chain.get(fork)
+        pending, work = [], 0
+        with ThreadPoolExecutor(self.workers) as executor:
+            for i in range(0, len(ranges), self.workers):
+                window = ranges[i:i + self.workers]
+                blocks = []
+                for batch in executor.map(lambda r: self.fetch_blocks(peer, *r), window):
+                    blocks += batch
+                if len(blocks) != window[-1][1] - window[0][0] + 1:
+                    raise SyncError(f"peer returned {len(blocks)} blocks for {window[0][0]}-{window[-1][1]}")
+                for block in blocks:
+                    if expected.get(block["index"]) != block_hash(block):
+                        raise SyncError(f"block {block['index']} does not match its header")
+                # Signature checks are the slow part and need no chain lock
+                errors = check_blocks((previous, blocks))
+                if errors:
+                    height, error = errors[0]
+                    raise SyncError(f"block {height}: {error}")
+                previous = blocks[-1]
+                pending += blocks
+                work += sum(block_work(block) for block in blocks)
+                if work > ours:
+                    self._apply(fork, pending)
+                    fork, pending, work, ours = pending[-1]["index"], [], 0, 0
+
+    def _apply(self, fork, blocks):
+        """Dry-run checked blocks on top of `fork` against the ledger and switch to them."""
+        blockchain = self.blockchain
+        with blockchain.lock:
+            # The chain may have moved while the blocks were fetched
+            if fork > len(blockchain.chain) or blockchain.hash(blockchain.chain.get(fork)) != blocks[0]["previous_hash"]:
+                raise SyncError(f"our block {fork} changed during sync")
+            removed = blockchain.chain[fork:]
+            if sum(block_work(block) for block in blocks) <= sum(block_work(block) for block in removed):
+                raise SyncError(f"branch above {fork} no longer has more work than ours")
+
+            # Dry-run the ledger: undo our blocks above the fork, then replay theirs
+            addresses = {address for block in removed + blocks for tx in block["transactions"]
+                         for address in (tx["sender"], tx["recipient"])}
+            balances = blockchain.db.get_balances(addresses)
+            for block in reversed(removed):
+                for tx in block["transactions"]:
+                    amount, fee = transaction_units(tx)
+                    if tx["sender"] != NETWORK:
+                        balances[tx["sender"]] = balances.get(tx["sender"], 0) + amount + fee
+                    balances[tx["recipient"]] = balances.get(tx["recipient"], 0) - amount
+            errors = replay_blocks(blocks, balances, self.reward)
+            errors += self._duplicates(removed, blocks)
+            if errors:
+                height, error = errors[0]
+                raise SyncError(f"block {height}: {error}")
+
+            blockchain.replace_blocks(fork, blocks)
+        logging.info(f"Chain synced to height {len(blockchain.chain)}")
+
+    def _duplicates(self, removed, blocks):
+        """
+        (height, error) pairs for transactions of `blocks` that repeat one
+        another or one confirmed below the fork, by transaction id or by
+        (sender, nonce). Confirmations in `removed` are released by the switch.
+        """
+        db = self.blockchain.db
+        released = set()
+        for block in removed:
+            for tx in block["transactions"]:
+                released.add(transaction_id(tx))
+                released.add((tx["sender"], transfer_nonce(tx)))
+        errors = []
+        seen = set()
+        for block in blocks:
+            for position, tx in enumerate(block["transactions"]):
+                tx_hash, nonce = transaction_id(tx), transfer_nonce(tx)
+                if tx_hash in seen or (tx_hash not in released and db.has_transaction(tx_hash)):
+                    errors.append((block["index"], f"Transaction {position} is already confirmed"))
+                elif nonce is not None and ((tx["sender"], nonce) in seen or
+                                            ((tx["sender"], nonce) not in released and db.has_nonce(tx["sender"], nonce))):
+                    errors.append((block["index"], f"Transaction {position} reuses a confirmed nonce"))
+                seen.add(tx_hash)
+                if nonce is not None:
+                    seen.add((tx["sender"], nonce))
+        return errors
@@ -0,0 +1,33 @@
+import os
+import sys
+import threading
+import pytest
+from werkzeug.serving import make_server
+
+# The node's modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from node import create_app
+from wallet import Wallet
+
+
+@pytest.fixture
+def nodes(tmp_path):
+    """Start writer apps on loopback ports, each with its own database. Returns a factory of (node, url)."""
+    servers = []
+
+    def start(name, **options):
+        app = create_app(db_name=str(tmp_path / f"{name}.db"), snapshot_dir=str(tmp_path / name), start=False, **options)
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return app.extensions["fartchan"], f"http://127.0.0.1:{server.server_port}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+@pytest.fixture
+def wallet():
+    return Wallet.from_keys({"private_key": os.urandom(32).hex()})
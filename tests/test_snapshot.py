@@ -0,0 +1,51 @@
+import pytest
+from blockchain import Blockchain, block_work
+from blockstore import BlockStore
+from retarget import Retarget
+from test_sync import address, mine, state
+from validation import validate_chain
+
+WINDOW = 3
+
+
+def fast_retarget(*nodes):
+    # Short intervals and a narrow window keep proof-of-work cheap while the prefix still matters
+    for node in nodes:
+        node.blockchain.retarget = Retarget(block_time=0.001, window=WINDOW)
+        node.blockchain.adjust_difficulty()
+
+
+@pytest.mark.parametrize("block_store", [False, True])
+def test_bootstrap_starts_at_snapshot_block(nodes, wallet, tmp_path, block_store):
+    a, a_url = nodes("a")
+    blocks = str(tmp_path / "b-blocks") if block_store else None
+    b, _ = nodes("b", block_dir=blocks)
+    fast_retarget(a, b)
+    mine(a, address(wallet))
+    a.blockchain.add_transaction(wallet.sign_transaction("bob", 3, fee=1))
+    for _ in range(6):
+        mine(a)
+    height = a.snapshots.write()["height"]
+    for _ in range(2):
+        mine(a)
+
+    assert b.snapshots.bootstrap(a.snapshots.path(height), b.peer_sync, a_url)["height"] == height
+    chain = b.blockchain.chain
+    assert (chain.base, len(chain)) == (height, height)
+    assert chain.store.load_base() == height
+    assert chain.load_headers(1, height) == a.blockchain.chain.load_headers(height - WINDOW, height)
+    assert chain.work() == sum(block_work(header) for header in a.blockchain.chain.load_headers(1, height))
+
+    b.peer_sync.add_peers([a_url])
+    assert b.peer_sync.sync_once()
+    assert state(b) == state(a)
+    assert chain.work() == a.blockchain.chain.work()
+    assert validate_chain(b.blockchain, processes=1)["valid"]
+
+    # The base and the prefix survive a restart
+    if block_store:
+        chain.store.close()
+    reopened = Blockchain(db=b.db, store=BlockStore(blocks) if block_store else None, retarget=Retarget(block_time=0.001, window=WINDOW))
+    assert (reopened.chain.base, reopened.chain.tip_hash) == (height, chain.tip_hash)
+    assert reopened.chain.work() == a.blockchain.chain.work()
+    assert reopened.target == a.blockchain.target
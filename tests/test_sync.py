@@ -0,0 +1,138 @@
+import pytest
+import sync
+from headers import block_hash
+from merkle import hash_transaction, merkle_root
+from retarget import target_to_hex
+from signatures import transaction_id
+from sync import SyncError
+
+REWARD = 50
+
+
+def address(wallet):
+    return wallet.public_key.to_string().hex()
+
+
+def mine(node, miner="miner"):
+    blockchain = node.blockchain
+    tip = blockchain.chain[-1]
+    return blockchain.create_block(blockchain.proof_of_work(tip["proof"]), blockchain.hash(tip), miner, REWARD)
+
+
+def forge(node, transactions, **fields):
+    """Mine a block over the tip and store it without applying it to the ledger, as a dishonest peer would."""
+    blockchain = node.blockchain
+    tip = blockchain.chain[-1]
+    block = {
+        "index": tip["index"] + 1,
+        "timestamp": "0",
+        "transactions": transactions,
+        "proof": blockchain.proof_of_work(tip["proof"]),
+        "previous_hash": blockchain.hash(tip),
+        "merkle_root": merkle_root([hash_transaction(tx) for tx in transactions]),
+        "target": target_to_hex(blockchain.target),
+        **fields
+    }
+    assert blockchain.chain.store.save_block(block, block_hash(block))
+    blockchain.chain.replace(tip["index"], [], [block])
+    blockchain.adjust_difficulty()
+    return block
+
+
+def state(node):
+    # Reverted blocks can leave zero balances behind
+    balances = {address: balance for address, balance in node.db.get_balances().items() if balance}
+    return node.blockchain.chain.tip_hash, balances
+
+
+def test_follows_branch_with_more_work(nodes, wallet):
+    a, a_url = nodes("a")
+    b, _ = nodes("b")
+    mine(a, address(wallet))
+    b.peer_sync.add_peers([a_url])
+    assert b.peer_sync.sync_once()
+
+    tx = wallet.sign_transaction("bob", 3, fee=1)
+    assert a.blockchain.add_transaction(tx)[1] is None
+    for _ in range(3):
+        mine(a)
+    mine(b, "other")  # Loses to the longer branch
+    assert b.peer_sync.sync_once()
+
+    assert state(b) == state(a)
+    assert b.db.get_balance("other") == 0
+    assert b.db.has_transaction(transaction_id(tx))
+
+
+def test_rejects_branch_replaying_confirmed_transaction(nodes, wallet):
+    a, a_url = nodes("a")
+    b, _ = nodes("b")
+    mine(a, address(wallet))
+    tx = wallet.sign_transaction("bob", 3)
+    a.blockchain.add_transaction(tx)
+    mine(a)
+    b.peer_sync.add_peers([a_url])
+    b.peer_sync.sync_once()
+    before = state(b)
+
+    # A longer branch that confirms the transaction a second time
+    forge(a, [tx])
+    forge(a, [])
+    with pytest.raises(SyncError, match="already confirmed"):
+        b.peer_sync.sync_once()
+    assert state(b) == before
+    assert len(b.blockchain.chain) == 3
+
+
+def test_branch_ends_at_first_invalid_header(nodes):
+    a, a_url = nodes("a")
+    b, _ = nodes("b")
+    for _ in range(2):
+        mine(a)
+    forge(a, [], target="f" * 64)  # Claims a target of its own choosing
+    mine(a)
+    b.peer_sync.add_peers([a_url])
+
+    assert b.peer_sync.sync_once()
+    assert len(b.blockchain.chain) == 3
+    assert b.blockchain.chain.tip_hash == a.blockchain.hash(a.blockchain.chain.get(3))
+
+
+def test_branch_is_capped_past_our_tip(nodes, monkeypatch):
+    a, a_url = nodes("a")
+    b, _ = nodes("b")
+    for _ in range(5):
+        mine(a)
+    monkeypatch.setattr(sync, "MAX_AHEAD", 2)
+    b.peer_sync.add_peers([a_url])
+
+    assert b.peer_sync.sync_once()
+    assert len(b.blockchain.chain) == 3
+    assert b.peer_sync.sync_once()
+    assert len(b.blockchain.chain) == 5
+    assert b.peer_sync.sync_once()
+    assert state(b) == state(a)
+
+
+def test_failed_branch_keeps_our_blocks(nodes, wallet, monkeypatch):
+    a, a_url = nodes("a")
+    b, _ = nodes("b")
+    mine(a, address(wallet))
+    b.peer_sync.add_peers([a_url])
+    b.peer_sync.sync_once()
+    for _ in range(2):
+        mine(b, "other")
+    before = state(b)
+
+    # Their branch has more work, but its second block carries a forged signature
+    mine(a)
+    tampered = dict(wallet.sign_transaction("bob", 3), amount=4)
+    forge(a, [tampered])
+    for _ in range(3):
+        mine(a)
+    monkeypatch.setattr(sync, "BLOCKS_PER_REQUEST", 1)
+    b.peer_sync.workers = 1
+
+    with pytest.raises(SyncError, match="Invalid signature"):
+        b.peer_sync.sync_once()
+    assert state(b) == before
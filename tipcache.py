@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import OrderedDict
+from metrics import Counter
+
+RESPONSE_CACHE_BYTES = 32 * 1024 * 1024  # Response bodies kept per app
+MAX_WAITERS = 32  # Requests allowed to wait for a block at once; each holds a server thread
+WAIT_POLL = 0.5  # Seconds between tip checks for waiters no block producer can wake (read-only workers)
+
+CACHE_LOOKUPS = Counter("fartchan_response_cache_total", "Read requests by cache outcome.", ["result"])
+
+
+class TipVersion:
+    """
+    What the read endpoints' answers depend on: the chain tip hash, the
+    ledger version (id of the newest transaction row, shared by every
+    process on the database) and, on a writer, a counter bumped with every
+    transaction the mempool accepts. Also lets up to `max_waiters` requests
+    at a time wait for the next block.
+    """
+
+    def __init__(self, blockchain, max_waiters=MAX_WAITERS):
+        self.blockchain = blockchain
+        self.ledger = blockchain.db.last_transaction_id() or 0
+        self.pending = 0
+        self.max_waiters = max_waiters
+        self._waiters = 0
+        self._changed = threading.Condition()
+        blockchain.block_listeners.append(self.notify_new_block)
+        blockchain.transaction_listeners.append(self.notify_transaction)
+
+    def notify_new_block(self, block):
+        ledger = self.blockchain.db.last_transaction_id()
+        with self._changed:
+            self.ledger = self.ledger if ledger is None else ledger
+            self._changed.notify_all()
+
+    def notify_transaction(self, tx_hash):
+        with self._changed:
+            self.pending += 1
+
+    def etag(self, pending=False):
+        """ETag for the current version; with `pending`, also for the current mempool."""
+        tag = f"{self.blockchain.chain.tip_hash[:16]}-{self.ledger}"
+        return f"{tag}-{self.pending}" if pending else tag
+
+    def wait_block(self, after, timeout, poll=None):
+        """
+        Block until the chain is higher than `after` or `timeout` seconds
+        pass. Returns True if it grew, False on timeout, or None without
+        waiting if max_waiters requests already are. With `poll`, the shared
+        store is also checked every `poll` seconds, for processes that do not mine or sync.
+        """
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            if len(self.blockchain.chain) > after:
+                return True
+            if self._waiters >= self.max_waiters:
+                return None
+            self._waiters += 1
+        try:
+            while True:
+                if poll:
+                    self.blockchain.refresh()
+                with self._changed:
+                    if len(self.blockchain.chain) > after:
+                        return True
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._changed.wait(min(remaining, poll) if poll else remaining)
+        finally:
+            with self._changed:
+                self._waiters -= 1
+
+
+class ResponseCache:
+    """
+    Bodies of recent read responses, keyed by request and tagged with the
+    ETag they were produced under. An entry is only served while its ETag is
+    current, and the whole cache is dropped with every new block.
+    """
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (etag, body, content type), least recently used first
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, etag):
+        """(body, content type) cached for a key under this ETag, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != etag:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1], entry[2]
+
+    def put(self, key, etag, body, content_type):
+        if len(body) > self.max_bytes // 8:
+            return  # Would crowd out everything else
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[1])
+            self._entries[key] = (etag, body, content_type)
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def notify_new_block(self, block):
+        self.clear()
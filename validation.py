@@ -0,0 +1,173 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from database import NETWORK, to_units, transaction_units
+from headers import block_hash, block_target, valid_proof
+from merkle import hash_transaction, merkle_root
+from retarget import target_to_hex
+from signatures import verify_transaction
+
+CHECKPOINT_KEY = "validation_checkpoint"
+CHUNK_SIZE = 256  # Blocks per worker task
+MAX_ERRORS = 100
+
+
+def check_blocks(args):
+    """
+    Checks hash linkage, proofs, Merkle roots and signatures for a run of
+    consecutive blocks. `previous` is the block before the run, or None when
+    the run starts at genesis. Runs in pool workers; returns (height, error) pairs.
+    """
+    previous, blocks = args
+    errors = []
+    for block in blocks:
+        height = block["index"]
+        if previous is None:
+            if height != 1 or block["previous_hash"] != "0":
+                errors.append((height, "Chain does not start with a genesis block"))
+        else:
+            if height != previous["index"] + 1:
+                errors.append((height, f"Expected height {previous['index'] + 1}"))
+            if block["previous_hash"] != block_hash(previous):
+                errors.append((height, "previous_hash does not match the previous block"))
+            # Blocks written before difficulty was recorded cannot have their proof re-checked
+            target = block_target(block)
+            if target is not None and not valid_proof(previous["proof"], block["proof"], target):
+                errors.append((height, "Invalid proof of work"))
+            if "target" in previous and "target" not in block:
+                errors.append((height, "Block does not record its target"))
+
+        root = merkle_root([hash_transaction(tx) for tx in block["transactions"]])
+        if root is None or block.get("merkle_root") != root:
+            errors.append((height, "merkle_root does not match the transactions"))
+        for position, tx in enumerate(block["transactions"]):
+            if tx["sender"] != NETWORK and not verify_transaction(tx):
+                errors.append((height, f"Invalid signature on transaction {position}"))
+        previous = block
+    return errors
+
+
+def check_targets(retarget, history, headers):
+    """
+    Checks that every header recording a target carries the one the retarget
+    engine picks from the blocks before it. `history` holds the headers just
+    below headers[0] (the last retarget.window + 1 are used). Returns
+    (height, error) pairs.
+    """
+    errors = []
+    keep = retarget.window + 1
+    window = list(history[-keep:])
+    for header in headers:
+        if "target" in header:
+            expected = retarget.next_target(window)
+            if int(header["target"], 16) != expected:
+                errors.append((header["index"], f"Target does not match the retarget, expected {target_to_hex(expected)}"))
+        window.append(header)
+        del window[:-keep]
+    return errors
+
+
+def replay_blocks(blocks, balances, reward=None):
+    """
+    Applies block transactions to `balances` (base units) in order; returns
+    (height, error) pairs for invalid amounts, overspends and oversized rewards.
+    """
+    errors = []
+    for block in blocks:
+        height = block["index"]
+        units = [transaction_units(tx) for tx in block["transactions"]]
+        fees = sum(fee or 0 for _, fee in units)
+        for position, (tx, (amount, fee)) in enumerate(zip(block["transactions"], units)):
+            sender, recipient = tx["sender"], tx["recipient"]
+            if amount is None or amount <= 0 or fee is None or fee < 0:
+                errors.append((height, f"Invalid amount in transaction {position}"))
+                continue
+            if sender == NETWORK:
+                if position != 0:
+                    errors.append((height, f"Reward transaction {position} is not first in the block"))
+                if reward is not None and amount > to_units(reward) + fees:
+                    errors.append((height, f"Reward {tx['amount']} exceeds {reward} plus fees"))
+            else:
+                if balances.get(sender, 0) < amount + fee:
+                    errors.append((height, f"Transaction {position} overspends {sender}"))
+                balances[sender] = balances.get(sender, 0) - amount - fee
+            balances[recipient] = balances.get(recipient, 0) + amount
+    return errors
+
+
+def _load_checkpoint(blockchain):
+    checkpoint = blockchain.db.get_meta(CHECKPOINT_KEY)
+    if not checkpoint or not blockchain.chain.base <= checkpoint["height"] <= len(blockchain.chain):
+        return None
+    # Only trust the checkpoint if that block is still part of our chain
+    if blockchain.hash(blockchain.chain.get(checkpoint["height"])) != checkpoint["hash"]:
+        return None
+    return checkpoint
+
+
+def validate_chain(blockchain, reward=None, processes=None, use_checkpoint=True, save_checkpoint=True):
+    """
+    Validates the stored chain. Header and signature checks run in parallel
+    chunks on a process pool while targets are checked and the ledger is
+    replayed sequentially in this process. Validation resumes from the last checkpoint, so re-checking
+    after a restart only covers blocks added since. Returns a summary dict.
+    """
+    store = blockchain.chain.store
+    tip = len(blockchain.chain)
+    checkpoint = _load_checkpoint(blockchain) if use_checkpoint else None
+    if checkpoint:
+        start = checkpoint["height"] + 1
+        balances = dict(checkpoint["balances"])
+        previous = blockchain.chain.get(checkpoint["height"])
+    else:
+        # A chain bootstrapped from a snapshot fails here, since only its checkpoint vouches for the blocks below the base
+        start, balances, previous = blockchain.chain.base, {}, None
+
+    retarget = blockchain.retarget
+    history = blockchain.chain.load_headers(max(1, start - retarget.window - 1), start - 1)
+
+    processes = processes or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(processes) if processes > 1 and tip - start >= CHUNK_SIZE else None
+    futures = []
+    errors = []
+    try:
+        for first in range(start, tip + 1, CHUNK_SIZE):
+            blocks = store.load_blocks(first, min(first + CHUNK_SIZE - 1, tip))
+            if executor is not None:
+                futures.append(executor.submit(check_blocks, (previous, blocks)))
+            else:
+                errors += check_blocks((previous, blocks))
+            errors += check_targets(retarget, history, blocks)
+            errors += replay_blocks(blocks, balances, reward)
+            history = (history + blocks)[-retarget.window - 1:]
+            previous = blocks[-1] if blocks else previous
+        for future in futures:
+            errors += future.result()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    # The materialized balances must match the replayed ledger
+    stored = blockchain.db.get_balances()
+    for address in set(stored) | set(balances):
+        if stored.get(address, 0) != balances.get(address, 0):
+            errors.append((tip, f"Stored balance for {address} does not match the ledger"))
+
+    errors.sort()
+    valid = not errors
+    if valid and save_checkpoint and tip >= start:
+        blockchain.db.set_meta(CHECKPOINT_KEY, {
+            "height": tip,
+            "hash": blockchain.hash(blockchain.chain.get(tip)),
+            "balances": balances
+        })
+    if not valid:
+        logging.warning(f"Chain validation failed with {len(errors)} errors")
+
+    return {
+        "valid": valid,
+        "height": tip,
+        "checked_from": start,
+        "blocks_checked": tip - start + 1,
+        "errors": [{"height": height, "error": error} for height, error in errors[:MAX_ERRORS]]
+    }
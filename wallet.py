@@ -1,8 +1,13 @@
 import os
 import json
-import sqlite3
 import time
+import hashlib
 from ecdsa import SigningKey, SECP256k1
+from ecdsa.util import sigencode_string_canonize
+from database import get_pool
+from signatures import transaction_message
+
+INDEX_FILE = ".wallet_index.json"  # Public keys of the wallet files in a directory, by file mtime
 
 class Wallet:
     def __init__(self, filename=None, db_name="blockchain.db"):
@@ -43,6 +48,15 @@ class Wallet:
         print(f"\nLoaded Wallet: {filename}")
         print(f"Public Key: {self.public_key.to_string().hex()}")
 
+    @classmethod
+    def from_keys(cls, keys):
+        """ Build a wallet from loaded keys without printing, saving or registering anything. """
+        self = cls.__new__(cls)
+        self.db_name = None
+        self.private_key = SigningKey.from_string(bytes.fromhex(keys["private_key"]), curve=SECP256k1)
+        self.public_key = self.private_key.get_verifying_key()
+        return self
+
     @staticmethod
     def load_keys(filename):
         """ Load keys from a given wallet file. """
@@ -53,22 +67,110 @@ class Wallet:
         with open(filename, "r") as f:
             return json.load(f)
 
+    def sign_transaction(self, recipient, amount, fee=0, nonce=None):
+        """ Build a transaction from this wallet and sign it with its private key. """
+        tx = {
+            "sender": self.public_key.to_string().hex(),
+            "recipient": recipient,
+            "amount": amount,
+            "fee": fee,
+            "nonce": time.time_ns() if nonce is None else nonce  # Makes every signed transfer unique
+        }
+        # Low-s encoding: nodes reject the malleated (n - s) form of a signature
+        signature = self.private_key.sign_deterministic(
+            transaction_message(tx), hashfunc=hashlib.sha256, sigencode=sigencode_string_canonize
+        )
+        tx["signature"] = signature.hex()
+        return tx
+
     def register_wallet(self):
         """ Store the wallet in the database. """
         public_key_hex = self.public_key.to_string().hex()
-        with sqlite3.connect(self.db_name) as conn:
+        with get_pool(self.db_name).connection() as conn:
             cursor = conn.cursor()
             cursor.execute("INSERT OR IGNORE INTO wallets (public_key) VALUES (?)", (public_key_hex,))
-            conn.commit()
 
     @staticmethod
     def list_wallets(db_name="blockchain.db"):
         """ List all registered wallets. """
-        with sqlite3.connect(db_name) as conn:
+        with get_pool(db_name).connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT public_key FROM wallets")
             wallets = cursor.fetchall()
             return [wallet[0] for wallet in wallets]
 
+class WalletIndex:
+    """
+    Resolves wallet files in a directory by filename or public key. Public
+    keys are cached in INDEX_FILE next to the wallets, keyed by file mtime,
+    so a wallet's JSON is only parsed again when the file changes, and
+    signing keys are loaded at most once per process.
+    """
+
+    def __init__(self, directory="."):
+        self.directory = directory
+        self._entries = None  # filename -> {"mtime": ..., "public_key": ...}
+        self._by_address = {}  # public key -> filename
+        self._wallets = {}  # filename -> Wallet
+
+    def _index(self):
+        if self._entries is not None:
+            return self._entries
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        try:
+            with open(index_path, "r") as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            stored = {}
+
+        entries = {}
+        for name in sorted(os.listdir(self.directory)):
+            if not (name.startswith("wallet_") and name.endswith(".json")):
+                continue
+            path = os.path.join(self.directory, name)
+            mtime = os.stat(path).st_mtime
+            entry = stored.get(name)
+            if not isinstance(entry, dict) or entry.get("mtime") != mtime:
+                try:
+                    with open(path, "r") as f:
+                        entry = {"mtime": mtime, "public_key": json.load(f)["public_key"]}
+                except (OSError, ValueError, KeyError):
+                    continue  # Not a wallet file
+            entries[name] = entry
+
+        if entries != stored:
+            try:
+                with open(index_path, "w") as f:
+                    json.dump(entries, f)
+            except OSError:
+                pass  # A read-only directory only costs re-parsing next time
+        self._entries = entries
+        self._by_address = {entry["public_key"]: name for name, entry in entries.items()}
+        return entries
+
+    def files(self):
+        """ Wallet filenames in the directory, sorted. """
+        return list(self._index())
+
+    def address(self, name):
+        """ Public key of a wallet file. """
+        return self._index()[name]["public_key"]
+
+    def find(self, name_or_address):
+        """ The wallet filename for a filename, path or public key, or None. """
+        entries = self._index()
+        name = os.path.basename(name_or_address)
+        return name if name in entries else self._by_address.get(name_or_address)
+
+    def wallet(self, name_or_address):
+        """ The signing wallet for a filename or public key. Raises KeyError if there is none. """
+        name = self.find(name_or_address)
+        if name is None:
+            raise KeyError(name_or_address)
+        if name not in self._wallets:
+            with open(os.path.join(self.directory, name), "r") as f:
+                self._wallets[name] = Wallet.from_keys(json.load(f))
+        return self._wallets[name]
+
 if __name__ == "__main__":
     wallet = Wallet()
\ No newline at end of file